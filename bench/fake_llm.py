@@ -0,0 +1,153 @@
+# MCP\bench\fake_llm.py
+"""本地的OpenAI兼容流式接口，代替SiliconFlow做离线压测
+
+- 按固定速率逐token输出（每个token一个字符，便于客户端按字符数统计token速率）；
+- 可注入首token延迟和错误（429/500）；
+- 工具调用由脚本决定：查询命中规则的关键词时，第一轮返回规则里的工具调用，拿到工具结果后再生成回答。
+
+脚本文件格式（JSON）：
+{"rules": [{"match": "天气", "tool_calls": [{"name": "get_forecast", "arguments": {"latitude": 39.9, "longitude": 116.4}}]}]}
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+DEFAULT_SCRIPT = {
+    "rules": [
+        {"match": "天气", "tool_calls": [{"name": "get_forecast", "arguments": {"latitude": 39.9, "longitude": 116.4}}]},
+        {"match": "警报", "tool_calls": [{"name": "get_alerts", "arguments": {"state": "CA"}}]},
+        {"match": "搜索", "tool_calls": [{"name": "web_search", "arguments": {"query": "压测"}}]}
+    ]
+}
+
+
+class FakeLLM:
+    def __init__(self, token_rate: float, reply_tokens: int, ttft: float, jitter: float,
+                 error_rate: float, rate_limit_rate: float, script: Dict[str, Any]):
+        self.token_interval = 1 / token_rate if token_rate > 0 else 0.0
+        self.reply_tokens = reply_tokens
+        self.ttft = ttft
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rules = script.get("rules", [])
+        # 统计计数
+        self.requests = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+
+    def plan_tool_calls(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """最后一条消息是用户查询、且提供了工具时，按脚本决定是否调用工具"""
+        messages = payload.get("messages", [])
+        if not messages or messages[-1].get("role") != "user" or payload.get("tool_choice") == "none":
+            return []
+        offered = {tool["function"]["name"] for tool in payload.get("tools") or []}
+        query = messages[-1].get("content") or ""
+        for rule in self.rules:
+            if rule.get("match", "") in query:
+                return [call for call in rule.get("tool_calls", []) if call["name"] in offered]
+        return []
+
+    @staticmethod
+    def chunk(completion_id: str, delta: Dict[str, Any], finish_reason=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream(self, payload: Dict[str, Any]):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(max(self.ttft + random.uniform(-self.jitter, self.jitter), 0.0))
+            tool_calls = self.plan_tool_calls(payload)
+            if tool_calls:
+                for index, call in enumerate(tool_calls):
+                    arguments = json.dumps(call.get("arguments", {}), ensure_ascii=False)
+                    # 名称和参数分成两段发送，和真实接口一样需要客户端拼接
+                    yield self.chunk(completion_id, {"tool_calls": [{
+                        "index": index, "id": f"call_{uuid.uuid4().hex[:8]}", "type": "function",
+                        "function": {"name": call["name"], "arguments": ""}}]})
+                    yield self.chunk(completion_id, {"tool_calls": [{
+                        "index": index, "function": {"arguments": arguments}}]})
+                yield self.chunk(completion_id, {}, "tool_calls")
+            else:
+                for _ in range(self.reply_tokens):
+                    yield self.chunk(completion_id, {"content": "测"})
+                    if self.token_interval:
+                        await asyncio.sleep(self.token_interval)
+                yield self.chunk(completion_id, {}, "stop")
+            yield "data: [DONE]\n\n"
+        finally:
+            self.active -= 1
+
+    async def completions(self, request: Request):
+        payload = await request.json()
+        self.requests += 1
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "rate limited"}}, status_code=429, headers={"Retry-After": "1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "injected error"}}, status_code=500)
+        return StreamingResponse(self.stream(payload), media_type="text/event-stream")
+
+    async def models(self, request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "fake", "object": "model"}]})
+
+    async def stats(self, request: Request):
+        return JSONResponse({
+            "requests": self.requests,
+            "errors": self.errors,
+            "active": self.active,
+            "max_active": self.max_active
+        })
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/v1/chat/completions", self.completions, methods=["POST"]),
+            Route("/v1/models", self.models),
+            Route("/stats", self.stats)
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容流式接口（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8199)
+    parser.add_argument("--token-rate", type=float, default=50, help="每秒输出的token数，0表示不限速")
+    parser.add_argument("--reply-tokens", type=int, default=100, help="每个回答的token数")
+    parser.add_argument("--ttft", type=float, default=0.3, help="首token延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="首token延迟的随机抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的请求比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回429的请求比例")
+    parser.add_argument("--script", help="工具调用脚本（JSON文件），默认见DEFAULT_SCRIPT")
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    fake = FakeLLM(args.token_rate, args.reply_tokens, args.ttft, args.jitter,
+                   args.error_rate, args.rate_limit_rate, script)
+    uvicorn.run(fake.app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# MCP\bench\loadgen.py
+"""WebSocket压测客户端：N个并发会话，每个会话依次发送若干查询，记录每轮的时延指标
+
+一轮查询的结束：收到error或end（带工具调用的中间轮次以round_end分隔，不是查询的结束）。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Optional, List, Dict, Any
+
+import websockets
+
+
+class TurnResult:
+    def __init__(self, session: int, query: str):
+        self.session = session
+        self.query = query
+        self.started = time.monotonic()
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.chars = 0
+        self.error: Optional[str] = None
+        self.tool_started: Dict[str, float] = {}
+        self.tool_latencies: List[float] = []
+        self.tool_errors = 0
+        self.tool_progress_events = 0
+        self.queued_events = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        ttft = self.first_token - self.started if self.first_token is not None else None
+        streaming = (self.last_token - self.first_token) if self.first_token is not None else 0.0
+        return {
+            "session": self.session,
+            "query": self.query,
+            "ttft": ttft,
+            "latency": self.finished - self.started if self.finished is not None else None,
+            "chars": self.chars,
+            # 假模型每个token一个字符，首尾token之间的速率即token速率
+            "tokens_per_sec": (self.chars - 1) / streaming if streaming > 0 else None,
+            "tool_latencies": self.tool_latencies,
+            "tool_errors": self.tool_errors,
+            "tool_progress_events": self.tool_progress_events,
+            "queued_events": self.queued_events,
+            "error": self.error
+        }
+
+
+async def run_turn(websocket, session: int, query: str, timeout: float) -> TurnResult:
+    result = TurnResult(session, query)
+    await websocket.send(json.dumps({"type": "query", "data": query}, ensure_ascii=False))
+    try:
+        async with asyncio.timeout(timeout):
+            while True:
+                event = json.loads(await websocket.recv())
+                now = time.monotonic()
+                event_type = event.get("type")
+                if event_type == "text_chunk" and event.get("data"):
+                    if result.first_token is None:
+                        result.first_token = now
+                    result.last_token = now
+                    result.chars += len(event["data"])
+                elif event_type == "tool_call_delta":
+                    phase = event.get("phase")
+                    if phase == "start":
+                        result.tool_started[event["id"]] = now
+                    elif phase == "progress":
+                        result.tool_progress_events += 1
+                    elif phase in ("result", "error"):
+                        started = result.tool_started.pop(event["id"], None)
+                        if started is not None:
+                            result.tool_latencies.append(now - started)
+                        if phase == "error":
+                            result.tool_errors += 1
+                elif event_type == "queued":
+                    result.queued_events += 1
+                elif event_type == "error":
+                    result.error = str(event.get("data"))
+                    break
+                elif event_type == "end":
+                    break
+    except TimeoutError:
+        result.error = f"超过{timeout}秒未完成"
+    result.finished = time.monotonic()
+    return result
+
+
+async def run_session(url: str, session: int, queries: List[str], turns: int, timeout: float,
+                      think_time: float) -> List[TurnResult]:
+    results = []
+    async with websockets.connect(url, max_size=None) as websocket:
+        # 跳过连接时的session/system事件
+        while True:
+            event = json.loads(await websocket.recv())
+            if event.get("type") == "system" and "可用工具" in str(event.get("data")):
+                break
+        for turn in range(turns):
+            results.append(await run_turn(websocket, session, queries[(session + turn) % len(queries)], timeout))
+            if think_time:
+                await asyncio.sleep(think_time)
+    return results
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    values = [value for value in values if value is not None]
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None
+    }
+
+
+def summarize(turns: List[Dict[str, Any]], wall_time: float) -> Dict[str, Any]:
+    ok = [turn for turn in turns if turn["error"] is None]
+    return {
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "wall_time": wall_time,
+        "throughput_turns_per_sec": len(ok) / wall_time if wall_time > 0 else None,
+        "ttft": distribution([turn["ttft"] for turn in ok]),
+        "latency": distribution([turn["latency"] for turn in ok]),
+        "tokens_per_sec": distribution([turn["tokens_per_sec"] for turn in ok]),
+        "tool_latency": distribution([latency for turn in turns for latency in turn["tool_latencies"]]),
+        "tool_errors": sum(turn["tool_errors"] for turn in turns),
+        "queued_turns": sum(1 for turn in turns if turn["queued_events"])
+    }
+
+
+async def run_load(url: str, sessions: int, turns: int, queries: List[str], timeout: float = 120,
+                   think_time: float = 0.0, ramp_up: float = 0.0) -> Dict[str, Any]:
+    """运行压测，返回 {"summary", "turns"}"""
+
+    async def start(session: int):
+        if ramp_up:
+            await asyncio.sleep(ramp_up * session / sessions)
+        return await run_session(url, session, queries, turns, timeout, think_time)
+
+    started = time.monotonic()
+    outcomes = await asyncio.gather(*(start(session) for session in range(sessions)), return_exceptions=True)
+    wall_time = time.monotonic() - started
+    turns_data = []
+    connect_errors = []
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            connect_errors.append(repr(outcome))
+        else:
+            turns_data.extend(result.to_dict() for result in outcome)
+    summary = summarize(turns_data, wall_time)
+    summary["session_errors"] = connect_errors
+    return {"summary": summary, "turns": turns_data}
+
+
+DEFAULT_QUERIES = ["你好，介绍一下你自己", "北京明天天气怎么样", "加州有什么警报", "帮我搜索一下最新新闻"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket压测客户端")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的查询数")
+    parser.add_argument("--timeout", type=float, default=120, help="单轮查询超时（秒）")
+    parser.add_argument("--think-time", type=float, default=0.0, help="同一会话两次查询之间的间隔（秒）")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="在这段时间内逐步建立会话（秒）")
+    parser.add_argument("--queries", help="查询文件，每行一个，默认见DEFAULT_QUERIES")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    report = asyncio.run(run_load(args.url, args.sessions, args.turns, queries,
+                                  args.timeout, args.think_time, args.ramp_up))
+    print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
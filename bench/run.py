@@ -0,0 +1,284 @@
+# MCP\bench\run.py
+"""离线压测入口：启动假模型、桩工具服务器和web.py，跑一轮WebSocket压测并把结果存成JSON
+
+示例：
+    python run.py --sessions 20 --turns 5 --token-rate 80
+    python run.py --sessions 20 --compare results/baseline.json
+    python run.py --env MCP_POOL_MAX_SIZE=8 --env LLM_MAX_CONCURRENCY=16
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, List, Dict, Any
+
+import httpx
+
+from loadgen import run_load, DEFAULT_QUERIES
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(BENCH_DIR, "..", "mcp-client")
+SAMPLE_INTERVAL = 0.5  # 资源采样间隔（秒）
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port: int, process: subprocess.Popen, timeout: float = 60):
+    """等待服务开始监听（uvicorn在lifespan启动完成后才监听端口）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程提前退出: {process.args}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f"端口{port}在{timeout}秒内没有开始监听")
+
+
+def _children() -> Dict[int, List[int]]:
+    """pid -> 子进程列表（读取/proc，仅Linux）"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # 进程名可能含空格，取最后一个右括号之后的字段
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    return children
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def sample_process_tree(pid: int) -> Dict[str, int]:
+    """web进程的RSS，以及它的子进程（工具服务器）数量和RSS总和"""
+    if not os.path.isdir("/proc"):
+        return {"rss": 0, "subprocesses": 0, "subprocess_rss": 0}
+    children = _children()
+    descendants = []
+    stack = list(children.get(pid, []))
+    while stack:
+        child = stack.pop()
+        descendants.append(child)
+        stack.extend(children.get(child, []))
+    return {
+        "rss": _rss(pid),
+        "subprocesses": len(descendants),
+        "subprocess_rss": sum(_rss(child) for child in descendants)
+    }
+
+
+class ResourceSampler:
+    """压测期间周期性采样web进程树的内存和子进程数"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.samples: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        started = time.monotonic()
+        while True:
+            sample = await asyncio.to_thread(sample_process_tree, self.pid)
+            sample["t"] = round(time.monotonic() - started, 2)
+            self.samples.append(sample)
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self, baseline: Dict[str, int], sessions: int) -> Dict[str, Any]:
+        peak_rss = max((sample["rss"] for sample in self.samples), default=baseline["rss"])
+        return {
+            "baseline_rss": baseline["rss"],
+            "peak_rss": peak_rss,
+            "rss_per_session": (peak_rss - baseline["rss"]) / sessions if sessions else None,
+            "baseline_subprocesses": baseline["subprocesses"],
+            "peak_subprocesses": max((sample["subprocesses"] for sample in self.samples),
+                                     default=baseline["subprocesses"]),
+            "peak_subprocess_rss": max((sample["subprocess_rss"] for sample in self.samples),
+                                       default=baseline["subprocess_rss"]),
+            "samples": self.samples
+        }
+
+
+# 对比时关注的指标：(路径, 数值越大越好)
+COMPARED_METRICS = [
+    ("summary.ttft.p50", False), ("summary.ttft.p95", False), ("summary.ttft.p99", False),
+    ("summary.latency.p50", False), ("summary.latency.p95", False), ("summary.latency.p99", False),
+    ("summary.tokens_per_sec.p50", True), ("summary.tool_latency.p50", False),
+    ("summary.tool_latency.p95", False), ("summary.throughput_turns_per_sec", True),
+    ("summary.errors", False), ("resources.rss_per_session", False), ("resources.peak_subprocesses", False)
+]
+
+
+def lookup(report: Dict[str, Any], path: str):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """打印与基线的对比，返回变差超过threshold（比例）的指标"""
+    regressions = []
+    print(f"{'指标':<36}{'基线':>14}{'本次':>14}{'变化':>10}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline, path), lookup(current, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        worse = -change if higher_is_better else change
+        mark = " !" if worse > threshold else ""
+        print(f"{path:<36}{old:>14.4g}{new:>14.4g}{change:>+10.1%}{mark}")
+        if worse > threshold:
+            regressions.append(path)
+    return regressions
+
+
+async def bench(args) -> Dict[str, Any]:
+    llm_port = free_port()
+    web_port = args.port or free_port()
+    workdir = tempfile.mkdtemp(prefix="mcp-bench-")
+    os.makedirs(os.path.join(workdir, "static"), exist_ok=True)  # web.py挂载的静态目录
+
+    llm_command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_llm.py"), "--port", str(llm_port),
+        "--token-rate", str(args.token_rate), "--reply-tokens", str(args.reply_tokens),
+        "--ttft", str(args.ttft), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate)
+    ]
+    if args.script:
+        llm_command += ["--script", os.path.abspath(args.script)]
+
+    env = dict(os.environ)
+    env.update({
+        "LLM_API_BASE": f"http://127.0.0.1:{llm_port}/v1",
+        "LLM_ENDPOINTS": "",
+        "LLM_MODEL": "fake",
+        "SILICONFLOW_API_KEY": "bench",
+        "MCP_TOOL_SERVERS": os.path.join(BENCH_DIR, "stub_tools.py"),
+        "MCP_SESSION_DB": os.path.join(workdir, "sessions.sqlite3"),
+        "MCP_TOOL_MANIFEST": os.path.join(workdir, "tool_manifest.json"),
+        "BENCH_TOOL_LATENCY": str(args.tool_latency)
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    web_command = [sys.executable, "-m", "uvicorn", "web:app", "--app-dir", os.path.abspath(CLIENT_DIR),
+                   "--host", "127.0.0.1", "--port", str(web_port), "--log-level", "warning"]
+
+    processes = []
+    try:
+        llm = subprocess.Popen(llm_command, cwd=workdir)
+        processes.append(llm)
+        wait_port(llm_port, llm)
+        web = subprocess.Popen(web_command, cwd=workdir, env=env)
+        processes.append(web)
+        wait_port(web_port, web)
+
+        baseline = sample_process_tree(web.pid)
+        sampler = ResourceSampler(web.pid)
+        sampler.start()
+        queries = DEFAULT_QUERIES
+        if args.queries:
+            with open(args.queries, "r", encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        report = await run_load(f"ws://127.0.0.1:{web_port}/ws", args.sessions, args.turns, queries,
+                                args.timeout, args.think_time, args.ramp_up)
+        await sampler.stop()
+        async with httpx.AsyncClient() as http:
+            upstream = (await http.get(f"http://127.0.0.1:{llm_port}/stats")).json()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "summary": report["summary"],
+        "resources": sampler.summary(baseline, args.sessions),
+        "upstream": upstream,
+        "turns": report["turns"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线压测：假模型 + 桩工具 + WebSocket并发会话")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的查询数")
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--ramp-up", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120, help="单轮查询超时（秒）")
+    parser.add_argument("--queries", help="查询文件，每行一个")
+    parser.add_argument("--token-rate", type=float, default=50, help="假模型每秒输出的token数")
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    parser.add_argument("--ttft", type=float, default=0.3, help="假模型的首token延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--script", help="假模型的工具调用脚本（JSON）")
+    parser.add_argument("--tool-latency", type=float, default=0.2, help="桩工具的调用延迟（秒）")
+    parser.add_argument("--env", action="append", default=[], help="传给web.py的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--port", type=int, help="web.py的端口，默认随机")
+    parser.add_argument("--output", help="结果JSON文件，默认 results/bench-<时间>.json")
+    parser.add_argument("--compare", help="与之对比的基线结果JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时视为退化的变化比例")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    output = args.output or os.path.join(BENCH_DIR, "results", f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    summary = dict(result["summary"], resources={
+        key: value for key, value in result["resources"].items() if key != "samples"})
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"结果已保存: {output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), result, args.threshold)
+        if regressions:
+            print(f"退化的指标: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
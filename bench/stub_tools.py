@@ -0,0 +1,91 @@
+# MCP\bench\stub_tools.py
+"""与weather/websearch同名的桩工具服务器：不访问外部API，按配置的延迟返回固定大小的结果
+
+通过环境变量调整：
+BENCH_TOOL_LATENCY      每次调用的延迟（秒）
+BENCH_TOOL_RESULT_BYTES 结果大小（字节）
+BENCH_TOOL_PROGRESS     web_search在延迟期间分几段发送progress通知（0表示不发送）
+"""
+import asyncio
+import os
+import sys
+
+from mcp import types
+from mcp.server.fastmcp import Context, FastMCP
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import serve  # noqa: E402  与真实工具服务器共用命令行入口（stdio或streamable-http）
+import spans  # noqa: E402  与真实工具服务器一样随结果返回内部耗时片段
+
+TOOL_LATENCY = float(os.getenv("BENCH_TOOL_LATENCY", "0.2"))
+RESULT_BYTES = int(os.getenv("BENCH_TOOL_RESULT_BYTES", "2000"))
+PROGRESS_STEPS = int(os.getenv("BENCH_TOOL_PROGRESS", "4"))
+
+mcp = FastMCP("stub")
+
+
+def payload(label: str) -> str:
+    return (label + "\n" + "x" * RESULT_BYTES)[:RESULT_BYTES]
+
+
+@mcp.tool()
+@spans.traced
+async def get_alerts(state: str) -> str:
+    """获取美国州的天气警报（桩）
+
+    Args:
+        state: 两个字母的美国州代码（例如 CA, NY）
+    """
+    with spans.span("upstream", state=state):
+        await asyncio.sleep(TOOL_LATENCY)
+    return payload(f"{state} 警报")
+
+
+@mcp.tool()
+@spans.traced
+async def get_forecast(latitude: float, longitude: float) -> str:
+    """获取位置的天气预报（桩）
+
+    Args:
+        latitude: 纬度
+        longitude: 经度
+    """
+    with spans.span("upstream"):
+        await asyncio.sleep(TOOL_LATENCY)
+    return payload(f"{latitude},{longitude} 天气预报")
+
+
+@mcp.tool()
+@spans.traced
+async def web_search(query: str, ctx: Context) -> str:
+    """搜索网络资料（桩），请求带progressToken时分段发送部分结果
+
+    Args:
+        query: 搜索查询内容
+    """
+    result = payload(f"{query} 搜索结果")
+    meta = ctx.request_context.meta
+    token = meta.progressToken if meta else None
+    if token is None or PROGRESS_STEPS <= 0:
+        await asyncio.sleep(TOOL_LATENCY)
+        return result
+    step = -(-len(result) // PROGRESS_STEPS)
+    for index in range(PROGRESS_STEPS):
+        await asyncio.sleep(TOOL_LATENCY / PROGRESS_STEPS)
+        part = result[index * step:(index + 1) * step]
+        notification = types.ProgressNotification(
+            method="notifications/progress",
+            params=types.ProgressNotificationParams(
+                progressToken=token, progress=min((index + 1) * step, len(result)), message=part)
+        )
+        await ctx.request_context.session.send_notification(
+            types.ServerNotification(notification), related_request_id=ctx.request_id)
+    return result
+
+
+def http_app():
+    return serve.http_app(mcp)
+
+
+if __name__ == "__main__":
+    serve.run(mcp, "stub_tools:http_app", default_port=8111)
@@ -0,0 +1,305 @@
+# MCP\mcp-client\batch.py
+"""批量模式：从JSONL文件（或标准输入）读取查询，每个查询作为独立的对话运行，结果以JSONL输出
+
+所有对话共享工具服务器会话池、工具结果缓存、上游连接池和调度器，并发对话数由 --workers 限制。
+输入每行一个JSON对象：
+    {"id": "q1", "query": "北京明天天气怎么样"}
+    {"id": "q2", "query": ["加州有什么警报", "那纽约呢"]}     # 同一对话中依次提问
+    {"request_id": "user-001", "title": "...", "body": "..."}   # requests.jsonl格式，title和body作为查询
+非JSON的行整行作为查询，id为它在输入中的序号（从0开始，不计空行）。
+
+示例：
+    python batch.py queries.jsonl -o results.jsonl --workers 8
+    cat queries.jsonl | python batch.py - -o results.jsonl --order completion --queries-per-minute 60
+输出文件已存在时跳过其中已有结果的查询（中断后用同样的命令继续），--retry-errors 重跑出错的查询。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import aclosing
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from cache import ToolResultCache
+from client import MCPClient
+from pool import ToolPoolManager, tool_servers
+from scheduler import LLMScheduler, MAX_CONCURRENCY, TOKENS_PER_MINUTE
+from tracing import start_trace
+from upstream import aclose_http_client
+
+BATCH_WORKERS = int(os.getenv("MCP_BATCH_WORKERS", "4"))  # 同时进行的对话数
+BATCH_TIMEOUT = float(os.getenv("MCP_BATCH_TIMEOUT", "300"))  # 单个对话的超时（秒）
+TOOL_RESULT_CHARS = 1000  # 输出中每个工具结果保留的字符数
+
+
+class BatchItem:
+    def __init__(self, index: int, item_id: str, queries: List[str]):
+        self.index = index  # 在输入中的序号，按输入顺序输出时使用
+        self.id = item_id
+        self.queries = queries
+
+
+def parse_item(index: int, line: str) -> Optional[BatchItem]:
+    """解析一行输入；空行返回None"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        record = None
+    if not isinstance(record, dict):
+        return BatchItem(index, str(index), [line])
+    item_id = str(record.get("id") or record.get("request_id") or index)
+    query = record.get("query") or record.get("data")
+    if query is None:
+        query = "\n\n".join(str(record[key]) for key in ("title", "body") if record.get(key))
+    queries = [str(q) for q in query] if isinstance(query, list) else [str(query)]
+    return BatchItem(index, item_id, [q for q in queries if q.strip()])
+
+
+def read_lines(path: str) -> Iterator[str]:
+    if path == "-":
+        yield from sys.stdin
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from f
+
+
+def load_done(path: Optional[str], retry_errors: bool) -> set:
+    """已有输出中完成的id；进程被强制结束时最后一行可能只写了一半，截掉它以便继续追加"""
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("error") is None or not retry_errors:
+            done.add(str(record.get("id")))
+    return done
+
+
+class RateLimiter:
+    """全局的对话启动速率：相邻两个对话的开始时间至少间隔 60/per_minute 秒"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if self.interval <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+class ResultWriter:
+    """逐行写出结果并立即flush（中断时已完成的结果不会丢失）；ordered时按输入顺序写出"""
+
+    def __init__(self, path: Optional[str], ordered: bool, skipped: set):
+        self._file = open(path, "a", encoding="utf-8") if path else sys.stdout
+        self.ordered = ordered
+        self._skipped = skipped  # 续跑时跳过的输入序号，按顺序输出时直接越过
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._next = 0
+
+    def write(self, index: int, record: Dict[str, Any]):
+        if not self.ordered:
+            self._emit(record)
+            return
+        self._pending[index] = record
+        while True:
+            if self._next in self._skipped:
+                self._skipped.discard(self._next)
+            elif self._next in self._pending:
+                self._emit(self._pending.pop(self._next))
+            else:
+                break
+            self._next += 1
+
+    def skip(self, index: int):
+        if self.ordered:
+            self._skipped.add(index)
+
+    def _emit(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        # 按顺序输出时，被中断而缺失的序号之后已完成的结果也写出（续跑时补上缺失的部分）
+        for index in sorted(self._pending):
+            self._emit(self._pending.pop(index))
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+async def run_conversation(item: BatchItem, pool_manager: ToolPoolManager, tool_cache: ToolResultCache,
+                           scheduler: LLMScheduler, timeout: float, tool_result_chars: int,
+                           with_trace: bool) -> Dict[str, Any]:
+    """在一个新的对话中依次处理item的查询，返回结果记录"""
+    client = MCPClient(tool_cache=tool_cache, scheduler=scheduler)
+    client.use_pool(pool_manager)
+    turns = []
+    error = None
+    started = time.monotonic()
+    try:
+        async with asyncio.timeout(timeout):
+            for query in item.queries:
+                turn, error = await run_query(client, query, tool_result_chars, with_trace)
+                turns.append(turn)
+                if error is not None:
+                    break
+    except TimeoutError:
+        error = f"超过{timeout}秒未完成"
+    except Exception as e:
+        error = f"系统错误: {str(e)}"
+    finally:
+        await client.cleanup()
+    return {
+        "id": item.id,
+        "turns": turns,
+        "answer": turns[-1]["answer"] if turns else "",
+        "latency": round(time.monotonic() - started, 3),
+        "error": error
+    }
+
+
+async def run_query(client: MCPClient, query: str, tool_result_chars: int,
+                    with_trace: bool) -> Tuple[Dict[str, Any], Optional[str]]:
+    """处理一次查询，收集回答、工具调用记录和耗时"""
+    turn: Dict[str, Any] = {"query": query, "answer": "", "tool_calls": []}
+    tool_calls: Dict[str, Dict[str, Any]] = {}
+    error = None
+    with start_trace("batch") as trace:
+        first_token = None
+        answer = []
+        async with aclosing(client.process_query_stream(query)) as events:
+            async for event in events:
+                now = time.monotonic()
+                event_type = event["type"]
+                if event_type == "text_chunk":
+                    if first_token is None:
+                        first_token = now
+                    answer.append(event["data"])
+                elif event_type == "tool_call_start":
+                    tool_calls[event["id"]] = {
+                        "name": event["data"]["name"],
+                        "arguments": event["data"]["args"],
+                        "started": now
+                    }
+                elif event_type in ("tool_call_result", "tool_call_error"):
+                    tool_call = tool_calls.get(event["id"])
+                    if tool_call is not None:
+                        result = event["data"] or ""
+                        tool_call["success"] = event_type == "tool_call_result"
+                        tool_call["duration"] = round(now - tool_call.pop("started"), 3)
+                        tool_call["result_chars"] = len(result)
+                        tool_call["result"] = result[:tool_result_chars] if tool_result_chars > 0 else result
+                elif event_type == "error":
+                    error = event["data"]
+        turn["answer"] = "".join(answer)
+        turn["tool_calls"] = list(tool_calls.values())
+        turn["ttft"] = round(first_token - trace.started, 3) if first_token is not None else None
+        turn["latency"] = round(time.monotonic() - trace.started, 3)
+        if with_trace:
+            turn["trace"] = trace.to_dict()
+    return turn, error
+
+
+async def run_batch(args) -> Dict[str, Any]:
+    done = load_done(args.output, args.retry_errors)
+    writer = ResultWriter(args.output, args.order == "input", set())
+    scheduler = LLMScheduler(max_concurrency=args.llm_concurrency, tokens_per_minute=args.tokens_per_minute)
+    rate_limiter = RateLimiter(args.queries_per_minute)
+    pool_manager = ToolPoolManager(tool_servers())
+    tool_cache = ToolResultCache()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.workers * 2)  # 读取与执行之间的缓冲，输入不必一次读完
+    counts = {"completed": 0, "errors": 0, "skipped": 0}
+
+    async def reader():
+        lines = read_lines(args.input)
+        index = 0
+        while True:
+            # 标准输入可能一直阻塞，放到线程中读取
+            line = await asyncio.to_thread(next, lines, None)
+            if line is None:
+                break
+            item = parse_item(index, line)
+            if item is None:
+                continue
+            index += 1
+            if item.id in done or not item.queries:
+                counts["skipped"] += 1
+                writer.skip(item.index)
+                continue
+            await queue.put(item)
+        for _ in range(args.workers):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await rate_limiter.wait()
+            record = await run_conversation(item, pool_manager, tool_cache, scheduler, args.timeout,
+                                            args.tool_result_chars, args.trace)
+            counts["completed"] += 1
+            if record["error"] is not None:
+                counts["errors"] += 1
+            writer.write(item.index, record)
+
+    started = time.monotonic()
+    await pool_manager.start()
+    for path, error in pool_manager.errors.items():
+        print(f"服务连接错误 {path}: {error}", file=sys.stderr)
+    try:
+        await asyncio.gather(reader(), *(worker() for _ in range(args.workers)))
+    finally:
+        writer.close()
+        await pool_manager.close()
+        tool_cache.close()
+        await aclose_http_client()
+    wall_time = time.monotonic() - started
+    return dict(counts, wall_time=round(wall_time, 3),
+                conversations_per_sec=round(counts["completed"] / wall_time, 3) if wall_time > 0 else None,
+                scheduler=scheduler.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量运行查询文件，每个查询是一个独立对话，结果以JSONL输出")
+    parser.add_argument("input", help="输入JSONL文件，- 表示标准输入")
+    parser.add_argument("-o", "--output", help="输出JSONL文件（默认标准输出；文件已存在时续跑）")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="同时进行的对话数")
+    parser.add_argument("--order", choices=("input", "completion"), default="input",
+                        help="按输入顺序还是完成顺序输出")
+    parser.add_argument("--timeout", type=float, default=BATCH_TIMEOUT, help="单个对话的超时（秒）")
+    parser.add_argument("--queries-per-minute", type=float, default=0, help="全局的对话启动速率，0表示不限制")
+    parser.add_argument("--tokens-per-minute", type=int, default=TOKENS_PER_MINUTE,
+                        help="上游token速率预算（见scheduler.py），0表示不限制")
+    parser.add_argument("--llm-concurrency", type=int, default=MAX_CONCURRENCY, help="同时进行的上游请求数")
+    parser.add_argument("--tool-result-chars", type=int, default=TOOL_RESULT_CHARS,
+                        help="每个工具结果保留的字符数，0表示完整保留")
+    parser.add_argument("--retry-errors", action="store_true", help="续跑时重新运行出错的查询")
+    parser.add_argument("--trace", action="store_true", help="在结果中附带每次查询的耗时时间线")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(args))
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
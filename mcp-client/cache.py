@@ -0,0 +1,199 @@
+# MCP\mcp-client\cache.py
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+from mcp.types import CallToolResult
+
+# 各工具结果的缓存时间（秒），未列出的工具使用DEFAULT_TTL，<=0表示不缓存
+TOOL_CACHE_TTLS: Dict[str, float] = {
+    "get_alerts": 60,
+    "get_alerts_multi": 60,
+    "get_alerts_for_point": 60,
+    "get_forecast": 600,
+    "get_forecasts": 600,
+    "web_search": 3600,
+}
+DEFAULT_TTL = float(os.getenv("MCP_TOOL_CACHE_DEFAULT_TTL", "0"))
+CACHE_MAX_ENTRIES = int(os.getenv("MCP_TOOL_CACHE_MAX_ENTRIES", "1024"))
+CACHE_DB_PATH = os.getenv("MCP_TOOL_CACHE_DB", "")  # 为空时不启用磁盘缓存
+
+
+def is_cacheable(result: CallToolResult) -> bool:
+    """失败的结果不缓存：isError（工具抛出了异常），或工具在JSON结果中标记了 "partial": true（批量查询部分失败）"""
+    if result.isError:
+        return False
+    for item in result.content:
+        text = getattr(item, "text", None)
+        if isinstance(text, str) and text.startswith("{") and '"partial"' in text:
+            try:
+                if json.loads(text).get("partial") is True:
+                    return False
+            except (json.JSONDecodeError, AttributeError):
+                pass
+    return True
+
+
+def cache_key(tool_name: str, arguments: Any) -> str:
+    """工具名+规范化参数（键排序、紧凑分隔符），参数顺序和空白不同也命中同一条目"""
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except json.JSONDecodeError:
+            pass
+    canonical = json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return f"{tool_name}:{canonical}"
+
+
+class _DiskStore:
+    """SQLite持久化层，进程重启后缓存依然有效；所有操作在线程中执行，避免阻塞事件循环"""
+
+    def __init__(self, db_path: str):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM tool_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT expires_at, value FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+    def put(self, key: str, expires_at: float, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, value)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _InFlight:
+    """正在进行的上游调用，相同参数的并发请求共享同一个任务"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class ToolResultCache:
+    """MCPClient.call_tool前面的结果缓存：按工具TTL过期、LRU淘汰、可选磁盘持久化、合并并发请求"""
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, default_ttl: float = DEFAULT_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, db_path: str = CACHE_DB_PATH):
+        self.ttls = dict(TOOL_CACHE_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, CallToolResult)
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._disk = _DiskStore(db_path) if db_path else None
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def ttl_for(self, tool_name: str) -> float:
+        return self.ttls.get(tool_name, self.default_ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def _remember(self, key: str, expires_at: float, result: CallToolResult):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[CallToolResult]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None and row[0] > now:
+                result = CallToolResult.model_validate_json(row[1])
+                self._remember(key, row[0], result)
+                return result
+        return None
+
+    async def _store(self, key: str, ttl: float, result: CallToolResult):
+        if not is_cacheable(result):
+            return  # 不缓存失败结果，上游短暂故障不会在TTL内一直返回错误
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, result)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.put, key, expires_at, result.model_dump_json())
+            except sqlite3.Error:
+                pass  # 磁盘缓存写入失败不影响本次结果
+
+    async def _call_and_store(self, key: str, ttl: float, call: Callable[[], Awaitable[CallToolResult]]):
+        result = await call()
+        await self._store(key, ttl, result)
+        return result
+
+    def _forget(self, key: str, in_flight: _InFlight):
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+
+    async def get_or_call(self, tool_name: str, arguments: Any,
+                          call: Callable[[], Awaitable[CallToolResult]]) -> CallToolResult:
+        """命中缓存直接返回；否则调用call，相同参数的并发请求只会触发一次上游调用"""
+        ttl = self.ttl_for(tool_name)
+        if ttl <= 0:
+            return await call()
+
+        key = cache_key(tool_name, arguments)
+        result = await self._lookup(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            self.misses += 1
+            in_flight = _InFlight(asyncio.create_task(self._call_and_store(key, ttl, call)))
+            self._in_flight[key] = in_flight
+            in_flight.task.add_done_callback(lambda _, f=in_flight: self._forget(key, f))
+        else:
+            self.coalesced += 1
+
+        # 某个调用方被取消时不影响其他等待者；所有等待者都离开后才取消上游调用
+        in_flight.waiters += 1
+        try:
+            return await asyncio.shield(in_flight.task)
+        finally:
+            in_flight.waiters -= 1
+            if in_flight.waiters == 0 and not in_flight.task.done():
+                self._forget(key, in_flight)
+                in_flight.task.cancel()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
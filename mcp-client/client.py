@@ -3,44 +3,160 @@ import asyncio
 import json
 import os
 import sys
-from contextlib import AsyncExitStack
-from typing import Optional, List, Dict, Any, AsyncGenerator
+import time
+import uuid
+from collections import deque
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from datetime import timedelta
+from typing import Optional, List, Dict, Any, AsyncGenerator, Callable
 
-import httpx
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
 from dotenv import load_dotenv
 
+from history import ConversationHistory, message_tokens
+from router import get_router, UpstreamStatusError, RETRYABLE_STATUS
+from scheduler import get_scheduler, retry_delay, COMPLETION_TOKENS_ESTIMATE, MAX_RETRIES
+from tool_index import ToolIndex, tools_tokens, pruning_stats, TOOL_PRUNING, PINNED_TOOLS
+from toolcalls import ToolCallLog
+from tracing import span, record, attach_remote
+from upstream import get_http_client, aclose_http_client, FIRST_BYTE_TIMEOUT
+
 load_dotenv()  # 加载环境变量
 
-class MCPClient:
+# 工具调用配置
+TOOL_CONCURRENCY = int(os.getenv("MCP_TOOL_CONCURRENCY", "4"))
+TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "30"))  # 默认单工具超时（秒）
+TOOL_TIMEOUTS: Dict[str, float] = {
+    "web_search": 60.0,  # 百度RAG生成较慢
+}
+MAX_TOOL_ROUNDS = int(os.getenv("MCP_MAX_TOOL_ROUNDS", "3"))  # 单个查询最多的工具调用轮数
+
+def server_parameters(server_script_path: str) -> StdioServerParameters:
+    """根据脚本类型生成启动MCP服务器子进程的参数"""
+    is_python = server_script_path.endswith('.py')
+    is_js = server_script_path.endswith('.js')
+    
+    if not (is_python or is_js):
+        raise ValueError("服务器脚本必须是.py或.js文件")
+
+    command = "python" if is_python else "node"
+    return StdioServerParameters(
+        command=command,
+        args=[server_script_path],
+        env=None
+    )
+
+def is_http_target(target: str) -> bool:
+    return target.startswith(("http://", "https://"))
+
+@asynccontextmanager
+async def connect_transport(target: str):
+    """按目标类型打开MCP传输：http(s)地址走streamable-HTTP，脚本路径启动stdio子进程"""
+    if is_http_target(target):
+        async with streamablehttp_client(target) as (read, write, _):
+            yield read, write
+    else:
+        async with stdio_client(server_parameters(target)) as (read, write):
+            yield read, write
+
+def is_complete_json(text: str) -> bool:
+    """判断流式拼接的工具参数是否已经是完整的JSON"""
+    try:
+        json.loads(text)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+def tool_to_dict(tool) -> Dict:
+    """将MCP工具定义转换为API调用使用的纯字典结构"""
+    return {
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": tool.description,
+            "parameters": tool.inputSchema
+        }
+    }
+
+class ProgressDispatcher:
+    """把工具服务器的progress通知按progressToken分发给对应的工具调用
+
+    作为ClientSession的message_handler使用。通知中的message字段携带工具的部分输出
+    （mcp 1.8.1的ProgressNotificationParams允许额外字段，新版协议正式定义了message）。
+    """
+
     def __init__(self):
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+
+    async def __call__(self, message):
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ProgressNotification):
+            params = message.root.params
+            handler = self._handlers.get(params.progressToken)
+            text = getattr(params, "message", None)
+            if handler is not None and text:
+                handler(text)
+
+    async def call_tool(self, session: ClientSession, tool_name: str, arguments: Any,
+                        read_timeout_seconds: Optional[timedelta] = None,
+                        on_progress: Optional[Callable[[str], None]] = None) -> types.CallToolResult:
+        """调用工具；提供on_progress时在请求中带上progressToken，服务器的部分输出交给on_progress
+
+        正在记录追踪时还在_meta中带上traceparent，工具服务器返回的内部片段并入当前时间线。
+        """
+        with span("tool.rpc", tool=tool_name) as rpc:
+            meta = {}
+            traceparent = rpc.traceparent()
+            if traceparent is not None:
+                meta["traceparent"] = traceparent
+            token = None
+            if on_progress is not None:
+                token = uuid.uuid4().hex
+                self._handlers[token] = on_progress
+                meta["progressToken"] = token
+            if not meta:
+                return await session.call_tool(tool_name, arguments, read_timeout_seconds=read_timeout_seconds)
+            try:
+                request = types.CallToolRequest(
+                    method="tools/call",
+                    params=types.CallToolRequestParams(
+                        name=tool_name, arguments=arguments, _meta=types.RequestParams.Meta(**meta))
+                )
+                result = await session.send_request(types.ClientRequest(request), types.CallToolResult,
+                                                    request_read_timeout_seconds=read_timeout_seconds)
+            finally:
+                if token is not None:
+                    self._handlers.pop(token, None)
+            attach_remote(result, rpc)
+            return result
+
+class MCPClient:
+    def __init__(self, tool_cache=None, scheduler=None, router=None):
+        self.session_id = uuid.uuid4().hex  # 会话存储的键，调度器也按会话轮转放行
         self.sessions: List[ClientSession] = []  # 存储多个会话
         self.exit_stack = AsyncExitStack()
-        self.http_client = httpx.AsyncClient()
-        self.conversation_history: List[Dict[str, Any]] = []
+        self.http_client = get_http_client()  # 进程内共享的上游连接池
+        self.conversation_history = ConversationHistory()  # 带token预算的对话历史（见history.py）
         self.available_tools = []  # 现在会包含所有工具的JSON可序列化表示
+        self.tool_index: Optional[ToolIndex] = None  # 按相关性裁剪每次请求发送的工具（见tool_index.py）
+        self.recent_tools = deque(maxlen=4)  # 最近调用过的工具，追问时即使没有关键词也继续提供
         self.tool_sessions: Dict[str, ClientSession] = {}  # 工具名到会话的映射
-        self.tool_calls_history: List[Dict[str, Any]] = []
+        self.tool_calls_history = ToolCallLog()  # 按id索引的工具调用环形缓冲区（见toolcalls.py）
+        self.pool_manager = None  # 可选的共享工具服务器会话池（见pool.py）
+        self.tool_cache = tool_cache  # 可选的工具结果缓存（见cache.py），可在多个连接间共享
+        self.tool_semaphore = asyncio.Semaphore(TOOL_CONCURRENCY)  # 同一轮工具调用的并发上限
+        self.progress_dispatcher = ProgressDispatcher()  # 直连会话上的工具进度通知
+        self.tool_progress: asyncio.Queue = asyncio.Queue()  # 工具调用的部分输出（tool_call_progress事件）
+        self.scheduler = scheduler or get_scheduler()  # 应用级的上游调用调度器（见scheduler.py）
+        self.router = router or get_router()  # 多上游端点的路由和对冲（见router.py）
 
     async def connect_to_server(self, server_script_path: str) -> List[Dict]:
-        """连接MCP服务器并返回工具列表"""
-        is_python = server_script_path.endswith('.py')
-        is_js = server_script_path.endswith('.js')
-        
-        if not (is_python or is_js):
-            raise ValueError("服务器脚本必须是.py或.js文件")
-
-        command = "python" if is_python else "node"
-        server_params = StdioServerParameters(
-            command=command,
-            args=[server_script_path],
-            env=None
-        )
-        
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        stdio, write = stdio_transport
-        session = await self.exit_stack.enter_async_context(ClientSession(stdio, write))
+        """连接MCP服务器并返回工具列表（脚本路径或streamable-HTTP地址）"""
+        transport = await self.exit_stack.enter_async_context(connect_transport(server_script_path))
+        stdio, write = transport
+        session = await self.exit_stack.enter_async_context(
+            ClientSession(stdio, write, message_handler=self.progress_dispatcher))
         
         await session.initialize()
         
@@ -53,23 +169,62 @@ class MCPClient:
         # 创建纯字典结构的工具列表，用于API调用
         tools = []
         for tool in response.tools:
-            tool_dict = {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": tool.inputSchema
-                }
-            }
-            tools.append(tool_dict)
+            tools.append(tool_to_dict(tool))
             
             # 存储工具名到会话的映射
             self.tool_sessions[tool.name] = session
         
         return tools
 
-    async def call_tool(self, tool_name: str, arguments: Any) -> Any:
-        """在适当的服务器上调用工具"""
+    def use_pool(self, pool_manager) -> List[Dict]:
+        """改用应用级共享的工具服务器会话池，连接时不再启动任何子进程"""
+        self.pool_manager = pool_manager
+        self.available_tools = pool_manager.tools
+        self.tool_index = pool_manager.tool_index
+        return self.available_tools
+
+    def session_state(self) -> Dict[str, Any]:
+        """可持久化的会话状态（对话历史和工具调用记录），见session_store.py"""
+        return {
+            "history": self.conversation_history.to_dict(),
+            "tool_calls": self.tool_calls_history.to_list(),
+            "recent_tools": list(self.recent_tools)
+        }
+
+    def restore_session(self, session_id: str, state: Optional[Dict[str, Any]]):
+        """接管一个已有会话（重连或由其他worker创建），state为None时作为新会话"""
+        self.session_id = session_id
+        if not state:
+            return
+        self.conversation_history = ConversationHistory.from_dict(state.get("history", {}))
+        self.tool_calls_history.restore(state.get("tool_calls", []))
+        self.recent_tools.extend(state.get("recent_tools", []))
+
+    def select_tools(self, query: str) -> List[Dict]:
+        """本轮查询要发送给模型的工具：按相关性裁剪，并统计节省的请求体积"""
+        if not self.available_tools or not TOOL_PRUNING:
+            return self.available_tools
+        if self.tool_index is None or self.tool_index.tools != self.available_tools:
+            self.tool_index = ToolIndex(self.available_tools)
+        return self.tool_index.select(query, pinned=PINNED_TOOLS, sticky=self.recent_tools)
+
+    async def call_tool(self, tool_name: str, arguments: Any,
+                        on_progress: Optional[Callable[[str], None]] = None) -> Any:
+        """在适当的服务器上调用工具，配置了结果缓存时先查缓存（命中缓存时没有进度输出）"""
+        if self.tool_cache is not None:
+            return await self.tool_cache.get_or_call(
+                tool_name, arguments, lambda: self.call_tool_uncached(tool_name, arguments, on_progress))
+        return await self.call_tool_uncached(tool_name, arguments, on_progress)
+
+    async def call_tool_uncached(self, tool_name: str, arguments: Any,
+                                 on_progress: Optional[Callable[[str], None]] = None) -> Any:
+        """在适当的服务器上调用工具，服务器发来的部分输出交给on_progress"""
+        # 优先从共享会话池中租用会话（池内处理超时、崩溃剔除和重试）
+        if self.pool_manager is not None:
+            pool = self.pool_manager.pool_for_tool(tool_name)
+            if pool is not None:
+                return await pool.call_tool(tool_name, arguments, on_progress=on_progress)
+
         # 查找匹配的工具会话
         session = self.tool_sessions.get(tool_name)
         
@@ -77,189 +232,309 @@ class MCPClient:
             raise ValueError(f"未找到工具: {tool_name}")
         
         # 调用工具
-        return await session.call_tool(tool_name, arguments)
+        return await self.progress_dispatcher.call_tool(session, tool_name, arguments, on_progress=on_progress)
 
-    async def call_deepseek_api_stream(self, messages: List[Dict]) -> AsyncGenerator[Dict, None]:
-        """调用DeepSeek API流式接口"""
-        try:
-            async with httpx.AsyncClient() as client:
-                async with client.stream(
-                    "POST",
-                    "https://api.siliconflow.cn/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {os.getenv('SILICONFLOW_API_KEY')}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": "deepseek-ai/DeepSeek-V3",
-                        "messages": messages,
-                        "temperature": 0.7,
-                        "tools": self.available_tools,
-                        "tool_choice": "auto",
-                        "stream": True  # 启用流式
-                    },
-                    timeout=30.0
-                ) as response:
-                    response.raise_for_status()
-                    
-                    # 事件流处理
-                    async for line in response.aiter_lines():
-                        if line.startswith('data: '):
-                            event_data = line[6:].strip()
-                            if event_data == '[DONE]':
-                                break
-                            
-                            try:
-                                chunk = json.loads(event_data)
-                                yield chunk
-                            except json.JSONDecodeError:
-                                continue
-        except Exception as e:
-            yield {"error": str(e)}
-    async def process_query_stream(self, query: str) -> AsyncGenerator[Dict, None]:
-        """流式处理用户查询"""
-        self.conversation_history.append({"role": "user", "content": query})
-        current_message = {"role": "assistant", "content": ""}
-        tool_calls_collected = []
+    async def run_tool_call(self, tool_call: Dict) -> Dict:
+        """执行单个工具调用，返回结果记录（受并发上限和单工具超时约束）"""
+        arguments = tool_call["arguments"] or "{}"
+        if arguments:
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError:
+                pass
         
-        # 第一次API调用和处理
-        async for chunk in self.call_deepseek_api_stream(self.conversation_history):
-            if "error" in chunk:
-                yield {"type": "error", "data": chunk["error"]}
-                return
-                
-            for choice in chunk.get("choices", []):
-                if "delta" not in choice:
-                    continue
-                    
-                delta = choice["delta"]
-                
-                # 处理内容增量
-                if "content" in delta and delta["content"] is not None:
-                    content = delta["content"]
-                    current_message["content"] += content
-                    yield {"type": "text_chunk", "data": content}
-                
-                # 收集工具调用
-                if "tool_calls" in delta:
-                    tool_call = delta["tool_calls"][0]
-                    if "index" in tool_call and tool_call["index"] >= len(tool_calls_collected):
-                        tool_calls_collected.append({
-                            "id": tool_call.get("id"),
-                            "name": "",
-                            "arguments": ""
-                        })
-                    
-                    # 更新工具调用参数
-                    if tool_call["index"] < len(tool_calls_collected):
-                        current_tool = tool_calls_collected[tool_call["index"]]
-                        function = tool_call.get("function", {})
-                        if "name" in function:
-                            current_tool["name"] = function.get("name")
-                        if "arguments" in function:
-                            current_tool["arguments"] += function["arguments"]
-        
-        # 保存第一次回复的完整消息
-        self.conversation_history.append(current_message)
+        timeout = TOOL_TIMEOUTS.get(tool_call["name"], TOOL_TIMEOUT)
+        progress = self.tool_progress
+
+        def on_progress(text: str):
+            progress.put_nowait({"type": "tool_call_progress", "id": tool_call["id"], "data": text})
+
+        with span("tool.call", labels={"tool": tool_call["name"]}) as current:
+            try:
+                async with self.tool_semaphore:
+                    current.attrs["semaphore_wait_ms"] = round((time.monotonic() - current.started) * 1000, 2)
+                    tool_result = await asyncio.wait_for(
+                        self.call_tool(tool_call["name"], arguments, on_progress), timeout)
+                # 解析工具结果：拼接各段文本内容（直接str()会得到列表的repr，还会带上额外字段）
+                tool_content = "\n".join(
+                    item.text if isinstance(item, types.TextContent) else str(item)
+                    for item in tool_result.content
+                )
+                # 工具抛出异常时FastMCP返回isError结果，内容是错误说明
+                success = not tool_result.isError
+            except asyncio.TimeoutError:
+                tool_content = f"工具调用失败: 超过{timeout}秒未返回"
+                success = False
+            except Exception as e:
+                tool_content = f"工具调用失败: {str(e)}"
+                success = False
+            current.attrs["success"] = success
         
-        # 处理工具调用
-        if tool_calls_collected:
-            for tool_call in tool_calls_collected:
+        return {
+            "id": tool_call["id"],
+            "name": tool_call["name"],
+            "arguments": tool_call["arguments"],
+            "result": tool_content,
+            "success": success
+        }
+
+    def start_tool_call(self, tool_call: Dict) -> Dict:
+        """在后台启动一个工具调用，返回tool_call_start事件"""
+        self.tool_calls_history.start(tool_call["id"], tool_call["name"], tool_call["arguments"])
+        if tool_call["name"] not in self.recent_tools:
+            self.recent_tools.append(tool_call["name"])
+        tool_call["task"] = asyncio.create_task(self.run_tool_call(tool_call))
+        return {
+            "type": "tool_call_start",
+            "id": tool_call["id"],
+            "data": {
+                "name": tool_call["name"],
+                "args": tool_call["arguments"]
+            }
+        }
+
+    async def tool_result_event(self, tool_call: Dict) -> Dict:
+        """记录已完成工具调用的结果，返回tool_call_result/tool_call_error事件"""
+        tool_call["reported"] = True
+        tool_data = tool_call["task"].result()
+        # 添加到工具调用历史
+        await self.tool_calls_history.finish(tool_data["id"], tool_data["result"], tool_data["success"])
+        event_type = "tool_call_result" if tool_data["success"] else "tool_call_error"
+        return {"type": event_type, "id": tool_data["id"], "data": tool_data["result"]}
+
+    async def wait_tool_results(self, tool_calls: List[Dict]) -> AsyncGenerator[Dict, None]:
+        """等待尚未报告的工具调用，按完成顺序发送结果事件"""
+        pending = {tool_call["task"]: tool_call for tool_call in tool_calls if not tool_call.get("reported")}
+        while pending:
+            # 等待期间工具的部分输出随到随发
+            getter = asyncio.ensure_future(self.tool_progress.get())
+            try:
+                done, _ = await asyncio.wait([*pending, getter], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not getter.done():
+                    getter.cancel()
+            if getter in done:
+                yield getter.result()
+            for event in self.drain_tool_progress():
+                yield event
+            for task in done:
+                if task is not getter:
+                    yield await self.tool_result_event(pending.pop(task))
+
+    def drain_tool_progress(self) -> List[Dict]:
+        """取出已经到达的tool_call_progress事件"""
+        events = []
+        while not self.tool_progress.empty():
+            events.append(self.tool_progress.get_nowait())
+        return events
+
+    async def call_deepseek_api_stream(self, messages: List[Dict], allow_tools: bool = True,
+                                       tools: Optional[List[Dict]] = None) -> AsyncGenerator[Dict, None]:
+        """调用上游LLM流式接口（端点由router选择）；allow_tools为False时要求模型直接回答
+
+        tools为本次请求提供的工具，默认为全部可用工具。
+        """
+        if tools is None:
+            tools = self.available_tools
+        payload = {
+            "messages": messages,  # model由路由器按选中的端点填写
+            "temperature": 0.7,
+            "stream": True  # 启用流式
+        }
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "auto" if allow_tools else "none"
+            if self.tool_index is not None:
+                pruning_stats.record(self.tool_index.full_tokens, tools_tokens(tools),
+                                     len(self.tool_index), len(tools))
+        # 经过应用级调度器准入：排队期间向界面报告位置和预计等待时间
+        tokens = sum(message_tokens(message) for message in messages) + COMPLETION_TOKENS_ESTIMATE
+        # 各阶段耗时用record()在结束时记录：生成器会在yield处挂起，不能用span()包裹
+        call_started = time.monotonic()
+        ticket = self.scheduler.enqueue(self.session_id, tokens)
+        try:
+            async with aclosing(ticket.wait()) as statuses:
+                async for status in statuses:
+                    yield {"queued": status}
+            record("llm.queue", call_started, time.monotonic() - call_started)
+            
+            for attempt in range(MAX_RETRIES + 1):
                 try:
-                    # 发送工具调用开始事件
-                    yield {
-                        "type": "tool_call_start", 
-                        "data": {
-                            "name": tool_call["name"],
-                            "args": tool_call["arguments"]
-                        }
-                    }
-                    
-                    # 执行工具调用
-                    arguments = tool_call["arguments"]
-                    if arguments:
-                        try:
-                            arguments = json.loads(arguments)
-                        except json.JSONDecodeError:
-                            pass
-                        
-                    tool_result = await self.call_tool(tool_call["name"], arguments)
-                    # 解析工具结果
-                    if hasattr(tool_result.content, 'text'):
-                        tool_content = tool_result.content.text
-                    elif isinstance(tool_result.content, dict) and 'text' in tool_result.content:
-                        tool_content = tool_result.content['text']
-                    else:
-                        tool_content = str(tool_result.content)
-                    
-                    tool_content = tool_content.replace("\\n", "\n").replace("\\'", "'")
-                    
-                    # 添加到工具调用历史
-                    tool_data = {
-                        "name": tool_call["name"],
-                        "arguments": tool_call["arguments"],
-                        "result": tool_content,
-                        "success": True
-                    }
-                    self.tool_calls_history.append(tool_data)
-                    
-                    # 发送工具调用结果
-                    yield {"type": "tool_call_result", "data": tool_content}
-                    
-                    # 添加到对话历史
-                    self.conversation_history.append({
-                        "role": "tool",
-                        "content": tool_content,
-                        "tool_call_id": tool_call["id"]
-                    })
-                    
+                    # 首字节超时覆盖“发出请求到收到首个数据行”（含对冲），之后由连接池的read超时接管
+                    opened = time.monotonic()
+                    stream = await self.router.open_stream(self.http_client, payload, timeout=FIRST_BYTE_TIMEOUT)
+                    record("llm.open", opened, time.monotonic() - opened,
+                           labels={"endpoint": stream.endpoint.name}, attempt=attempt)
+                    streaming = time.monotonic()
+                    chunks = 0
+                    try:
+                        # 事件流处理
+                        async for line in stream.lines():
+                            if line.startswith('data: '):
+                                event_data = line[6:].strip()
+                                if event_data == '[DONE]':
+                                    break
+                                
+                                try:
+                                    chunk = json.loads(event_data)
+                                    chunks += 1
+                                    yield chunk
+                                except json.JSONDecodeError:
+                                    continue
+                    finally:
+                        await stream.aclose()
+                        record("llm.stream", streaming, time.monotonic() - streaming,
+                               labels={"endpoint": stream.endpoint.name}, chunks=chunks)
+                    return
+                except TimeoutError:
+                    yield {"error": f"上游响应超时（{FIRST_BYTE_TIMEOUT}秒内未收到响应）"}
+                    return
+                except UpstreamStatusError as e:
+                    if e.status_code not in RETRYABLE_STATUS or attempt >= MAX_RETRIES:
+                        yield {"error": f"上游服务错误（HTTP {e.status_code}），已重试{attempt}次"}
+                        return
+                    # 所有端点都返回429/5xx：遵守Retry-After，否则抖动退避；429时全局暂停放行
+                    delay = retry_delay(attempt, e.retry_after)
+                    if e.status_code == 429:
+                        self.scheduler.backoff(delay)
                 except Exception as e:
-                    error_msg = f"工具调用失败: {str(e)}"
-                    self.tool_calls_history.append({
-                        "name": tool_call["name"],
-                        "arguments": tool_call["arguments"],
-                        "result": error_msg,
-                        "success": False
-                    })
-                    yield {"type": "tool_call_error", "data": error_msg}
-            yield {"type": "end"}
-        # 如果有工具调用结果，进行第二次API调用（总结）
-        if self.conversation_history[-1]["role"] == "tool":
-            current_message = {"role": "assistant", "content": ""}
-            # 第二次调用API（使用更新后的对话历史）
-            async for chunk in self.call_deepseek_api_stream(self.conversation_history):
-                if "error" in chunk:
-                    yield {"type": "error", "data": chunk["error"]}
+                    yield {"error": str(e)}
                     return
-                    
-                for choice in chunk.get("choices", []):
-                    if "delta" not in choice:
-                        continue
+                
+                yield {"queued": {"position": 0, "eta": round(delay, 1), "retry": attempt + 1}}
+                await asyncio.sleep(delay)
+        finally:
+            ticket.release()
+            record("llm.call", call_started, time.monotonic() - call_started)
+
+    async def process_query_stream(self, query: str) -> AsyncGenerator[Dict, None]:
+        """流式处理用户查询
+
+        每一轮中，工具调用的参数一旦完整（出现下一个index且参数是合法JSON）就立即派发，
+        与模型的后续生成重叠执行；最多进行MAX_TOOL_ROUNDS轮工具调用，最后一轮不再提供工具。
+        """
+        self.conversation_history.append({"role": "user", "content": query})
+        tools = self.select_tools(query)  # 同一查询的各轮使用同一组工具
+        self.tool_progress = asyncio.Queue()  # 被中断的上一轮遗留的进度不再发送
+        
+        for round_index in range(MAX_TOOL_ROUNDS + 1):
+            allow_tools = round_index < MAX_TOOL_ROUNDS
+            current_message = {"role": "assistant", "content": ""}
+            tool_calls_collected = []
+            
+            try:
+                # aclosing：本生成器在yield处被关闭时，上游HTTP流也要立即关闭，而不是等到垃圾回收
+                async with aclosing(self.call_deepseek_api_stream(self.conversation_history.for_request(), allow_tools, tools)) as chunks:
+                    async for chunk in chunks:
+                        if "error" in chunk:
+                            yield {"type": "error", "data": chunk["error"]}
+                            return
+                        if "queued" in chunk:
+                            yield {"type": "queued", "data": chunk["queued"]}
+                            continue
+                        
+                        for choice in chunk.get("choices", []):
+                            if "delta" not in choice:
+                                continue
+                            
+                            delta = choice["delta"]
+                        
+                            # 处理内容增量
+                            if "content" in delta and delta["content"] is not None:
+                                content = delta["content"]
+                                current_message["content"] += content
+                                yield {"type": "text_chunk", "data": content}
                         
-                    delta = choice["delta"]
+                            # 收集工具调用
+                            for tool_call in delta.get("tool_calls") or []:
+                                index = tool_call.get("index", max(len(tool_calls_collected) - 1, 0))
+                                while index >= len(tool_calls_collected):
+                                    tool_calls_collected.append({
+                                        "id": None,
+                                        "name": "",
+                                        "arguments": ""
+                                    })
+                            
+                                # 更新工具调用参数
+                                current_tool = tool_calls_collected[index]
+                                if tool_call.get("id"):
+                                    current_tool["id"] = tool_call["id"]
+                                function = tool_call.get("function", {})
+                                if function.get("name"):
+                                    current_tool["name"] = function["name"]
+                                    if self.pool_manager is not None:
+                                        self.pool_manager.prestart(function["name"])
+                                if function.get("arguments"):
+                                    current_tool["arguments"] += function["arguments"]
+                            
+                                # index前进说明之前的工具调用已经生成完毕，参数完整即可提前派发
+                                for earlier in tool_calls_collected[:index]:
+                                    if "task" not in earlier and is_complete_json(earlier["arguments"]):
+                                        yield self.start_tool_call(earlier)
                     
-                    # 只处理文本内容，忽略可能的工具调用（在第二次调用中我们不需要工具）
-                    if "content" in delta and delta["content"] is not None:
-                        content = delta["content"]
-                        current_message["content"] += content
-                        yield {"type": "text_chunk", "data": content}
+                        # 流式生成期间已经完成的工具调用，立即发送部分输出和结果
+                        for event in self.drain_tool_progress():
+                            yield event
+                        for tool_call in tool_calls_collected:
+                            if "task" in tool_call and tool_call["task"].done() and not tool_call.get("reported"):
+                                yield await self.tool_result_event(tool_call)
+                
+                # 流结束后派发剩余的工具调用，并按完成顺序等待结果
+                for tool_call in tool_calls_collected:
+                    if "task" not in tool_call:
+                        yield self.start_tool_call(tool_call)
+                async for event in self.wait_tool_results(tool_calls_collected):
+                    yield event
+            except (asyncio.CancelledError, GeneratorExit):
+                # 用户中断：保留已经输出的文字回答；带未完成工具调用的消息不能写入历史
+                if current_message["content"] and not tool_calls_collected:
+                    self.conversation_history.append(current_message)
+                raise
+            finally:
+                for tool_call in tool_calls_collected:
+                    if "task" in tool_call:
+                        tool_call["task"].cancel()
             
-            # 保存第二次的完整消息
-            if current_message["content"]:
+            # 保存本轮回复的完整消息（带上tool_calls，后续的tool消息才能与之对应）
+            if tool_calls_collected:
+                current_message["tool_calls"] = [
+                    {
+                        "id": tool_call["id"],
+                        "type": "function",
+                        "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]}
+                    }
+                    for tool_call in tool_calls_collected
+                ]
+            if current_message["content"] or tool_calls_collected:
                 self.conversation_history.append(current_message)
+            
+            if not tool_calls_collected:
+                break
+            
+            # tool消息按assistant消息中tool_calls的顺序加入对话历史
+            for tool_call in tool_calls_collected:
+                tool_data = tool_call["task"].result()
+                self.conversation_history.append({
+                    "role": "tool",
+                    "content": tool_data["result"],
+                    "tool_call_id": tool_data["id"]
+                })
+            # 本轮的回答到此为止，模型还会继续生成（不是整次查询的结束）
+            yield {"type": "round_end"}
         
-        # 流式处理结束
+        # 流式处理结束：每次查询只发送一次end
         yield {"type": "end"}
 
 
     async def cleanup(self):
         """清理资源"""
         await self.exit_stack.aclose()
-        await self.http_client.aclose()
+        self.tool_calls_history.close()
+        # 共享的上游HTTP客户端由进程统一关闭（见upstream.aclose_http_client）
 
 async def main():
     if len(sys.argv) < 2:
-        print("用法: python client.py <服务器脚本路径>")
+        print("用法: python client.py <服务器脚本路径或streamable-HTTP地址>")
         sys.exit(1)
         
     client = MCPClient()
@@ -274,6 +549,7 @@ async def main():
                 print(event)
     finally:
         await client.cleanup()
+        await aclose_http_client()
 
 if __name__ == "__main__":
     asyncio.run(main())
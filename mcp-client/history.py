@@ -0,0 +1,163 @@
+# MCP\mcp-client\history.py
+import json
+import os
+from typing import List, Dict, Any, Optional, Iterator
+
+# 对话历史配置（可通过环境变量调整）
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+TOOL_RESULT_STUB_CHARS = int(os.getenv("HISTORY_TOOL_RESULT_STUB_CHARS", "300"))
+SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY", "1") == "1"
+SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "1500"))
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条消息的角色/分隔符开销
+STUB_MARKER = "…[工具结果已压缩"  # 工具结果存根中截断处之后的标记
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符约1字1token，其余约4字符1token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get("content") or "")
+    if message.get("tool_calls"):
+        tokens += estimate_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    return tokens
+
+
+class ConversationHistory:
+    """带token预算的对话历史
+
+    - 每条消息的token数在加入时计算一次，总数增量维护；
+    - 之前轮次中已经被模型用过的大段工具结果压缩成摘要存根；
+    - 超出预算时按轮次（从一条user消息到下一条之前）滑动窗口丢弃最早的内容，
+      可选地把丢弃的轮次折叠进一条滚动摘要。
+    这样无论会话多长，每次请求的消息体积都保持在预算以内。
+    """
+
+    def __init__(self, token_budget: int = HISTORY_TOKEN_BUDGET, summary_enabled: bool = SUMMARY_ENABLED):
+        self.token_budget = token_budget
+        self.summary_enabled = summary_enabled
+        self.messages: List[Dict[str, Any]] = []
+        self._tokens: List[int] = []
+        self.total_tokens = 0
+        self.summary = ""  # 被丢弃轮次的滚动摘要
+        self._summary_tokens = 0
+        self._compacted_upto = 0  # 此下标之前的工具结果已经压缩过
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def append(self, message: Dict[str, Any]):
+        if message["role"] == "user":
+            # 新一轮开始：之前轮次的工具结果都已被模型使用，可以压缩
+            self._compact_tool_results(len(self.messages))
+        self.messages.append(message)
+        tokens = message_tokens(message)
+        self._tokens.append(tokens)
+        self.total_tokens += tokens
+        self._enforce_budget()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可持久化的状态（见session_store.py）；消息dict加入后不再原地修改，复制列表即可"""
+        return {
+            "messages": list(self.messages),
+            "summary": self.summary,
+            "compacted_upto": self._compacted_upto
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any], **kwargs) -> "ConversationHistory":
+        history = cls(**kwargs)
+        history.messages = list(state.get("messages", []))
+        history._tokens = [message_tokens(message) for message in history.messages]
+        history.total_tokens = sum(history._tokens)
+        history.summary = state.get("summary", "")
+        if history.summary:
+            history._summary_tokens = estimate_tokens(history.summary) + MESSAGE_OVERHEAD_TOKENS
+        history._compacted_upto = min(state.get("compacted_upto", 0), len(history.messages))
+        history._enforce_budget()  # 预算可能比保存时更小
+        return history
+
+    def for_request(self) -> List[Dict[str, Any]]:
+        """发送给模型的消息列表（滚动摘要 + 窗口内的消息）"""
+        if self.summary:
+            return [{"role": "system", "content": f"此前对话的摘要：\n{self.summary}"}] + self.messages
+        return list(self.messages)
+
+    @property
+    def request_tokens(self) -> int:
+        return self.total_tokens + self._summary_tokens
+
+    def _set_content(self, index: int, content: str):
+        message = dict(self.messages[index], content=content)
+        self.messages[index] = message
+        tokens = message_tokens(message)
+        self.total_tokens += tokens - self._tokens[index]
+        self._tokens[index] = tokens
+
+    def _stub_tool_result(self, index: int) -> bool:
+        """把一条过长的工具结果压缩成存根，返回是否有变化（已经是存根的不再压缩）"""
+        message = self.messages[index]
+        content = message.get("content") or ""
+        if message["role"] != "tool" or len(content) <= TOOL_RESULT_STUB_CHARS or content[TOOL_RESULT_STUB_CHARS:].startswith(STUB_MARKER):
+            return False
+        stub = f"{content[:TOOL_RESULT_STUB_CHARS]}{STUB_MARKER}，省略{len(content) - TOOL_RESULT_STUB_CHARS}字]"
+        self._set_content(index, stub)
+        return True
+
+    def _compact_tool_results(self, end: int):
+        for index in range(self._compacted_upto, end):
+            self._stub_tool_result(index)
+        self._compacted_upto = max(self._compacted_upto, end)
+
+    def _oldest_turn_end(self) -> Optional[int]:
+        """最早一轮的结束位置（下一条user消息的下标）；只剩当前轮时返回None"""
+        for index in range(1, len(self.messages)):
+            if self.messages[index]["role"] == "user":
+                return index
+        return None
+
+    def _enforce_budget(self):
+        while self.request_tokens > self.token_budget:
+            end = self._oldest_turn_end()
+            if end is None:
+                # 只剩当前轮仍超出预算：不丢弃消息，从最大的开始压缩本轮的工具结果
+                self._shrink_current_turn()
+                return
+            dropped = self.messages[:end]
+            self.total_tokens -= sum(self._tokens[:end])
+            del self.messages[:end]
+            del self._tokens[:end]
+            self._compacted_upto = max(0, self._compacted_upto - end)
+            if self.summary_enabled:
+                self._fold_into_summary(dropped)
+
+    def _shrink_current_turn(self):
+        tool_indexes = [index for index, message in enumerate(self.messages) if message["role"] == "tool"]
+        for index in sorted(tool_indexes, key=lambda index: self._tokens[index], reverse=True):
+            if self.request_tokens <= self.token_budget:
+                return
+            self._stub_tool_result(index)
+
+    def _fold_into_summary(self, turn: List[Dict[str, Any]]):
+        """把丢弃的一轮对话折叠成一行摘要（只保留用户问题和最终回答的开头）"""
+        question = next((m.get("content") or "" for m in turn if m["role"] == "user"), "")
+        answers = [m.get("content") for m in turn if m["role"] == "assistant" and m.get("content")]
+        line = f"- 用户: {question[:100]}"
+        if answers:
+            line += f" / 助手: {answers[-1][:200]}"
+        summary = f"{self.summary}\n{line}" if self.summary else line
+        # 摘要本身也有上限，超出时按行保留最近的部分
+        if len(summary) > SUMMARY_MAX_CHARS:
+            summary = summary[-SUMMARY_MAX_CHARS:].split("\n", 1)[-1]
+        self.summary = summary
+        self._summary_tokens = estimate_tokens(self.summary) + MESSAGE_OVERHEAD_TOKENS
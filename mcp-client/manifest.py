@@ -0,0 +1,70 @@
+# MCP\mcp-client\manifest.py
+import hashlib
+import json
+import os
+import time
+from typing import Optional, List, Dict
+
+from client import is_http_target
+
+# 工具清单缓存配置（可通过环境变量调整）
+MANIFEST_PATH = os.getenv("MCP_TOOL_MANIFEST", "tool_manifest.json")
+MANIFEST_HTTP_TTL = float(os.getenv("MCP_TOOL_MANIFEST_HTTP_TTL", "3600"))  # HTTP服务器没有脚本可哈希，按时间过期（秒）
+
+
+def server_fingerprint(server: str) -> Optional[str]:
+    """脚本内容的哈希；HTTP服务器返回None（改用TTL判断是否过期）"""
+    if is_http_target(server):
+        return None
+    hasher = hashlib.sha256()
+    with open(server, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class ToolManifest:
+    """磁盘上的工具清单：服务器 -> 工具列表（API调用格式）
+
+    脚本内容变化后对应条目自动失效；读写失败只会退化为启动服务器现查，不影响使用。
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH, http_ttl: float = MANIFEST_HTTP_TTL):
+        self.path = path
+        self.http_ttl = http_ttl
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._entries: Dict[str, Dict] = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, server: str) -> Optional[List[Dict]]:
+        """返回仍然有效的缓存工具列表，没有或已失效时返回None"""
+        entry = self._entries.get(server)
+        if entry is None:
+            return None
+        try:
+            fingerprint = server_fingerprint(server)
+        except OSError:
+            return None
+        if fingerprint is None:
+            if time.time() - entry.get("updated_at", 0) > self.http_ttl:
+                return None
+        elif entry.get("hash") != fingerprint:
+            return None
+        return entry.get("tools")
+
+    def put(self, server: str, tools: List[Dict]):
+        try:
+            fingerprint = server_fingerprint(server)
+        except OSError:
+            return
+        self._entries[server] = {"hash": fingerprint, "updated_at": time.time(), "tools": tools}
+        # 先写临时文件再替换，多个worker同时写也不会留下半个文件
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
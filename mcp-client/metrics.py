@@ -0,0 +1,137 @@
+# MCP\mcp-client\metrics.py
+import bisect
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Prometheus风格的直方图（累积桶 + _sum + _count），按标签组合分别统计"""
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}  # 标签 -> 各桶计数 + [sum, count]
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted((name, str(label)) for name, label in labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            labels = dict(key)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} "
+                             f"{_format_value(cumulative)}")
+            lines.append(f"{self.name}_bucket{_format_labels(dict(labels, le='+Inf'))} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(series[-1])}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted((name, str(label)) for name, label in labels.items()))
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(key))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """进程内的指标集合：直方图/计数器在热路径上直接更新，
+    其余状态（会话池、缓存、调度器等）由collector在抓取时读取，热路径上没有额外开销
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        # collector返回 [(指标名, 类型, 说明, [(标签, 值), ...]), ...]
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable) -> Callable:
+        self._collectors.append(collector)
+        return collector
+
+    def unregister_collector(self, collector: Callable):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self) -> str:
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# 热路径上的耗时片段（见tracing.py），span为片段名，其余标签因片段而异（端点、工具名）
+span_seconds = registry.histogram("mcp_span_duration_seconds", "各阶段耗时（上游排队、连接、首字节、生成、工具调用等）")
+turn_seconds = registry.histogram("mcp_turn_duration_seconds", "一次查询从收到到结束的总耗时")
+turns_total = registry.counter("mcp_turns_total", "查询数（按结果分类）")
+
+
+def gauge(name: str, help_text: str, samples: List[Tuple[Dict[str, str], Optional[float]]]):
+    """collector中构造一个gauge条目"""
+    return name, "gauge", help_text, samples
+
+
+def counter_sample(name: str, help_text: str, samples: List[Tuple[Dict[str, str], Optional[float]]]):
+    """collector中构造一个counter条目（值由其他模块累计）"""
+    return name, "counter", help_text, samples
@@ -0,0 +1,463 @@
+# MCP\mcp-client\pool.py
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable
+
+import anyio
+from mcp import ClientSession
+from mcp.shared.exceptions import McpError
+
+from client import ProgressDispatcher, connect_transport, is_http_target, tool_to_dict
+from manifest import ToolManifest
+from tool_index import ToolIndex
+from tracing import span
+
+# 会话池配置（可通过环境变量调整）
+POOL_MIN_SIZE = int(os.getenv("MCP_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("MCP_POOL_MAX_SIZE", "4"))
+HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_POOL_HEALTH_INTERVAL", "30"))
+PING_TIMEOUT = float(os.getenv("MCP_POOL_PING_TIMEOUT", "5"))
+TOOL_CALL_TIMEOUT = float(os.getenv("MCP_TOOL_CALL_TIMEOUT", "60"))
+START_TIMEOUT = float(os.getenv("MCP_POOL_START_TIMEOUT", "20"))  # 子进程启动+initialize握手
+ENDPOINT_COOLDOWN = float(os.getenv("MCP_ENDPOINT_COOLDOWN", "15"))  # HTTP端点连接失败后暂停使用的时间（秒）
+LAZY_START = os.getenv("MCP_LAZY_START", "1") == "1"  # 工具清单有缓存时，服务器推迟到第一次调用工具时才启动
+IDLE_TIMEOUT = float(os.getenv("MCP_POOL_IDLE_TIMEOUT", "600"))  # 服务器闲置超过此时间（秒）后关闭，0表示不关闭
+
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools")
+
+
+def tool_servers() -> List[str]:
+    """要连接的工具服务器：脚本路径（作为stdio子进程启动），或同一服务器的一组streamable-HTTP地址（逗号分隔）
+
+    默认为tools目录下的weather.py和websearch.py，可通过 MCP_TOOL_SERVERS 覆盖，多个服务器之间用分号分隔，例如
+    MCP_TOOL_SERVERS="http://10.0.0.1:8101/mcp/,http://10.0.0.2:8101/mcp/;../tools/websearch.py"
+    """
+    servers = os.getenv("MCP_TOOL_SERVERS")
+    if not servers:
+        return [os.path.abspath(os.path.join(TOOLS_DIR, "weather.py")),
+                os.path.abspath(os.path.join(TOOLS_DIR, "websearch.py"))]
+    return [
+        server.strip() if server.strip().startswith("http") else os.path.abspath(server.strip())
+        for server in servers.split(";") if server.strip()
+    ]
+
+
+# 说明子进程或stdio管道已经断开的异常
+TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)
+
+
+class PooledSession:
+    """一个已初始化的ClientSession：stdio子进程，或到某个streamable-HTTP端点的连接
+
+    传输和ClientSession都依赖anyio任务组，必须在同一个任务中进入和退出，
+    所以每个会话都由一个独立的后台任务持有，直到被关闭。
+    """
+
+    def __init__(self, target: str):
+        self.target = target  # 脚本路径或HTTP端点地址
+        self.session: Optional[ClientSession] = None
+        self.progress = ProgressDispatcher()  # 工具调用的进度通知
+        self.in_flight = 0  # 当前正在进行的调用数
+        self.dead = False  # 传输层出错或ping失败后置为True，不再被租用
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def alive(self) -> bool:
+        return (not self.dead and self.session is not None
+                and self._task is not None and not self._task.done())
+
+    async def start(self):
+        """启动子进程（或连接HTTP端点）并完成initialize握手"""
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if self.session is None:
+            raise RuntimeError(f"工具服务器启动失败 {self.target}: {self._error}")
+
+    async def _run(self):
+        try:
+            async with connect_transport(self.target) as (stdio, write):
+                async with ClientSession(stdio, write, message_handler=self.progress) as session:
+                    # 子进程启动即退出时initialize不会返回，必须限时
+                    await asyncio.wait_for(session.initialize(), START_TIMEOUT)
+                    self.session = session
+                    self._ready.set()
+                    await self._stop.wait()
+        except Exception as e:
+            self._error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def call_tool(self, tool_name: str, arguments: Any, timeout: float,
+                        on_progress: Optional[Callable[[str], None]] = None):
+        """调用工具；传输在调用途中断开时（子进程退出、HTTP端点连不上）立即抛出传输错误，
+        不用等到调用超时——ClientSession本身不会让已发出的请求失败
+        """
+        call = asyncio.ensure_future(self.progress.call_tool(
+            self.session, tool_name, arguments, timedelta(seconds=timeout), on_progress))
+        try:
+            await asyncio.wait([call, self._task], return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            call.cancel()
+            raise
+        if not call.done():
+            call.cancel()
+            raise anyio.BrokenResourceError(f"工具服务器连接已断开: {self._error}")
+        return call.result()
+
+    async def ping(self) -> bool:
+        """健康检查：子进程崩溃或无响应时返回False"""
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), PING_TIMEOUT)
+            return True
+        except Exception:
+            self.dead = True
+            return False
+
+    async def close(self):
+        self.dead = True
+        self._stop.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, PING_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+
+
+class ToolServerPool:
+    """单个工具服务器的会话池，维护min_size到max_size个已初始化的会话
+
+    server是脚本路径（每个会话一个stdio子进程），或同一服务器的一组streamable-HTTP端点
+    （逗号分隔）。多个端点时每个端点至少一个会话，调用按负载分摊到各端点；
+    连不上的端点暂时冷却，新会话开到其他端点上。
+    """
+
+    def __init__(self, server: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 on_start: Optional[Callable[[], None]] = None):
+        self.server = server
+        self.on_start = on_start  # 每次启动成功（拿到最新工具列表）后调用
+        if is_http_target(server):
+            self.targets = [url.strip() for url in server.split(",") if url.strip()]
+        else:
+            self.targets = [server]
+        self.min_size = max(1, min_size, len(self.targets))
+        self.max_size = max(self.min_size, max_size)
+        self._cooldown_until: Dict[str, float] = {}  # 端点 -> 冷却结束时间
+        self.members: List[PooledSession] = []
+        self.tools: List[Dict] = []  # 缓存的工具列表（API调用格式）
+        self.started = False
+        self.last_used = time.monotonic()
+        self._closed = False
+        self._spawning = 0
+        self._connecting: Dict[str, int] = {}  # 端点 -> 正在建立的会话数
+        # 后台任务保留引用防止被回收：扩容任务在关闭时取消，关闭会话的任务则等待其完成
+        self._spawn_tasks: set[asyncio.Task] = set()
+        self._close_tasks: set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._spawning > 0 or any(m.in_flight for m in self.members)
+
+    async def start(self):
+        """预热min_size个会话，并缓存一次工具列表；失败时关闭已启动的部分会话"""
+        results = await asyncio.gather(*(self._spawn() for _ in range(self.min_size)),
+                                       return_exceptions=True)
+        members = [r for r in results if isinstance(r, PooledSession)]
+        try:
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                raise errors[0]
+            response = await members[0].session.list_tools()
+        except BaseException:
+            for member in members:
+                self._evict(member)
+            raise
+        self.tools = [tool_to_dict(tool) for tool in response.tools]
+        self.started = True
+        self.last_used = time.monotonic()
+        if self.on_start is not None:
+            self.on_start()
+
+    async def ensure_started(self):
+        """按需启动：并发的首次调用只启动一次"""
+        if self.started:
+            return
+        async with self._start_lock:
+            if not self.started:
+                with span("tool.start", labels={"server": self.server}):
+                    await self.start()
+
+    def _ranked_targets(self) -> List[str]:
+        """新会话优先开到会话最少的可用端点上，冷却中的端点排在最后"""
+        now = time.monotonic()
+        counts = {target: self._connecting.get(target, 0) for target in self.targets}
+        for member in self.members:
+            if member.alive and member.target in counts:
+                counts[member.target] += 1
+        return sorted(self.targets, key=lambda target: (
+            self._cooldown_until.get(target, 0.0) > now, counts[target]))
+
+    async def _spawn(self, reserved: bool = False) -> PooledSession:
+        """启动一个新会话（端点连不上时依次尝试其他端点）；reserved表示调用方已经预先计入了_spawning"""
+        if not reserved:
+            self._spawning += 1
+        try:
+            error: Optional[BaseException] = None
+            for target in self._ranked_targets():
+                member = PooledSession(target)
+                self._connecting[target] = self._connecting.get(target, 0) + 1
+                try:
+                    await member.start()
+                except Exception as e:
+                    await member.close()
+                    self._cooldown_until[target] = time.monotonic() + ENDPOINT_COOLDOWN
+                    error = e
+                    continue
+                except BaseException:
+                    await member.close()
+                    raise
+                finally:
+                    self._connecting[target] -= 1
+                self._cooldown_until.pop(target, None)
+                break
+            else:
+                raise error
+        finally:
+            self._spawning -= 1
+        if self._closed:
+            await member.close()
+            raise RuntimeError("会话池已关闭")
+        self.members.append(member)
+        return member
+
+    @staticmethod
+    def _track(tasks: set, coro):
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _spawn_in_background(self):
+        try:
+            await self._spawn(reserved=True)
+        except Exception:
+            pass  # 扩容失败不影响当前调用，交给下一次健康检查
+
+    def _evict(self, member: PooledSession):
+        """把失效会话移出池子并在后台关闭，仍在进行的调用会收到传输错误"""
+        member.dead = True
+        if member in self.members:
+            self.members.remove(member)
+        self._track(self._close_tasks, member.close())
+
+    async def _acquire(self, exclude: Optional[PooledSession] = None) -> PooledSession:
+        async with self._lock:
+            alive = [m for m in self.members if m.alive and m is not exclude]
+            if not alive:
+                # 所有会话都已失效，只能同步重启一个
+                member = await self._spawn()
+            else:
+                member = min(alive, key=lambda m: m.in_flight)
+                # 所有会话都忙时在后台扩容，当前调用先复用负载最低的会话
+                # （ClientSession支持在同一连接上并发请求）
+                if member.in_flight > 0 and len(alive) + self._spawning < self.max_size:
+                    self._spawning += 1
+                    self._track(self._spawn_tasks, self._spawn_in_background())
+            member.in_flight += 1
+            return member
+
+    @asynccontextmanager
+    async def lease(self, exclude: Optional[PooledSession] = None) -> AsyncIterator[PooledSession]:
+        """租用一个会话，用完自动归还"""
+        member = await self._acquire(exclude)
+        try:
+            yield member
+        finally:
+            member.in_flight -= 1
+            self.last_used = time.monotonic()
+
+    async def call_tool(self, tool_name: str, arguments: Any, timeout: float = TOOL_CALL_TIMEOUT,
+                        on_progress: Optional[Callable[[str], None]] = None):
+        """在池中的会话上调用工具；子进程已退出或端点断开时剔除该会话，并在其他会话（端点）上重试一次"""
+        await self.ensure_started()
+        failed = None
+        for attempt in range(2):
+            async with self.lease(exclude=failed) as member:
+                try:
+                    return await member.call_tool(tool_name, arguments, timeout, on_progress)
+                except TRANSPORT_ERRORS:
+                    crashed = True
+                except McpError:
+                    # 超时可能只是工具慢，也可能是子进程已经崩溃，用ping区分
+                    crashed = not await member.ping()
+                    if not crashed:
+                        raise
+                self._evict(member)
+                failed = member
+                if attempt == 1:
+                    raise RuntimeError(f"工具服务器已断开: {self.server}")
+
+    async def health_check(self):
+        """移除崩溃或无响应的会话，并补足到min_size"""
+        results = await asyncio.gather(*(m.ping() for m in self.members))
+        for member, healthy in zip(list(self.members), results):
+            if not healthy:
+                self._evict(member)
+        alive = [m for m in self.members if m.alive]
+        missing = self.min_size - len(alive) - self._spawning
+        # 多端点时，恢复（冷却结束）但没有会话的端点重新分到会话，调用才能再分摊过去
+        now = time.monotonic()
+        uncovered = [target for target in self.targets
+                     if target not in {m.target for m in alive} and self._cooldown_until.get(target, 0.0) <= now]
+        missing = min(max(missing, len(uncovered)), self.max_size - len(alive) - self._spawning)
+        if missing > 0:
+            await asyncio.gather(*(self._spawn() for _ in range(missing)), return_exceptions=True)
+
+    async def stop(self):
+        """闲置关闭：结束所有会话释放内存，保留工具列表，下次调用时重新启动"""
+        async with self._start_lock:
+            if not self.started or self.busy:
+                return
+            self.started = False
+            members, self.members = self.members, []
+            await asyncio.gather(*(m.close() for m in members), return_exceptions=True)
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._spawn_tasks):
+            task.cancel()
+        members, self.members = self.members, []
+        await asyncio.gather(*(m.close() for m in members), *self._spawn_tasks, *self._close_tasks,
+                             return_exceptions=True)
+
+
+class ToolPoolManager:
+    """应用级的工具服务器会话池集合，所有WebSocket连接共享
+
+    工具清单在磁盘上有缓存（见manifest.py）时，启动阶段不启动服务器，直接用缓存的工具列表；
+    服务器在第一次调用其工具时才启动，闲置超过idle_timeout后关闭。
+    """
+
+    def __init__(self, servers: List[str], min_size: int = POOL_MIN_SIZE,
+                 max_size: int = POOL_MAX_SIZE, health_check_interval: float = HEALTH_CHECK_INTERVAL,
+                 manifest: Optional[ToolManifest] = None, lazy: bool = LAZY_START,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        self.pools: Dict[str, ToolServerPool] = {
+            server: ToolServerPool(server, min_size, max_size,
+                                   on_start=lambda server=server: self._on_pool_started(server))
+            for server in servers
+        }
+        self.errors: Dict[str, str] = {}  # 启动失败的服务器及错误信息
+        self.health_check_interval = health_check_interval
+        self.manifest = manifest if manifest is not None else ToolManifest()
+        self.lazy = lazy
+        self.idle_timeout = idle_timeout
+        self._tool_pools: Dict[str, ToolServerPool] = {}
+        self._tool_index: Optional[ToolIndex] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._prestart_tasks: set[asyncio.Task] = set()
+
+    @property
+    def tools(self) -> List[Dict]:
+        """所有服务器的工具列表（已启动的服务器为实时列表，其余为缓存）"""
+        tools = []
+        for pool in self.pools.values():
+            tools.extend(pool.tools)
+        return tools
+
+    @property
+    def tool_index(self) -> ToolIndex:
+        """工具列表上的检索索引，工具列表变化（服务器启动）后重建"""
+        if self._tool_index is None:
+            self._tool_index = ToolIndex(self.tools)
+        return self._tool_index
+
+    def pool_for_tool(self, tool_name: str) -> Optional[ToolServerPool]:
+        return self._tool_pools.get(tool_name)
+
+    def _register(self, pool: ToolServerPool):
+        for name in [name for name, owner in self._tool_pools.items() if owner is pool]:
+            del self._tool_pools[name]
+        for tool in pool.tools:
+            self._tool_pools[tool["function"]["name"]] = pool
+        self._tool_index = None
+
+    def _on_pool_started(self, path: str):
+        """服务器（重新）启动后用实时工具列表更新清单和工具映射"""
+        pool = self.pools[path]
+        self.errors.pop(path, None)
+        if pool.tools != self.manifest.get(path):
+            self.manifest.put(path, pool.tools)
+        self._register(pool)
+
+    async def _start_pool(self, path: str, pool: ToolServerPool):
+        try:
+            await pool.ensure_started()
+        except Exception as e:
+            self.errors[path] = str(e)
+
+    def prestart(self, tool_name: str):
+        """模型刚开始生成某个工具调用时就在后台启动对应服务器，与参数生成重叠"""
+        pool = self.pool_for_tool(tool_name)
+        if pool is None or pool.started:
+            return
+        task = asyncio.create_task(self._start_pool(pool.server, pool))
+        self._prestart_tasks.add(task)
+        task.add_done_callback(self._prestart_tasks.discard)
+
+    async def start(self):
+        """应用启动：有有效清单缓存的服务器推迟启动，其余并行启动以获取工具列表；然后开始周期性健康检查"""
+        eager = []
+        for path, pool in self.pools.items():
+            cached = self.manifest.get(path) if self.lazy else None
+            if cached is None:
+                eager.append((path, pool))
+            else:
+                pool.tools = cached
+                self._register(pool)
+        await asyncio.gather(*(self._start_pool(path, pool) for path, pool in eager))
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _maintain(self, path: str, pool: ToolServerPool):
+        try:
+            if pool.started:
+                idle = time.monotonic() - pool.last_used
+                if self.idle_timeout > 0 and idle > self.idle_timeout and not pool.busy:
+                    await pool.stop()
+                else:
+                    await pool.health_check()
+            elif path in self.errors:
+                # 启动失败的服务器定期重试
+                await self._start_pool(path, pool)
+        except Exception as e:
+            self.errors[path] = str(e)
+
+    async def _health_loop(self):
+        # 各服务器独立维护，一个服务器启动超时不会拖住其他服务器的健康检查和闲置关闭；
+        # 上一轮还没结束的服务器本轮跳过
+        running: Dict[str, asyncio.Task] = {}
+        try:
+            while True:
+                await asyncio.sleep(self.health_check_interval)
+                for path, pool in self.pools.items():
+                    if path not in running or running[path].done():
+                        running[path] = asyncio.create_task(self._maintain(path, pool))
+        finally:
+            for task in running.values():
+                task.cancel()
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for task in list(self._prestart_tasks):
+            task.cancel()
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
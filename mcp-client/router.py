@@ -0,0 +1,262 @@
+# MCP\mcp-client\router.py
+import asyncio
+import json
+import os
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator
+
+import httpx
+from dotenv import load_dotenv
+
+from tracing import span, record
+
+load_dotenv()  # 加载环境变量
+
+# 默认的上游端点（未配置LLM_ENDPOINTS时使用）
+LLM_API_BASE = os.getenv("LLM_API_BASE", "https://api.siliconflow.cn/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3")
+# 多端点配置：JSON数组，例如
+# [{"name": "sf", "base_url": "https://api.siliconflow.cn/v1", "model": "deepseek-ai/DeepSeek-V3", "api_key_env": "SILICONFLOW_API_KEY"}]
+LLM_ENDPOINTS = os.getenv("LLM_ENDPOINTS", "")
+
+# 路由配置（可通过环境变量调整）
+HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "3"))  # 首token超过此时间（秒）向备用端点发对冲请求，0表示不对冲
+FAILURE_COOLDOWN = float(os.getenv("LLM_ENDPOINT_COOLDOWN", "30"))  # 端点失败后暂停使用的时间（秒）
+EWMA_ALPHA = 0.3
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}  # 换端点或稍后重试可能成功的状态码
+
+
+class UpstreamStatusError(Exception):
+    """上游返回了错误状态码"""
+
+    def __init__(self, endpoint: "Endpoint", status_code: int, retry_after: Optional[str] = None):
+        super().__init__(f"{endpoint.name} 返回 HTTP {status_code}")
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Endpoint:
+    """一个OpenAI兼容的上游端点，以及它的首token延迟EWMA和健康状态"""
+
+    def __init__(self, name: str, base_url: str, model: str, api_key_env: str = "SILICONFLOW_API_KEY"):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key_env = api_key_env
+        self.ttft: Optional[float] = None  # 首token延迟的EWMA（秒）
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {os.getenv(self.api_key_env)}",
+            "Content-Type": "application/json"
+        }
+
+    def record_ttft(self, seconds: float):
+        self.ttft = seconds if self.ttft is None else (1 - EWMA_ALPHA) * self.ttft + EWMA_ALPHA * seconds
+
+    def record_success(self):
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def record_failure(self):
+        # 连续失败时冷却时间翻倍（最多8倍）
+        self.failures += 1
+        self.cooldown_until = time.monotonic() + FAILURE_COOLDOWN * min(2 ** (self.failures - 1), 8)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "healthy": self.healthy,
+            "failures": self.failures
+        }
+
+
+def load_endpoints() -> List[Endpoint]:
+    if not LLM_ENDPOINTS:
+        return [Endpoint("default", LLM_API_BASE, LLM_MODEL)]
+    return [
+        Endpoint(
+            item.get("name") or item["base_url"],
+            item["base_url"],
+            item.get("model", LLM_MODEL),
+            item.get("api_key_env", "SILICONFLOW_API_KEY")
+        )
+        for item in json.loads(LLM_ENDPOINTS)
+    ]
+
+
+class UpstreamStream:
+    """已经收到首个SSE数据行的上游响应"""
+
+    def __init__(self, endpoint: Endpoint, response: httpx.Response, lines: AsyncIterator[str],
+                 first_line: Optional[str]):
+        self.endpoint = endpoint
+        self.response = response
+        self._lines = lines
+        self._first_line = first_line
+
+    async def lines(self) -> AsyncIterator[str]:
+        if self._first_line is not None:
+            yield self._first_line
+        async for line in self._lines:
+            yield line
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+class EndpointRouter:
+    """在多个上游端点之间路由：优先选首token延迟EWMA最低的健康端点，
+    首token迟迟不来时向下一个端点发对冲请求，先出首token的一方胜出，另一方立即取消；
+    端点返回错误或连接失败时进入冷却并切换到下一个端点。
+    """
+
+    def __init__(self, endpoints: Optional[List[Endpoint]] = None, hedge_after: float = HEDGE_AFTER):
+        self.endpoints = endpoints or load_endpoints()
+        self.hedge_after = hedge_after
+        # 统计计数
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def ranked(self) -> List[Endpoint]:
+        """健康端点按延迟排序（还没有测量数据的端点优先试探），冷却中的端点排在最后作为兜底"""
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+        cooling = sorted((endpoint for endpoint in self.endpoints if not endpoint.healthy),
+                         key=lambda endpoint: endpoint.cooldown_until)
+        healthy.sort(key=lambda endpoint: endpoint.ttft if endpoint.ttft is not None else 0.0)
+        return healthy + cooling
+
+    async def _open(self, http_client: httpx.AsyncClient, endpoint: Endpoint,
+                    payload: Dict[str, Any]) -> UpstreamStream:
+        """向单个端点发出请求，读到首个SSE数据行（或流结束）为止"""
+        with span("llm.first_byte", labels={"endpoint": endpoint.name}) as current:
+            started = current.started
+            request = http_client.build_request(
+                "POST", endpoint.url, headers=endpoint.headers(), json=dict(payload, model=endpoint.model))
+            # 新建连接时通过httpx的trace扩展记录TCP连接和TLS握手耗时（复用连接时没有这些事件）
+            connect: Dict[str, float] = {}
+
+            async def on_trace(event: str, info: dict):
+                if event == "connection.connect_tcp.started":
+                    connect["started"] = time.monotonic()
+                elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+                    connect["finished"] = time.monotonic()
+
+            request.extensions["trace"] = on_trace
+            try:
+                response = await http_client.send(request, stream=True)
+            finally:
+                if "finished" in connect:
+                    record("llm.connect", connect["started"], connect["finished"] - connect["started"],
+                           labels={"endpoint": endpoint.name})
+            current.attrs["status"] = response.status_code
+            try:
+                if response.status_code >= 400:
+                    raise UpstreamStatusError(endpoint, response.status_code, response.headers.get("Retry-After"))
+                lines = response.aiter_lines()
+                first_line = None
+                async for line in lines:
+                    if line.startswith("data: "):
+                        first_line = line
+                        break
+                endpoint.record_ttft(time.monotonic() - started)
+                endpoint.record_success()
+                return UpstreamStream(endpoint, response, lines, first_line)
+            except BaseException:
+                await response.aclose()
+                raise
+
+    async def open_stream(self, http_client: httpx.AsyncClient, payload: Dict[str, Any],
+                          timeout: Optional[float] = None) -> UpstreamStream:
+        """返回首个出token的端点的流；所有端点都失败时抛出最后一个错误
+
+        timeout为首字节超时（含对冲），超时抛出TimeoutError，仍在进行的端点计一次失败。
+        """
+        candidates = self.ranked()
+        attempts: Dict[asyncio.Task, tuple] = {}  # task -> (endpoint, 开始时间)
+        last_error: Optional[BaseException] = None
+        hedged = False
+        timed_out = False
+
+        def launch():
+            endpoint = candidates.pop(0)
+            attempts[asyncio.create_task(self._open(http_client, endpoint, payload))] = (endpoint, time.monotonic())
+
+        launch()
+        primary = next(iter(attempts.values()))[0]
+        try:
+            async with asyncio.timeout(timeout):
+                while attempts:
+                    wait_timeout = None
+                    if candidates and not hedged and self.hedge_after > 0:
+                        first_started = min(started for _, started in attempts.values())
+                        wait_timeout = max(self.hedge_after - (time.monotonic() - first_started), 0.0)
+                    done, _ = await asyncio.wait(attempts, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # 首token超时：对冲到下一个端点，两边谁先出首token用谁
+                        hedged = True
+                        self.hedges += 1
+                        launch()
+                        continue
+                    for task in done:
+                        endpoint, _ = attempts.pop(task)
+                        if task.exception() is None:
+                            stream = task.result()
+                            if hedged and endpoint is not primary:
+                                self.hedge_wins += 1
+                            return stream
+                        last_error = task.exception()
+                        if isinstance(last_error, UpstreamStatusError) and last_error.status_code not in RETRYABLE_STATUS:
+                            raise last_error  # 请求本身有问题（如400），换端点也无济于事
+                        endpoint.record_failure()
+                    # 失败：没有进行中的请求时切换到下一个端点
+                    if not attempts and candidates:
+                        launch()
+                raise last_error
+        except TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            # 取消落败的请求。它们没有出首token，不计入延迟（TTFT只在_open读到首个数据行时记录）；
+            # 首字节超时时计为失败，用户停止或对冲落败则不计
+            for task, (endpoint, _) in attempts.items():
+                task.cancel()
+                if timed_out and not task.done():
+                    endpoint.record_failure()
+            for task in attempts:
+                try:
+                    stream = await task
+                except BaseException:
+                    continue
+                await stream.aclose()  # 同时完成的另一方
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins
+        }
+
+
+_router: Optional[EndpointRouter] = None
+
+
+def get_router() -> EndpointRouter:
+    """返回进程内共享的端点路由器"""
+    global _router
+    if _router is None:
+        _router = EndpointRouter()
+    return _router
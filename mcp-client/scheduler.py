@@ -0,0 +1,236 @@
+# MCP\mcp-client\scheduler.py
+import asyncio
+import email.utils
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, AsyncGenerator
+
+# 上游LLM调用的准入控制配置（可通过环境变量调整）
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # 同时进行的上游请求数
+TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # token速率预算，0表示不限制
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "512"))  # 每次请求预留的输出token
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+LAST_SERVED_SIZE = 4096  # 记录最近放行时间的会话数上限
+QUEUE_STATUS_INTERVAL = 1.0  # 排队状态的最长刷新间隔（秒）
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """第attempt次重试前的等待时间：优先遵守Retry-After，否则指数退避加全抖动"""
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+        try:
+            # Retry-After也可以是HTTP日期
+            parsed = email.utils.parsedate_to_datetime(retry_after)
+            return min(max(parsed.timestamp() - time.time(), 0.0), RETRY_MAX_DELAY)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class _Ticket:
+    """一次上游调用的排队凭证"""
+
+    def __init__(self, scheduler: "LLMScheduler", session_id: str, tokens: int):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.tokens = tokens
+        self.admitted = False
+        self.released = False
+        self.admitted_at = 0.0
+        self.changed = asyncio.Event()  # 被放行或排队位置可能变化时置位
+
+    async def wait(self) -> AsyncGenerator[Dict[str, Any], None]:
+        """等待放行；排队期间在位置变化时产出 {"position", "eta"} 状态"""
+        last_position = None
+        try:
+            while not self.admitted:
+                position = self.scheduler.position(self)
+                if position != last_position:
+                    last_position = position
+                    yield {"position": position, "eta": self.scheduler.eta(position)}
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), QUEUE_STATUS_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class LLMScheduler:
+    """应用级的上游LLM调用调度器
+
+    - 并发上限：同时进行的请求数不超过max_concurrency；
+    - token速率预算：令牌桶按tokens_per_minute匀速补充，每次请求按估算的token数扣减；
+    - 公平：每个会话一个队列，按会话轮转放行，单个会话的连续请求不会饿死其他会话；
+    - 上游返回429时全局暂停放行（backoff），而不是让每个会话各自重试撞墙。
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, tokens_per_minute: int = TOKENS_PER_MINUTE):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self._queues: Dict[str, deque] = {}  # 会话 -> 排队中的请求
+        self._last_served: "OrderedDict[str, int]" = OrderedDict()  # 会话 -> 最近一次放行的序号
+        self._serial = 0
+        self._active = 0
+        self._bucket = float(tokens_per_minute)
+        self._bucket_updated = time.monotonic()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._avg_hold = 5.0  # 单次请求占用时间的EWMA（秒），用于估算排队时间
+        # 统计计数
+        self.admitted = 0
+        self.queued = 0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enqueue(self, session_id: str, tokens: int) -> _Ticket:
+        ticket = _Ticket(self, session_id, tokens)
+        self._queues.setdefault(session_id, deque()).append(ticket)
+        self._dispatch()
+        if not ticket.admitted:
+            self.queued += 1
+        return ticket
+
+    def _rotation(self) -> list:
+        """排队中的会话按轮转顺序排列：最久没有被放行的会话在前"""
+        return sorted(self._queues, key=lambda session_id: self._last_served.get(session_id, -1))
+
+    def position(self, ticket: _Ticket) -> int:
+        """按会话轮转计算前面还有多少个请求"""
+        queue = self._queues.get(ticket.session_id)
+        if not queue or ticket not in queue:
+            return 0
+        depth = queue.index(ticket) + 1
+        ahead = depth - 1
+        before = True  # 轮转顺序在本会话之前的会话，本轮也会先于本请求放行
+        for session_id in self._rotation():
+            if session_id == ticket.session_id:
+                before = False
+                continue
+            ahead += min(len(self._queues[session_id]), depth if before else depth - 1)
+        return ahead + 1
+
+    def eta(self, position: int) -> float:
+        """预计还需等待的秒数"""
+        rounds = math.ceil(max(position - (self.max_concurrency - self._active), 0) / self.max_concurrency)
+        eta = rounds * self._avg_hold + max(self._paused_until - time.monotonic(), 0.0)
+        return round(eta, 1)
+
+    def backoff(self, delay: float):
+        """上游限流：在delay秒内暂停放行新请求"""
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _refill(self, now: float):
+        if self.tokens_per_minute <= 0:
+            return
+        elapsed = now - self._bucket_updated
+        self._bucket = min(float(self.tokens_per_minute), self._bucket + elapsed * self.tokens_per_minute / 60)
+        self._bucket_updated = now
+
+    def _token_wait(self, tokens: int) -> float:
+        """令牌桶还需多久才够tokens（单次请求超过整个预算时按预算封顶）"""
+        if self.tokens_per_minute <= 0:
+            return 0.0
+        needed = min(tokens, self.tokens_per_minute) - self._bucket
+        return max(needed, 0.0) * 60 / self.tokens_per_minute
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        delay = 0.0
+        while self._queues and self._active < self.max_concurrency:
+            if now < self._paused_until:
+                delay = self._paused_until - now
+                break
+            session_id = min(self._queues, key=lambda session_id: self._last_served.get(session_id, -1))
+            queue = self._queues[session_id]
+            ticket = queue[0]
+            delay = self._token_wait(ticket.tokens)
+            if delay > 0:
+                break
+            if self.tokens_per_minute > 0:
+                self._bucket -= min(ticket.tokens, self.tokens_per_minute)
+            queue.popleft()
+            if not queue:
+                del self._queues[session_id]
+            # 轮转：记录放行序号，该会话的下一个请求排到其他会话之后
+            self._serial += 1
+            self._last_served[session_id] = self._serial
+            self._last_served.move_to_end(session_id)
+            while len(self._last_served) > LAST_SERVED_SIZE:
+                self._last_served.popitem(last=False)
+            self._active += 1
+            self.admitted += 1
+            ticket.admitted = True
+            ticket.admitted_at = now
+            ticket.changed.set()
+        # 其余排队者的位置可能变了
+        for queue in self._queues.values():
+            for waiting in queue:
+                waiting.changed.set()
+        if delay > 0 and self._queues:
+            self._schedule_wakeup(delay)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _release(self, ticket: _Ticket):
+        if ticket.admitted:
+            self._active -= 1
+            hold = time.monotonic() - ticket.admitted_at
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * hold
+        else:
+            # 排队中被取消：从队列中移除
+            queue = self._queues.get(ticket.session_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.session_id]
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "avg_hold": round(self._avg_hold, 3)
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    """返回进程内共享的调度器"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
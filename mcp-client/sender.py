@@ -0,0 +1,129 @@
+# MCP\mcp-client\sender.py
+import asyncio
+import json
+import os
+import time
+from typing import Optional, List, Dict, Any
+
+from fastapi import WebSocket
+
+try:
+    import msgpack  # 可选依赖：紧凑的二进制协议
+except ImportError:
+    msgpack = None
+
+# 文本块合并窗口：首个token立即发送，之后在窗口内到达的token合并成一帧
+COALESCE_INTERVAL = float(os.getenv("WS_COALESCE_INTERVAL", "0.02"))
+COALESCE_BYTES = int(os.getenv("WS_COALESCE_BYTES", "512"))
+# 发送队列上限：浏览器读得慢时生产方在此等待（反压），而不是无限制地缓冲
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+
+
+def negotiate_protocol(requested: Optional[str]) -> str:
+    """客户端通过 ?proto=msgpack 请求二进制协议，服务端未安装msgpack时退回json"""
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+
+class EventSender:
+    """WebSocket输出层：合并text_chunk，按协议编码后放入有界发送队列，由单独的写任务发送"""
+
+    def __init__(self, websocket: WebSocket, protocol: str = "json",
+                 interval: float = COALESCE_INTERVAL, max_bytes: int = COALESCE_BYTES,
+                 queue_size: int = SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._chunks: List[str] = []
+        self._buffered_bytes = 0
+        self._last_text_sent = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()  # 定时刷新和正常发送不能交错写入
+        self._queue: "asyncio.Queue[Optional[bytes | str]]" = asyncio.Queue(maxsize=queue_size)
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self._queue.get()
+                if frame is None:
+                    return
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        finally:
+            # 连接断开后清空队列，避免生产方阻塞在已满的队列上
+            while not self._queue.empty():
+                self._queue.get_nowait()
+
+    async def _write(self, event: Dict[str, Any]):
+        if self._writer.done():
+            raise ConnectionError("WebSocket发送任务已结束")
+        if self.protocol == "msgpack":
+            frame = msgpack.packb(event, use_bin_type=True)
+        else:
+            frame = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        await self._queue.put(frame)
+
+    async def _flush_locked(self):
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        if not self._chunks:
+            return
+        text = "".join(self._chunks)
+        self._chunks.clear()
+        self._buffered_bytes = 0
+        self._last_text_sent = time.monotonic()
+        await self._write({"type": "text_chunk", "data": text})
+
+    async def flush(self):
+        async with self._lock:
+            await self._flush_locked()
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def send(self, event: Dict[str, Any]):
+        async with self._lock:
+            if event["type"] != "text_chunk":
+                # 其他事件之前先把缓冲的文本发出去，保证顺序
+                await self._flush_locked()
+                await self._write(event)
+                return
+
+            text = event["data"]
+            since_last = time.monotonic() - self._last_text_sent
+            if not self._chunks and since_last >= self.interval:
+                # 距上一帧已超过窗口（例如首个token），不额外等待
+                self._last_text_sent = time.monotonic()
+                await self._write(event)
+                return
+
+            self._chunks.append(text)
+            self._buffered_bytes += len(text.encode("utf-8"))
+            if self._buffered_bytes >= self.max_bytes:
+                await self._flush_locked()
+            elif self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later(max(0.0, self.interval - since_last)))
+
+    async def close(self):
+        """发出剩余的缓冲并等待写任务把队列写完"""
+        if self._writer.done():
+            return
+        try:
+            await self.flush()
+            await self._queue.put(None)
+            await self._writer
+        except Exception:
+            pass  # 连接已断开时丢弃剩余的缓冲
+
+    def abort(self):
+        """连接已断开：不再发送任何内容"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._writer.cancel()
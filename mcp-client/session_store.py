@@ -0,0 +1,131 @@
+# MCP\mcp-client\session_store.py
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, Callable
+
+# 会话存储配置（可通过环境变量调整）
+SESSION_DB_PATH = os.getenv("MCP_SESSION_DB", "sessions.sqlite3")
+SESSION_TTL = float(os.getenv("MCP_SESSION_TTL", str(7 * 24 * 3600)))  # 超过此时间未更新的会话被清理
+SESSION_FLUSH_INTERVAL = float(os.getenv("MCP_SESSION_FLUSH_INTERVAL", "1.0"))  # 写回间隔（秒）
+
+
+class SessionStore(abc.ABC):
+    """会话状态存储接口
+
+    状态是可JSON序列化的dict（对话历史、工具调用记录）。多个worker/节点共享同一个存储时，
+    任何一个worker都可以接管重连的会话。基于Redis等外部服务的实现只需提供这三个方法。
+    """
+
+    @abc.abstractmethod
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话状态，不存在时返回None"""
+
+    @abc.abstractmethod
+    async def save_many(self, states: Dict[str, Dict[str, Any]]):
+        """批量写入多个会话的状态"""
+
+    async def close(self):
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """默认实现：本机SQLite文件（WAL模式，同一台机器上的多个uvicorn worker可以共享）"""
+
+    def __init__(self, db_path: str = SESSION_DB_PATH, ttl: float = SESSION_TTL):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, updated_at REAL NOT NULL, state TEXT NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - ttl,))
+            self._conn.commit()
+
+    def _load(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def _save_many(self, rows: list):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions (id, updated_at, state) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        state = await asyncio.to_thread(self._load, session_id)
+        return json.loads(state) if state else None
+
+    async def save_many(self, states: Dict[str, Dict[str, Any]]):
+        def encode_and_save():
+            now = time.time()
+            rows = [(session_id, now, json.dumps(state, ensure_ascii=False)) for session_id, state in states.items()]
+            self._save_many(rows)
+        await asyncio.to_thread(encode_and_save)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionWriter:
+    """写回缓冲：热路径上只标记会话为脏（O(1)），由后台任务按间隔批量快照并写入存储"""
+
+    def __init__(self, store: SessionStore, interval: float = SESSION_FLUSH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._dirty: Dict[str, Callable[[], Dict[str, Any]]] = {}  # 会话 -> 生成状态快照的函数
+        self._task: Optional[asyncio.Task] = None
+        # 统计计数
+        self.flushes = 0
+        self.writes = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def mark_dirty(self, session_id: str, snapshot: Callable[[], Dict[str, Any]]):
+        self._dirty[session_id] = snapshot
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话状态；还没写回的本进程修改优先"""
+        snapshot = self._dirty.get(session_id)
+        if snapshot is not None:
+            return snapshot()
+        return await self.store.load(session_id)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        # 快照在事件循环中生成（只复制引用），编码和写入在线程中进行
+        states = {session_id: snapshot() for session_id, snapshot in dirty.items()}
+        try:
+            await self.store.save_many(states)
+        except Exception:
+            # 写入失败：放回待写集合，下次重试（期间更新过的会话以新快照为准）
+            for session_id, snapshot in dirty.items():
+                self._dirty.setdefault(session_id, snapshot)
+            raise
+        self.flushes += 1
+        self.writes += len(states)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # 存储暂时不可用时保留脏数据，下个周期重试
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+        await self.store.close()
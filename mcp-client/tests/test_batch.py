@@ -0,0 +1,50 @@
+# MCP\mcp-client\tests\test_batch.py
+import json
+
+from batch import ResultWriter, load_done, parse_item
+
+
+def read_records(path) -> list:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_parse_item_formats():
+    assert parse_item(0, "   \n") is None
+    item = parse_item(3, '{"id": "q1", "query": ["加州有什么警报", "那纽约呢"]}')
+    assert (item.index, item.id, item.queries) == (3, "q1", ["加州有什么警报", "那纽约呢"])
+    item = parse_item(1, '{"request_id": "user-001", "title": "标题", "body": "正文"}')
+    assert (item.id, item.queries) == ("user-001", ["标题\n\n正文"])
+    item = parse_item(2, "北京明天天气怎么样\n")
+    assert (item.id, item.queries) == ("2", ["北京明天天气怎么样"])
+
+
+def test_load_done_truncates_partial_last_line(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"id": "a", "error": null}\n{"id": "b", "error": "超时"}\n{"id": "c", "er', encoding="utf-8")
+    assert load_done(str(output), retry_errors=False) == {"a", "b"}
+    assert output.read_text(encoding="utf-8").endswith('"超时"}\n')
+    assert load_done(str(output), retry_errors=True) == {"a"}
+    assert load_done(str(tmp_path / "missing.jsonl"), retry_errors=False) == set()
+
+
+def test_ordered_writer_waits_for_gaps_and_skips(tmp_path):
+    output = tmp_path / "results.jsonl"
+    writer = ResultWriter(str(output), ordered=True, skipped=set())
+    writer.skip(1)
+    writer.write(2, {"id": "2"})
+    assert output.read_text(encoding="utf-8") == ""  # 0还没完成
+    writer.write(0, {"id": "0"})
+    assert [record["id"] for record in read_records(output)] == ["0", "2"]
+    writer.write(4, {"id": "4"})
+    writer.close()  # 被中断：缺失的3之后已完成的结果也要写出
+    assert [record["id"] for record in read_records(output)] == ["0", "2", "4"]
+
+
+def test_unordered_writer_appends_on_resume(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text('{"id": "old"}\n', encoding="utf-8")
+    writer = ResultWriter(str(output), ordered=False, skipped=set())
+    writer.write(5, {"id": "5"})
+    writer.write(1, {"id": "1"})
+    writer.close()
+    assert [record["id"] for record in read_records(output)] == ["old", "5", "1"]
@@ -0,0 +1,140 @@
+# MCP\mcp-client\tests\test_cache.py
+import asyncio
+import json
+
+from mcp.types import CallToolResult, TextContent
+
+import cache
+from cache import ToolResultCache, cache_key, is_cacheable
+
+
+def text_result(text: str, is_error: bool = False) -> CallToolResult:
+    return CallToolResult(content=[TextContent(type="text", text=text)], isError=is_error)
+
+
+class CountingCall:
+    """模拟上游工具调用，记录调用次数"""
+
+    def __init__(self, *results: CallToolResult, delay: float = 0.0):
+        self.results = list(results)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self) -> CallToolResult:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.results[min(self.calls, len(self.results)) - 1]
+
+
+def test_cache_key_ignores_argument_order_and_whitespace():
+    assert cache_key("get_alerts", {"state": "CA", "limit": 5}) == cache_key("get_alerts", '{"limit":5,  "state":"CA"}')
+
+
+def test_hit_within_ttl_and_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    tool_cache = ToolResultCache(ttls={"get_forecast": 600})
+    call = CountingCall(text_result("晴"), text_result("雨"))
+
+    async def run():
+        first = await tool_cache.get_or_call("get_forecast", {"latitude": 1}, call)
+        now[0] += 599
+        second = await tool_cache.get_or_call("get_forecast", {"latitude": 1}, call)
+        now[0] += 2
+        third = await tool_cache.get_or_call("get_forecast", {"latitude": 1}, call)
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first.content[0].text == "晴"
+    assert second.content[0].text == "晴"
+    assert third.content[0].text == "雨"
+    assert call.calls == 2
+    assert tool_cache.hits == 1 and tool_cache.misses == 2
+
+
+def test_zero_ttl_is_not_cached():
+    tool_cache = ToolResultCache(ttls={}, default_ttl=0)
+    call = CountingCall(text_result("x"))
+
+    async def run():
+        await tool_cache.get_or_call("other", {}, call)
+        await tool_cache.get_or_call("other", {}, call)
+
+    asyncio.run(run())
+    assert call.calls == 2
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    tool_cache = ToolResultCache(ttls={"web_search": 3600})
+    call = CountingCall(text_result("结果"), delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*(tool_cache.get_or_call("web_search", {"query": "q"}, call) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert call.calls == 1
+    assert tool_cache.coalesced == 4
+    assert all(result.content[0].text == "结果" for result in results)
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    tool_cache = ToolResultCache(ttls={"web_search": 3600})
+    call = CountingCall(text_result("结果"), delay=0.05)
+
+    async def run():
+        first = asyncio.create_task(tool_cache.get_or_call("web_search", {"query": "q"}, call))
+        second = asyncio.create_task(tool_cache.get_or_call("web_search", {"query": "q"}, call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()).content[0].text == "结果"
+    assert call.calls == 1
+
+
+def test_upstream_failure_is_not_cached():
+    """工具抛出异常（isError）时不缓存，下一次调用重新请求上游"""
+    tool_cache = ToolResultCache(ttls={"web_search": 3600})
+    call = CountingCall(text_result("Error executing tool web_search: 无法获取搜索结果，请稍后重试", is_error=True),
+                        text_result("结果"))
+
+    async def run():
+        failed = await tool_cache.get_or_call("web_search", {"query": "q"}, call)
+        recovered = await tool_cache.get_or_call("web_search", {"query": "q"}, call)
+        cached = await tool_cache.get_or_call("web_search", {"query": "q"}, call)
+        return failed, recovered, cached
+
+    failed, recovered, cached = asyncio.run(run())
+    assert failed.isError
+    assert recovered.content[0].text == "结果" and cached.content[0].text == "结果"
+    assert call.calls == 2
+
+
+def test_partial_failure_is_not_cached():
+    partial = text_result(json.dumps({"summary": {"failed": 1}, "partial": True}))
+    tool_cache = ToolResultCache(ttls={"get_alerts_multi": 60})
+    call = CountingCall(partial, text_result('{"summary":{"failed":0}}'))
+
+    async def run():
+        await tool_cache.get_or_call("get_alerts_multi", {"states": ["CA", "NY"]}, call)
+        await tool_cache.get_or_call("get_alerts_multi", {"states": ["CA", "NY"]}, call)
+        await tool_cache.get_or_call("get_alerts_multi", {"states": ["CA", "NY"]}, call)
+
+    asyncio.run(run())
+    assert call.calls == 2
+    assert not is_cacheable(partial)
+    assert is_cacheable(text_result('{"summary":{"partial_text":"x"}}'))
+
+
+def test_lru_eviction():
+    tool_cache = ToolResultCache(ttls={"t": 60}, max_entries=2)
+    call = CountingCall(text_result("x"))
+
+    async def run():
+        for arguments in ({"a": 1}, {"a": 2}, {"a": 3}, {"a": 1}):
+            await tool_cache.get_or_call("t", arguments, call)
+
+    asyncio.run(run())
+    assert call.calls == 4  # {"a": 1}已被淘汰
+    assert tool_cache.stats()["entries"] == 2
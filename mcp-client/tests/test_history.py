@@ -0,0 +1,75 @@
+# MCP\mcp-client\tests\test_history.py
+import history
+from history import ConversationHistory, STUB_MARKER
+
+
+def tool_turn(question: str, result: str, answer: str = "好的") -> list:
+    return [
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": "", "tool_calls": [
+            {"id": "c1", "type": "function", "function": {"name": "search", "arguments": "{}"}}]},
+        {"role": "tool", "tool_call_id": "c1", "content": result},
+        {"role": "assistant", "content": answer},
+    ]
+
+
+def extend(conversation: ConversationHistory, messages: list):
+    for message in messages:
+        conversation.append(message)
+
+
+def test_token_count_maintained_incrementally():
+    conversation = ConversationHistory(token_budget=10_000)
+    extend(conversation, tool_turn("天气", "晴" * 50))
+    assert conversation.total_tokens == sum(history.message_tokens(m) for m in conversation)
+
+
+def test_previous_turn_tool_results_are_stubbed():
+    conversation = ConversationHistory(token_budget=100_000)
+    extend(conversation, tool_turn("第一问", "x" * 2000))
+    assert conversation[2]["content"] == "x" * 2000  # 当前轮不压缩
+    conversation.append({"role": "user", "content": "第二问"})
+    stub = conversation[2]["content"]
+    assert stub.startswith("x" * history.TOOL_RESULT_STUB_CHARS) and STUB_MARKER in stub
+    assert conversation[2]["tool_call_id"] == "c1"
+
+
+def test_oldest_turns_dropped_and_folded_into_summary():
+    conversation = ConversationHistory(token_budget=300)
+    for i in range(5):
+        extend(conversation, tool_turn(f"问题{i}", "短结果", answer=f"回答{i}" * 10))
+    assert conversation.request_tokens <= conversation.token_budget
+    assert conversation[0]["role"] == "user" and conversation[0]["content"] != "问题0"
+    assert "问题0" in conversation.summary
+    assert conversation.for_request()[0]["role"] == "system"
+
+
+def test_oversized_current_turn_is_shrunk():
+    conversation = ConversationHistory(token_budget=500, summary_enabled=False)
+    extend(conversation, tool_turn("旧问题", "旧结果"))
+    turn = tool_turn("新问题", "大" * 3000)
+    turn.insert(3, {"role": "tool", "tool_call_id": "c2", "content": "小" * 100})
+    extend(conversation, turn)
+    assert conversation[0]["content"] == "新问题"  # 旧轮次先被丢弃
+    assert conversation.request_tokens <= conversation.token_budget
+    assert STUB_MARKER in conversation[2]["content"]
+    assert conversation[3]["content"] == "小" * 100  # 最大的压缩后已够，其余保持原样
+
+
+def test_stub_not_compacted_twice():
+    conversation = ConversationHistory(token_budget=450, summary_enabled=False)
+    extend(conversation, tool_turn("问题", "大" * 3000))
+    stub = conversation[2]["content"]
+    assert STUB_MARKER in stub
+    conversation.append({"role": "user", "content": "下一问"})
+    assert conversation[2]["content"] == stub
+
+
+def test_restore_enforces_smaller_budget():
+    conversation = ConversationHistory(token_budget=100_000)
+    for i in range(3):
+        extend(conversation, tool_turn(f"问题{i}", "结果" * 300))
+    restored = ConversationHistory.from_dict(conversation.to_dict(), token_budget=400, summary_enabled=False)
+    assert restored.request_tokens <= 400
+    assert restored[0]["content"] == "问题2"
+    assert restored[-1]["content"] == "好的"
@@ -0,0 +1,90 @@
+# MCP\mcp-client\tests\test_scheduler.py
+import asyncio
+import email.utils
+import time
+
+import scheduler
+from scheduler import LLMScheduler, retry_delay
+
+
+def admit_all(llm_scheduler: LLMScheduler, tickets: list) -> list:
+    """逐个释放已放行的请求，返回放行顺序（会话id）"""
+    order = []
+    while any(not ticket.released for ticket in tickets):
+        ticket = next(ticket for ticket in tickets if ticket.admitted and not ticket.released)
+        order.append(ticket.session_id)
+        ticket.release()
+    return order
+
+
+def test_sessions_served_round_robin():
+    llm_scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    tickets = [llm_scheduler.enqueue("a", 100) for _ in range(3)]
+    tickets += [llm_scheduler.enqueue("b", 100), llm_scheduler.enqueue("c", 100), llm_scheduler.enqueue("b", 100)]
+    assert llm_scheduler.active == 1 and llm_scheduler.waiting == 5
+    assert admit_all(llm_scheduler, tickets) == ["a", "b", "c", "a", "b", "a"]
+    assert llm_scheduler.stats()["admitted"] == 6
+
+
+def test_queue_position_follows_rotation():
+    llm_scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    llm_scheduler.enqueue("a", 100)  # 已放行
+    a2, a3 = llm_scheduler.enqueue("a", 100), llm_scheduler.enqueue("a", 100)
+    b1 = llm_scheduler.enqueue("b", 100)
+    assert [llm_scheduler.position(ticket) for ticket in (b1, a2, a3)] == [1, 2, 3]
+
+
+def test_cancelled_ticket_leaves_queue():
+    llm_scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    first = llm_scheduler.enqueue("a", 100)
+    waiting = llm_scheduler.enqueue("b", 100)
+    waiting.release()
+    assert llm_scheduler.waiting == 0
+    first.release()
+    assert llm_scheduler.active == 0 and not waiting.admitted
+
+
+def test_retry_delay_honours_retry_after(monkeypatch):
+    assert retry_delay(0, "2") == 2.0
+    assert retry_delay(0, "-5") == 0.0
+    assert retry_delay(0, "3600") == scheduler.RETRY_MAX_DELAY
+    http_date = email.utils.formatdate(time.time() + 5, usegmt=True)
+    assert 3.5 <= retry_delay(0, http_date) <= 5.0
+    # 无法解析时退回指数退避加全抖动
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)
+    assert retry_delay(2, "soon") == min(scheduler.RETRY_MAX_DELAY, scheduler.RETRY_BASE_DELAY * 4)
+    assert retry_delay(30) == scheduler.RETRY_MAX_DELAY
+
+
+def test_backoff_pauses_admission_until_delay_passes():
+    async def run():
+        llm_scheduler = LLMScheduler(max_concurrency=4, tokens_per_minute=0)
+        llm_scheduler.backoff(0.1)
+        ticket = llm_scheduler.enqueue("a", 100)
+        assert not ticket.admitted
+        statuses = []
+        async for status in ticket.wait():
+            statuses.append(status)
+        assert ticket.admitted
+        assert statuses and statuses[0]["position"] == 1 and statuses[0]["eta"] > 0
+        ticket.release()
+
+    started = time.monotonic()
+    asyncio.run(run())
+    assert time.monotonic() - started >= 0.1
+
+
+def test_token_budget_delays_next_request():
+    async def run():
+        llm_scheduler = LLMScheduler(max_concurrency=4, tokens_per_minute=600)  # 每秒补充10个token
+        first = llm_scheduler.enqueue("a", 600)
+        second = llm_scheduler.enqueue("b", 1)
+        assert first.admitted and not second.admitted
+        waited = time.monotonic()
+        async for _ in second.wait():
+            pass
+        assert time.monotonic() - waited >= 0.05
+        first.release()
+        second.release()
+
+    asyncio.run(run())
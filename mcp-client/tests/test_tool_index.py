@@ -0,0 +1,70 @@
+# MCP\mcp-client\tests\test_tool_index.py
+from tool_index import ToolIndex, tokenize, tool_name, tools_tokens
+
+
+def make_tool(name: str, description: str, **properties: str) -> dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": {key: {"type": "string", "description": value} for key, value in properties.items()}
+            }
+        }
+    }
+
+
+TOOLS = [
+    make_tool("get_alerts", "获取美国某个州的天气警报", state="两个字母的州代码"),
+    make_tool("get_forecast", "获取某个位置的天气预报", latitude="纬度", longitude="经度"),
+    make_tool("web_search", "在网络上搜索最新信息", query="搜索关键词"),
+    make_tool("read_file", "读取本地文件的内容", path="文件路径"),
+    make_tool("list_directory", "列出目录中的文件", path="目录路径"),
+    make_tool("run_sql", "在数据库上执行SQL查询", sql="SQL语句"),
+    make_tool("send_email", "发送电子邮件", to="收件人", body="正文"),
+]
+
+
+def names(tools: list) -> list:
+    return [tool_name(tool) for tool in tools]
+
+
+def test_tokenize_splits_words_and_cjk_bigrams():
+    assert tokenize("get_alerts for CA") == ["get", "alerts", "for", "ca"]
+    assert tokenize("天气预报") == ["天气", "气预", "预报"]
+    assert tokenize("州 X") == ["州", "x"]
+
+
+def test_bm25_ranks_most_relevant_tool_first():
+    index = ToolIndex(TOOLS)
+    scores = index.scores("明天的天气预报怎么样")
+    ranked = sorted(range(len(TOOLS)), key=lambda i: scores[i], reverse=True)
+    assert tool_name(TOOLS[ranked[0]]) == "get_forecast"
+    assert scores[names(TOOLS).index("send_email")] == 0
+
+
+def test_name_terms_outweigh_description_terms():
+    index = ToolIndex(TOOLS)
+    scores = index.scores("alerts")
+    assert scores[names(TOOLS).index("get_alerts")] > 0
+    assert all(score == 0 for i, score in enumerate(scores) if names(TOOLS)[i] != "get_alerts")
+
+
+def test_select_keeps_top_k_pinned_and_sticky_in_original_order():
+    index = ToolIndex(TOOLS)
+    selected = index.select("天气预报", top_k=1, pinned=["send_email"], sticky=["read_file", "unknown_tool"])
+    assert names(selected) == ["get_forecast", "read_file", "send_email"]
+    assert tools_tokens(selected) < index.full_tokens
+
+
+def test_select_with_only_sticky_tools_when_nothing_matches():
+    index = ToolIndex(TOOLS)
+    assert names(index.select("你好", top_k=2, sticky=["web_search"])) == ["web_search"]
+
+
+def test_select_falls_back_to_all_tools():
+    index = ToolIndex(TOOLS)
+    assert index.select("你好", top_k=2) == TOOLS  # 没有相关工具也没有最近用过的工具
+    assert index.select("天气", top_k=len(TOOLS)) == TOOLS  # 工具数不超过top_k
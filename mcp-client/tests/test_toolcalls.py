@@ -0,0 +1,76 @@
+# MCP\mcp-client\tests\test_toolcalls.py
+import asyncio
+import os
+
+import toolcalls
+from toolcalls import ToolCallLog, find_log
+
+
+def finish(log: ToolCallLog, tool_call_id, result: str, success: bool = True):
+    return asyncio.run(log.finish(tool_call_id, result, success))
+
+
+def test_small_result_kept_in_memory():
+    log = ToolCallLog()
+    log.start("c1", "get_alerts", '{"state": "CA"}')
+    record = finish(log, "c1", "没有警报")
+    assert record["status"] == "completed" and not record["spilled"]
+    assert log.full_result("c1") == "没有警报"
+    assert find_log(log.log_id) is log
+    log.close()
+
+
+def test_large_result_spilled_to_disk_and_read_back(monkeypatch):
+    monkeypatch.setattr(toolcalls, "SPILL_BYTES", 100)
+    log = ToolCallLog()
+    log.start("c1", "get_forecast", "{}")
+    result = "晴" * 1000
+    record = finish(log, "c1", result)
+    assert record["spilled"] and record["result"] == result[:toolcalls.PREVIEW_CHARS]
+    assert record["size"] == len(result)
+    assert log.full_result("c1") == result
+    event = log.delta(record, "result")
+    assert event["url"] == f"/tool_results/{log.log_id}/c1"
+    log.close()
+
+
+def test_spill_without_tool_call_id(monkeypatch):
+    monkeypatch.setattr(toolcalls, "SPILL_BYTES", 10)
+    log = ToolCallLog()
+    log.start(None, "search", "{}")
+    finish(log, None, "x" * 100)
+    assert log.full_result(None) == "x" * 100
+    log.close()
+
+
+def test_ring_buffer_evicts_oldest_and_removes_spill_file(monkeypatch):
+    monkeypatch.setattr(toolcalls, "SPILL_BYTES", 10)
+    log = ToolCallLog(maxlen=2)
+    log.start("c1", "search", "{}")
+    finish(log, "c1", "x" * 100)
+    spill_path = log._spill_path("c1")
+    assert os.path.exists(spill_path)
+    log.start("c2", "search", "{}")
+    log.start("c3", "search", "{}")
+    assert [record["id"] for record in log] == ["c2", "c3"]
+    assert log.get("c1") is None and log.full_result("c1") is None
+    assert not os.path.exists(spill_path)
+    log.close()
+
+
+def test_restore_keeps_preview_and_marks_it(monkeypatch):
+    monkeypatch.setattr(toolcalls, "SPILL_BYTES", 10)
+    log = ToolCallLog()
+    log.start("c1", "search", "{}")
+    finish(log, "c1", "x" * 1000)
+    log.start("c2", "search", "{}")
+    finish(log, "c2", "短", success=False)
+
+    restored = ToolCallLog()
+    restored.restore(log.to_list())
+    log.close()
+    assert restored.is_preview("c1") and not restored.is_preview("c2")
+    assert restored.full_result("c1") == "x" * toolcalls.PREVIEW_CHARS
+    assert restored.get("c2")["status"] == "error"
+    assert "spill_name" not in restored.get("c1")
+    restored.close()
@@ -0,0 +1,137 @@
+# MCP\mcp-client\tool_index.py
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Optional
+
+from history import estimate_tokens
+
+# 工具裁剪配置（可通过环境变量调整）
+TOOL_PRUNING = os.getenv("MCP_TOOL_PRUNING", "1") == "1"
+TOOL_TOP_K = int(os.getenv("MCP_TOOL_TOP_K", "5"))  # 每次请求最多发送的相关工具数（不含固定工具）
+PINNED_TOOLS = [name for name in os.getenv("MCP_PINNED_TOOLS", "").split(",") if name]  # 总是发送的工具
+NAME_WEIGHT = 3  # 工具名中的词在文档中重复的次数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[⺀-鿿豈-﫿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """英文/数字按词切分（get_alerts -> get, alerts），中日韩文字切成相邻双字（“的”“一”这类单字噪声太大），无需分词词典"""
+    tokens = []
+    for word in _WORD_RE.findall(text.lower()):
+        if ord(word[0]) < 0x2E80 or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def tool_name(tool: Dict) -> str:
+    return tool["function"]["name"]
+
+
+def tool_text(tool: Dict) -> List[str]:
+    """用于检索的工具文本：名称（加权）、描述、参数名及参数描述"""
+    function = tool["function"]
+    tokens = tokenize(function["name"].replace("_", " ")) * NAME_WEIGHT
+    tokens += tokenize(function.get("description") or "")
+    for name, schema in (function.get("parameters") or {}).get("properties", {}).items():
+        tokens += tokenize(name.replace("_", " "))
+        if isinstance(schema, dict):
+            tokens += tokenize(schema.get("description") or schema.get("title") or "")
+    return tokens
+
+
+def tools_tokens(tools: Iterable[Dict]) -> int:
+    """工具定义在请求中大约占用的token数"""
+    tools = list(tools)
+    return estimate_tokens(json.dumps(tools, ensure_ascii=False)) if tools else 0
+
+
+class ToolIndex:
+    """工具名称/描述上的BM25索引，在工具列表确定时构建一次"""
+
+    def __init__(self, tools: List[Dict]):
+        self.tools = list(tools)
+        self.by_name = {tool_name(tool): tool for tool in self.tools}
+        self._docs = [Counter(tool_text(tool)) for tool in self.tools]
+        self._lengths = [sum(doc.values()) for doc in self._docs]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        document_frequency = Counter(term for doc in self._docs for term in doc)
+        count = len(self._docs)
+        self._idf = {
+            term: math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        self.full_tokens = tools_tokens(self.tools)
+
+    def __len__(self) -> int:
+        return len(self.tools)
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in tokenize(query) if term in self._idf]
+        scores = []
+        for doc, length in zip(self._docs, self._lengths):
+            score = 0.0
+            for term in terms:
+                frequency = doc.get(term, 0)
+                if frequency:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_length)
+                    score += self._idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            scores.append(score)
+        return scores
+
+    def select(self, query: str, top_k: int = TOOL_TOP_K, pinned: Iterable[str] = (),
+               sticky: Iterable[str] = ()) -> List[Dict]:
+        """按相关性挑选工具：固定工具 + 最近用过的工具 + 得分最高的top_k个
+
+        查询与任何工具都不相关、又没有最近用过的工具时返回全部工具，
+        避免因为检索漏召回而让模型无工具可用。
+        """
+        if len(self.tools) <= top_k:
+            return list(self.tools)
+        scores = self.scores(query)
+        ranked = sorted((index for index, score in enumerate(scores) if score > 0),
+                        key=lambda index: scores[index], reverse=True)[:top_k]
+        keep = {name for name in list(pinned) + list(sticky) if name in self.by_name}
+        if not ranked and not keep:
+            return list(self.tools)
+        keep.update(tool_name(self.tools[index]) for index in ranked)
+        # 保持工具原有顺序，相同工具集合的请求前缀一致，利于上游的前缀缓存
+        return [tool for tool in self.tools if tool_name(tool) in keep]
+
+
+class PruningStats:
+    """工具裁剪节省的请求体积统计（进程级）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+        self.full_tools = 0
+        self.sent_tools = 0
+
+    def record(self, full_tokens: int, sent_tokens: int, full_tools: int, sent_tools: int):
+        self.requests += 1
+        self.full_tokens += full_tokens
+        self.sent_tokens += sent_tokens
+        self.full_tools += full_tools
+        self.sent_tools += sent_tools
+
+    def stats(self) -> Dict[str, Any]:
+        saved = self.full_tokens - self.sent_tokens
+        return {
+            "requests": self.requests,
+            "tool_tokens_full": self.full_tokens,
+            "tool_tokens_sent": self.sent_tokens,
+            "tool_tokens_saved": saved,
+            "saved_ratio": saved / self.full_tokens if self.full_tokens else 0.0,
+            "avg_tools_sent": self.sent_tools / self.requests if self.requests else 0.0
+        }
+
+
+pruning_stats = PruningStats()
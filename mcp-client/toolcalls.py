@@ -0,0 +1,150 @@
+# MCP\mcp-client\toolcalls.py
+import asyncio
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+# 工具调用记录配置（可通过环境变量调整）
+TOOL_LOG_SIZE = int(os.getenv("TOOL_LOG_SIZE", "50"))  # 每个会话保留的工具调用数
+SPILL_BYTES = int(os.getenv("TOOL_LOG_SPILL_BYTES", "4096"))  # 超过此大小的结果写入磁盘
+PREVIEW_CHARS = int(os.getenv("TOOL_LOG_PREVIEW_CHARS", "500"))  # 增量事件中携带的结果预览长度
+
+# log_id -> ToolCallLog，供 /tool_results 接口按需读取完整结果
+_logs: "weakref.WeakValueDictionary[str, ToolCallLog]" = weakref.WeakValueDictionary()
+
+
+def find_log(log_id: str) -> Optional["ToolCallLog"]:
+    return _logs.get(log_id)
+
+
+class ToolCallLog:
+    """按tool_call id索引的工具调用环形缓冲区，大结果落盘，内存中只保留预览"""
+
+    def __init__(self, maxlen: int = TOOL_LOG_SIZE):
+        self.log_id = uuid.uuid4().hex
+        self.maxlen = maxlen
+        self.records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._spill_dir: Optional[str] = None
+        _logs[self.log_id] = self
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def get(self, tool_call_id: str) -> Optional[Dict[str, Any]]:
+        return self.records.get(tool_call_id)
+
+    def start(self, tool_call_id: str, name: str, arguments: str) -> Dict[str, Any]:
+        record = {
+            "id": tool_call_id,
+            "name": name,
+            "arguments": arguments,
+            "status": "processing",
+            "result": "",
+            "size": 0,
+            "spilled": False,
+            "truncated": False  # 恢复的记录：完整结果留在了原进程，result只是预览
+        }
+        self.records[tool_call_id] = record
+        self.records.move_to_end(tool_call_id)
+        while len(self.records) > self.maxlen:
+            _, evicted = self.records.popitem(last=False)
+            self._drop_spill(evicted)
+        return record
+
+    async def finish(self, tool_call_id: str, result: str, success: bool) -> Dict[str, Any]:
+        record = self.records.get(tool_call_id)
+        if record is None:
+            record = self.start(tool_call_id, "", "")
+        record["status"] = "completed" if success else "error"
+        record["size"] = len(result)
+        if len(result.encode("utf-8")) > SPILL_BYTES:
+            # 写文件放到线程中，不阻塞事件循环
+            await asyncio.to_thread(self._write_spill, self._spill_path(tool_call_id), result)
+            record["result"] = result[:PREVIEW_CHARS]
+            record["spilled"] = True
+            if self.records.get(tool_call_id) is not record:
+                self._drop_spill(record)  # 写入期间记录已被挤出环形缓冲区
+        else:
+            record["result"] = result
+        return record
+
+    @staticmethod
+    def _write_spill(path: str, result: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(result)
+
+    def is_preview(self, tool_call_id: str) -> bool:
+        """记录中只有结果的预览（从会话存储恢复、完整结果已不可用）"""
+        record = self.records.get(tool_call_id)
+        return bool(record and record.get("truncated"))
+
+    def full_result(self, tool_call_id: str) -> Optional[str]:
+        """完整结果；恢复的记录只有预览时返回预览（用is_preview区分）"""
+        record = self.records.get(tool_call_id)
+        if record is None:
+            return None
+        if not record["spilled"]:
+            return record["result"]
+        with open(self._spill_path(tool_call_id), encoding="utf-8") as f:
+            return f.read()
+
+    def delta(self, record: Dict[str, Any], phase: str, data: Optional[str] = None) -> Dict[str, Any]:
+        """单个工具调用的增量事件（start/progress/result/error），progress的data为工具新输出的部分内容"""
+        event = {"type": "tool_call_delta", "id": record["id"], "phase": phase}
+        if phase == "progress":
+            event["data"] = data
+        elif phase == "start":
+            event["name"] = record["name"]
+            event["args"] = record["arguments"]
+        elif phase in ("result", "error"):
+            event["result"] = record["result"][:PREVIEW_CHARS]
+            event["size"] = record["size"]
+            if record["size"] > PREVIEW_CHARS:
+                event["url"] = f"/tool_results/{self.log_id}/{record['id']}"
+        return event
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """可持久化的记录（见session_store.py）：落盘的大结果只保存预览并标记为truncated，完整内容仍留在本进程"""
+        records = []
+        for record in self.records.values():
+            record = {key: value for key, value in record.items() if key != "spill_name"}
+            if record["spilled"]:
+                record.update(spilled=False, truncated=True)
+            records.append(record)
+        return records
+
+    def restore(self, records: List[Dict[str, Any]]):
+        for record in records[-self.maxlen:]:
+            self.records[record["id"]] = dict(record, spilled=False, truncated=bool(record.get("truncated")))
+
+    def _spill_path(self, tool_call_id: Optional[str]) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="mcp-tool-results-")
+        record = self.records.get(tool_call_id)
+        if record is not None and record.get("spill_name"):
+            return os.path.join(self._spill_dir, record["spill_name"])
+        # 模型返回的tool_call可能没有id，此时生成随机文件名，并记在记录中供之后读取和删除
+        name = uuid.uuid5(uuid.NAMESPACE_OID, tool_call_id).hex if tool_call_id else uuid.uuid4().hex
+        if record is not None:
+            record["spill_name"] = f"{name}.txt"
+        return os.path.join(self._spill_dir, f"{name}.txt")
+
+    def _drop_spill(self, record: Dict[str, Any]):
+        if record["spilled"] and self._spill_dir is not None:
+            try:
+                os.remove(os.path.join(self._spill_dir, record["spill_name"]))
+            except OSError:
+                pass
+
+    def close(self):
+        _logs.pop(self.log_id, None)
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
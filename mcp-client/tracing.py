@@ -0,0 +1,135 @@
+# MCP\mcp-client\tracing.py
+import contextvars
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator
+
+from metrics import span_seconds
+
+# 是否默认向界面发送每轮查询的瀑布图事件（客户端也可以在查询消息中用 "trace": true 单独请求）
+TRACE_EVENTS = os.getenv("MCP_TRACE_EVENTS", "0") == "1"
+MAX_SPANS = 500  # 单次查询最多记录的片段数
+
+
+class Trace:
+    """一次查询的耗时时间线，片段的开始时间相对于查询开始"""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.started = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, duration: float, parent: Optional[str] = None,
+            span_id: Optional[str] = None, **attrs):
+        if len(self.spans) >= MAX_SPANS:
+            return
+        self.spans.append({
+            "id": span_id or uuid.uuid4().hex[:16],
+            "parent": parent,
+            "name": name,
+            "start": round((start - self.started) * 1000, 2),  # 毫秒
+            "duration": round(duration * 1000, 2),
+            "attrs": attrs
+        })
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration": round((time.monotonic() - self.started) * 1000, 2),
+            "spans": sorted(self.spans, key=lambda span: span["start"])
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str) -> Iterator[Trace]:
+    """在当前上下文（及其中创建的任务）中记录一次查询的时间线"""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record(name: str, start: float, duration: float, labels: Optional[Dict[str, str]] = None, **attrs):
+    """记录一个已经结束的片段：计入/metrics的直方图，有追踪时加入时间线
+
+    跨越yield的片段（如上游流式响应）不适合用span()包裹，在结束时调用本函数。
+    """
+    span_seconds.observe(duration, span=name, **(labels or {}))
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration, parent=_current_span.get(), **(labels or {}), **attrs)
+
+
+class Span:
+    def __init__(self, name: str):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.started = time.monotonic()
+        self.attrs: Dict[str, Any] = {}
+
+    def traceparent(self) -> Optional[str]:
+        """W3C Trace Context格式，传给工具服务器以关联它返回的片段"""
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        return f"00-{trace.trace_id}-{self.span_id}-01"
+
+
+@contextmanager
+def span(name: str, labels: Optional[Dict[str, str]] = None, **attrs) -> Iterator[Span]:
+    """记录一段耗时；labels同时作为直方图标签（取值必须有限，如端点名、工具名）"""
+    current = Span(name)
+    current.attrs.update(attrs)
+    parent = _current_span.get()
+    token = _current_span.set(current.span_id)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.monotonic() - current.started
+        _current_span.reset(token)
+        span_seconds.observe(duration, span=name, **(labels or {}))
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, current.started, duration, parent=parent, span_id=current.span_id,
+                      **(labels or {}), **current.attrs)
+
+
+def attach_remote(result: Any, rpc: Span):
+    """把工具服务器随结果返回的片段（见tools/spans.py）并入当前时间线
+
+    两个进程的时钟不可比较，服务器端的片段按“往返开销两端各占一半”对齐到本地的调用片段中；
+    缓存命中的旧结果带着别的查询的trace_id，不合并。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    rpc_duration = time.monotonic() - rpc.started
+    for item in getattr(result, "content", None) or []:
+        remote = getattr(item, "trace", None)
+        if not isinstance(remote, dict) or trace.trace_id not in str(remote.get("traceparent", "")):
+            continue
+        server_duration = remote.get("duration", 0.0) / 1000
+        offset = rpc.started + max(rpc_duration - server_duration, 0.0) / 2
+        rpc.attrs["transport_overhead_ms"] = round(max(rpc_duration - server_duration, 0.0) * 1000, 2)
+        server_span_id = uuid.uuid4().hex[:16]
+        trace.add("tool.server", offset, server_duration, parent=rpc.span_id, span_id=server_span_id)
+        for remote_span in remote.get("spans", []):
+            trace.add(remote_span["name"], offset + remote_span["offset"] / 1000, remote_span["duration"] / 1000,
+                      parent=server_span_id, **remote_span.get("attrs", {}))
@@ -0,0 +1,74 @@
+# MCP\mcp-client\upstream.py
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()  # 加载环境变量
+
+# 连接池配置（可通过环境变量调整）
+HTTP2_ENABLED = os.getenv("LLM_HTTP2", "1") == "1"
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "90"))
+KEEPALIVE_PING_INTERVAL = float(os.getenv("LLM_KEEPALIVE_PING_INTERVAL", "60"))  # 0表示不保活
+
+# 超时配置（秒）
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))  # 两次收到数据之间的最长间隔
+WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "10"))
+POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))  # 等待空闲连接的最长时间
+FIRST_BYTE_TIMEOUT = float(os.getenv("LLM_FIRST_BYTE_TIMEOUT", "20"))  # 发出请求到收到响应头
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """返回进程内共享的上游HTTP客户端（HTTP/2 + keep-alive连接池）"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                connect=CONNECT_TIMEOUT,
+                read=READ_TIMEOUT,
+                write=WRITE_TIMEOUT,
+                pool=POOL_TIMEOUT
+            )
+        )
+    return _http_client
+
+
+async def _warm_endpoint(endpoint):
+    try:
+        await get_http_client().get(f"{endpoint.base_url}/models", headers=endpoint.headers())
+    except Exception:
+        pass  # 预热失败不影响正常请求
+
+
+async def warmup(endpoints):
+    """预先建立到各上游端点的连接，让首个对话请求不必承担TCP+TLS握手"""
+    await asyncio.gather(*(_warm_endpoint(endpoint) for endpoint in endpoints))
+
+
+async def keep_warm(endpoints):
+    """周期性地发送轻量请求，避免空闲连接因keepalive_expiry被回收"""
+    if KEEPALIVE_PING_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(KEEPALIVE_PING_INTERVAL)
+        await warmup(endpoints)
+
+
+async def aclose_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -1,14 +1,98 @@
 # MCP\mcp-client\web.py
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager, aclosing
+from typing import Optional
 from client import MCPClient
+from pool import ToolPoolManager, tool_servers
+from cache import ToolResultCache
+from sender import EventSender, negotiate_protocol
+from toolcalls import find_log
+from router import get_router
+from scheduler import get_scheduler
+from session_store import SQLiteSessionStore, SessionWriter
+from upstream import warmup, keep_warm, aclose_http_client
+from metrics import registry, gauge, counter_sample, turn_seconds, turns_total
+from tool_index import pruning_stats
+from tracing import start_trace, TRACE_EVENTS
 import uvicorn
 import os
 import asyncio
 import json
+import re
+import time
+import uuid
 
-app = FastAPI()
+# 工具服务器列表（见pool.tool_servers，可通过 MCP_TOOL_SERVERS 覆盖）
+TOOLS_PATHS = tool_servers()
+
+def state_collector(app: FastAPI):
+    """/metrics抓取时读取的状态：活跃会话、工具会话池、结果缓存、调度器、上游端点、工具裁剪、会话写回"""
+
+    def collect():
+        pools = app.state.tool_pool.pools
+        cache = app.state.tool_cache.stats()
+        scheduler = get_scheduler().stats()
+        router = get_router().stats()
+        pruning = pruning_stats.stats()
+        sessions = app.state.sessions
+        return [
+            gauge("mcp_active_sessions", "当前WebSocket会话数", [({}, app.state.active_sessions)]),
+            gauge("mcp_pool_members", "工具服务器会话池中存活的会话数", [
+                ({"server": path}, sum(1 for member in pool.members if member.alive))
+                for path, pool in pools.items()]),
+            gauge("mcp_pool_in_flight", "工具服务器上进行中的调用数", [
+                ({"server": path}, sum(member.in_flight for member in pool.members))
+                for path, pool in pools.items()]),
+            gauge("mcp_pool_started", "工具服务器是否已启动（延迟启动时为0）", [
+                ({"server": path}, int(pool.started)) for path, pool in pools.items()]),
+            counter_sample("mcp_tool_cache_hits_total", "工具结果缓存命中数", [({}, cache["hits"])]),
+            counter_sample("mcp_tool_cache_misses_total", "工具结果缓存未命中数", [({}, cache["misses"])]),
+            gauge("mcp_tool_cache_hit_rate", "工具结果缓存命中率", [({}, cache["hit_rate"])]),
+            gauge("mcp_llm_active", "正在进行的上游请求数", [({}, scheduler["active"])]),
+            gauge("mcp_llm_waiting", "排队等待上游的请求数", [({}, scheduler["waiting"])]),
+            counter_sample("mcp_llm_admitted_total", "调度器放行的请求数", [({}, scheduler["admitted"])]),
+            counter_sample("mcp_llm_queued_total", "曾经排队的请求数", [({}, scheduler["queued"])]),
+            gauge("mcp_endpoint_ttft_seconds", "上游端点首token延迟的EWMA", [
+                ({"endpoint": endpoint["name"]}, endpoint["ttft"]) for endpoint in router["endpoints"]]),
+            gauge("mcp_endpoint_healthy", "上游端点是否可用（冷却中为0）", [
+                ({"endpoint": endpoint["name"]}, int(endpoint["healthy"])) for endpoint in router["endpoints"]]),
+            counter_sample("mcp_hedges_total", "对冲请求数", [({}, router["hedges"])]),
+            counter_sample("mcp_hedge_wins_total", "对冲请求胜出数", [({}, router["hedge_wins"])]),
+            counter_sample("mcp_tool_tokens_saved_total", "工具裁剪节省的工具定义token数",
+                           [({}, pruning["tool_tokens_saved"])]),
+            gauge("mcp_tool_pruning_saved_ratio", "工具裁剪节省的比例", [({}, pruning["saved_ratio"])]),
+            counter_sample("mcp_session_flushes_total", "会话状态批量写回次数", [({}, sessions.flushes)]),
+            counter_sample("mcp_session_writes_total", "写回的会话状态数", [({}, sessions.writes)])
+        ]
+
+    return collect
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用启动时准备共享的工具服务器会话池（有工具清单缓存的服务器推迟到首次调用时启动）和上游连接，关闭时统一释放"""
+    app.state.tool_pool = ToolPoolManager(TOOLS_PATHS)
+    app.state.tool_cache = ToolResultCache()
+    # 会话状态放在共享存储里，多个worker/重连都能接管同一会话
+    app.state.sessions = SessionWriter(SQLiteSessionStore())
+    app.state.sessions.start()
+    app.state.active_sessions = 0
+    collector = registry.register_collector(state_collector(app))
+    endpoints = get_router().endpoints
+    await asyncio.gather(app.state.tool_pool.start(), warmup(endpoints))
+    keep_warm_task = asyncio.create_task(keep_warm(endpoints))
+    try:
+        yield
+    finally:
+        keep_warm_task.cancel()
+        registry.unregister_collector(collector)
+        await app.state.tool_pool.close()
+        app.state.tool_cache.close()
+        await app.state.sessions.close()
+        await aclose_http_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # 静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -18,107 +102,207 @@ async def web_interface():
     """返回网页界面"""
     return FileResponse("index.html")
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    client = MCPClient()
-    tool_calls_info = []
-    
+@app.get("/tool_results/{log_id}/{tool_call_id}")
+async def tool_result(log_id: str, tool_call_id: str):
+    """按需返回某次工具调用的完整结果"""
+    tool_log = find_log(log_id)
+    result = tool_log.full_result(tool_call_id) if tool_log else None
+    if result is None:
+        raise HTTPException(status_code=404, detail="工具调用结果不存在或已过期")
+    if tool_log.is_preview(tool_call_id):
+        # 恢复的会话：完整结果留在了之前的进程中，只能返回预览
+        return PlainTextResponse(result, headers={"X-Result-Preview": "1"})
+    return PlainTextResponse(result)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus格式的指标：各阶段耗时直方图，以及会话池、缓存、调度器等的当前状态"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+def visible_messages(client: MCPClient) -> list:
+    """恢复会话时界面需要重新显示的消息（用户问题和助手的文字回答）"""
+    return [
+        {"role": message["role"], "content": message["content"]}
+        for message in client.conversation_history
+        if message["role"] in ("user", "assistant") and message.get("content")
+    ]
+
+def parse_client_message(message: str) -> dict:
+    """客户端消息：{"type": "query", "data": ..., "trace": true} 或 {"type": "stop"}；非JSON的纯文本按查询处理
+
+    查询消息带 "trace": true 时，这一轮结束后额外发送 {"type": "trace"} 耗时时间线。
+    """
     try:
-        # 连接多个服务
-        tools_paths = [
-            os.path.abspath(os.path.join("..", "tools", "weather.py")),
-            os.path.abspath(os.path.join("..", "tools", "websearch.py"))
-        ]
-        
-        # 加载所有工具
-        all_tools = []
-        for path in tools_paths:
-            try:
-                tools_list = await client.connect_to_server(path)
-                all_tools.extend(tools_list)
-            except Exception as e:
-                error_msg = f"服务连接错误 {path}: {str(e)}"
-                await websocket.send_json({
-                    "type": "system",
-                    "data": error_msg
-                })
-        
-        # 设置客户端的工具列表（JSON可序列化的）
-        client.available_tools = all_tools
-        
-        # 发送初始信息
-        tools_names = [tool['function']['name'] for tool in all_tools]
-        await websocket.send_json({
-            "type": "system",
-            "data": f"系统：当前可用工具：{', '.join(tools_names)}"
-        })
-        
-        async def send_tool_calls_update():
-            """发送更新后的工具调用信息"""
-            await websocket.send_json({
-                "type": "tool_calls_update",
-                "data": tool_calls_info
-            })
-        
-        while True:
-            query = await websocket.receive_text()
-            async for event in client.process_query_stream(query):
+        request = json.loads(message)
+    except json.JSONDecodeError:
+        request = None
+    if isinstance(request, dict) and request.get("type") in ("query", "stop"):
+        return request
+    return {"type": "query", "data": message}
+
+async def run_turn(client: MCPClient, sender: EventSender, query: str, sessions: SessionWriter,
+                   trace_events: bool = TRACE_EVENTS):
+    """处理一次查询并把事件转发给界面；任务被取消时上游流和进行中的工具调用随之取消"""
+    with start_trace("turn") as trace:
+        outcome = "cancelled"
+        try:
+            outcome = await forward_events(client, sender, query)
+            if trace_events:
+                await sender.send({"type": "trace", "data": trace.to_dict()})
+        finally:
+            turn_seconds.observe(time.monotonic() - trace.started)
+            turns_total.inc(outcome=outcome)
+            # 写回在后台批量进行，不占用流式输出路径
+            sessions.mark_dirty(client.session_id, client.session_state)
+
+async def forward_events(client: MCPClient, sender: EventSender, query: str) -> str:
+    """把一次查询的事件转发给界面，返回结果分类（ok/error）"""
+    tool_log = client.tool_calls_history
+    outcome = "ok"
+    try:
+        async with aclosing(client.process_query_stream(query)) as events:
+            async for event in events:
                 event_type = event["type"]
                 event_data = event.get("data", None)
                 
                 # 处理不同类型的事件
                 if event_type == "text_chunk":
-                    await websocket.send_json({
+                    await sender.send({
                         "type": "text_chunk",
                         "data": event_data
                     })
                 elif event_type == "tool_call_start":
-                    # 记录工具调用开始
-                    tool_calls_info.append({
-                        "name": event_data["name"],
-                        "arguments": event_data["args"],
-                        "status": "processing",
-                        "result": ""
-                    })
-                    await send_tool_calls_update()
-                elif event_type == "tool_call_result":
-                    # 更新工具调用结果
-                    if tool_calls_info:
-                        tool_call = tool_calls_info[-1]
-                        tool_call["status"] = "completed"
-                        tool_call["result"] = event_data
-                        await send_tool_calls_update()
-                    
-                    # 发送工具调用的结果
-                    await websocket.send_json({
-                        "type": "tool_call_result",
+                    # 只发送这一个工具调用的增量，不再重发整个列表
+                    await sender.send(tool_log.delta(tool_log.get(event["id"]), "start"))
+                elif event_type == "tool_call_progress":
+                    # 工具的部分输出（如搜索答案边生成边显示），最终结果到达时整体替换
+                    record = tool_log.get(event["id"])
+                    if record is not None:
+                        await sender.send(tool_log.delta(record, "progress", event_data))
+                elif event_type in ("tool_call_result", "tool_call_error"):
+                    # 大结果只发送预览，界面按需从 /tool_results 拉取完整内容
+                    phase = "result" if event_type == "tool_call_result" else "error"
+                    await sender.send(tool_log.delta(tool_log.get(event["id"]), phase))
+                elif event_type == "queued":
+                    # 上游繁忙时的排队位置/预计等待时间
+                    await sender.send({
+                        "type": "queued",
                         "data": event_data
                     })
-                elif event_type == "tool_call_error":
-                    # 更新工具调用错误
-                    if tool_calls_info:
-                        tool_call = tool_calls_info[-1]
-                        tool_call["status"] = "error"
-                        tool_call["result"] = event_data
-                        await send_tool_calls_update()
                 elif event_type == "error":
-                    await websocket.send_json({
+                    outcome = "error"
+                    await sender.send({
                         "type": "error",
                         "data": event_data
                     })
+                elif event_type == "round_end":
+                    # 一轮工具调用结束，后面还有模型的回答；界面据此结束当前消息气泡，但查询仍在进行
+                    await sender.send({"type": "round_end"})
                 elif event_type == "end":
-                    await websocket.send_json({"type": "end"})
-                
+                    await sender.send({"type": "end"})
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        error_msg = f"系统错误: {str(e)}"
-        await websocket.send_json({
+        outcome = "error"
+        await sender.send({
             "type": "error",
-            "data": error_msg
+            "data": f"系统错误: {str(e)}"
+        })
+    return outcome
+
+async def cancel_turn(turn: Optional[asyncio.Task]) -> bool:
+    """取消进行中的查询并等待其清理完毕，返回是否确实中断了一次查询"""
+    if turn is None or turn.done():
+        return False
+    turn.cancel()
+    try:
+        await turn
+    except asyncio.CancelledError:
+        pass
+    return True
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    sender = EventSender(websocket, negotiate_protocol(websocket.query_params.get("proto")))
+    client = MCPClient(tool_cache=websocket.app.state.tool_cache)
+    sessions: SessionWriter = websocket.app.state.sessions
+    turn: Optional[asyncio.Task] = None
+    connected = True
+    websocket.app.state.active_sessions += 1
+    
+    try:
+        # 客户端带着 ?session= 重连时恢复之前的对话，否则开始新会话
+        session_id = websocket.query_params.get("session") or ""
+        state = await sessions.load(session_id) if SESSION_ID_RE.match(session_id) else None
+        if state is None:
+            session_id = uuid.uuid4().hex
+        client.restore_session(session_id, state)
+        await sender.send({
+            "type": "session",
+            "data": {
+                "id": session_id,
+                "resumed": state is not None,
+                "messages": visible_messages(client) if state else [],
+                "tool_calls": client.tool_calls_history.to_list() if state else []
+            }
         })
+        
+
+        # 从共享会话池获取工具，连接时不再启动子进程
+        tool_pool = websocket.app.state.tool_pool
+        for path, error in tool_pool.errors.items():
+            error_msg = f"服务连接错误 {path}: {error}"
+            await sender.send({
+                "type": "system",
+                "data": error_msg
+            })
+        
+        # 设置客户端的工具列表（JSON可序列化的）
+        all_tools = client.use_pool(tool_pool)
+        
+        # 发送初始信息
+        tools_names = [tool['function']['name'] for tool in all_tools]
+        await sender.send({
+            "type": "system",
+            "data": f"系统：当前可用工具：{', '.join(tools_names)}"
+        })
+        
+        # 读端：查询在单独的任务中运行，这里始终能收到停止指令和断开通知
+        while True:
+            request = parse_client_message(await websocket.receive_text())
+            if await cancel_turn(turn):
+                await sender.send({"type": "end", "stopped": True})
+            turn = None
+            if request["type"] == "query" and request.get("data"):
+                turn = asyncio.create_task(run_turn(client, sender, request["data"], sessions,
+                                                    bool(request.get("trace")) or TRACE_EVENTS))
+                
+    except WebSocketDisconnect:
+        connected = False
+    except Exception as e:
+        error_msg = f"系统错误: {str(e)}"
+        try:
+            await sender.send({
+                "type": "error",
+                "data": error_msg
+            })
+        except Exception:
+            pass
     finally:
+        # 断开连接时立即取消上游流和工具调用
+        await cancel_turn(turn)
+        if connected:
+            await sender.close()
+        else:
+            sender.abort()
         await client.cleanup()
-        await websocket.close()
+        websocket.app.state.active_sessions -= 1
+        if connected:
+            await websocket.close()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="localhost", port=8000)
+    # 开启permessage-deflate压缩WebSocket帧
+    uvicorn.run(app, host="localhost", port=8000, ws="websockets", ws_per_message_deflate=True)
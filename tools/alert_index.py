@@ -0,0 +1,102 @@
+# MCP\tools\alert_index.py
+import time
+from collections import defaultdict
+
+CELL_SIZE = 1.0  # 空间索引网格大小（度）
+# 州和属地代码；海区的UGC代码（PZZ530、AMZ250、GMZ830等）前两位不是州，不计入按州索引
+STATE_CODES = frozenset(
+    "AL AK AZ AR CA CO CT DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ NM NY "
+    "NC ND OH OK OR PA RI SC SD TN TX UT VT VA WA WV WI WY DC PR VI GU AS MP".split()
+)
+
+
+def _cell(lat: float, lon: float) -> tuple:
+    return int(lat // CELL_SIZE), int(lon // CELL_SIZE)
+
+
+def _polygons(geometry: dict | None) -> list:
+    """把 GeoJSON Polygon/MultiPolygon 统一成多边形列表，每个多边形是 [外环, 内环...]"""
+    if not geometry:
+        return []
+    if geometry.get("type") == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _in_ring(lat: float, lon: float, ring: list) -> bool:
+    """射线法判断点是否在环内（GeoJSON坐标顺序为 [lon, lat]）"""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _in_polygon(lat: float, lon: float, polygon: list) -> bool:
+    if not polygon or not _in_ring(lat, lon, polygon[0]):
+        return False
+    return not any(_in_ring(lat, lon, hole) for hole in polygon[1:])
+
+
+class AlertIndex:
+    """全国活跃警报的内存索引：州/预报区代码 -> 警报，以及警报多边形的包围盒网格索引"""
+
+    def __init__(self):
+        self.by_state: dict[str, list[dict]] = {}
+        self.by_zone: dict[str, list[dict]] = {}
+        self._cells: dict[tuple, list] = {}  # 网格 -> [(bbox, polygons, feature)]
+        self.updated_at = 0.0
+
+    def rebuild(self, features: list[dict]):
+        """用最新的全国警报重建索引（整体替换，查询方不会看到中间状态）"""
+        by_state = defaultdict(list)
+        by_zone = defaultdict(list)
+        cells = defaultdict(list)
+        for feature in features:
+            # UGC代码的前两位是州代码（例如 CAZ006 -> CA）
+            ugc_codes = feature["properties"].get("geocode", {}).get("UGC", [])
+            for state in {code[:2] for code in ugc_codes} & STATE_CODES:
+                by_state[state].append(feature)
+            for code in ugc_codes:
+                by_zone[code].append(feature)
+
+            polygons = _polygons(feature.get("geometry"))
+            if not polygons:
+                continue
+            lons = [point[0] for polygon in polygons for point in polygon[0]]
+            lats = [point[1] for polygon in polygons for point in polygon[0]]
+            bbox = (min(lats), min(lons), max(lats), max(lons))
+            entry = (bbox, polygons, feature)
+            min_cell, max_cell = _cell(bbox[0], bbox[1]), _cell(bbox[2], bbox[3])
+            for x in range(min_cell[0], max_cell[0] + 1):
+                for y in range(min_cell[1], max_cell[1] + 1):
+                    cells[(x, y)].append(entry)
+
+        self.by_state, self.by_zone, self._cells = dict(by_state), dict(by_zone), dict(cells)
+        self.updated_at = time.time()
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.updated_at <= max_age
+
+    def for_state(self, state: str) -> list[dict]:
+        return self.by_state.get(state.upper(), [])
+
+    def for_point(self, lat: float, lon: float, zones: tuple = ()) -> list[dict]:
+        """命中多边形的警报，加上只按预报区/县发布（没有多边形）且覆盖 zones 的警报"""
+        matched = {}
+        for bbox, polygons, feature in self._cells.get(_cell(lat, lon), []):
+            if not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+                continue
+            if any(_in_polygon(lat, lon, polygon) for polygon in polygons):
+                matched[feature.get("id") or id(feature)] = feature
+        for zone in zones:
+            for feature in self.by_zone.get(zone, []):
+                if not feature.get("geometry"):
+                    matched[feature.get("id") or id(feature)] = feature
+        return list(matched.values())
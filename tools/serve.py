@@ -0,0 +1,38 @@
+# MCP\tools\serve.py
+import argparse
+import os
+
+import uvicorn
+from mcp.server.fastmcp import FastMCP
+
+
+def http_app(mcp: FastMCP):
+    """无状态的streamable-HTTP应用：每个请求独立处理，任意worker进程都能服务任意客户端"""
+    mcp.settings.stateless_http = True
+    return mcp.streamable_http_app()
+
+
+def run(mcp: FastMCP, app_factory: str, default_port: int):
+    """命令行入口：默认stdio（由客户端作为子进程启动），也可以作为常驻的多worker HTTP服务运行
+
+    app_factory是 "模块名:工厂函数"，多worker时uvicorn在每个worker进程中导入它。
+    """
+    parser = argparse.ArgumentParser(description=f"MCP工具服务器 {mcp.name}")
+    parser.add_argument("--transport", choices=["stdio", "streamable-http"], default="stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--workers", type=int, default=1, help="worker进程数（仅streamable-http）")
+    args = parser.parse_args()
+
+    if args.transport == "stdio":
+        mcp.run(transport="stdio")
+        return
+    # 客户端连接 http://host:port/mcp/
+    uvicorn.run(
+        app_factory,
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        app_dir=os.path.dirname(os.path.abspath(__file__))
+    )
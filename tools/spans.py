@@ -0,0 +1,68 @@
+# MCP\tools\spans.py
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from mcp import types
+from mcp.server.lowlevel.server import request_ctx
+
+# 当前工具调用记录的片段；客户端没有请求追踪时为None，span()什么也不做
+_spans: contextvars.ContextVar[list | None] = contextvars.ContextVar("tool_spans", default=None)
+
+
+def _traceparent() -> str | None:
+    """客户端在tools/call请求的_meta中带的traceparent（W3C Trace Context格式）"""
+    try:
+        meta = request_ctx.get().meta
+    except LookupError:
+        return None
+    return getattr(meta, "traceparent", None) if meta else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """记录工具内部的一段耗时（如上游HTTP请求），可以在with块内往返回的dict里补充属性"""
+    spans = _spans.get()
+    started = time.monotonic()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        if spans is not None:
+            spans.append((name, started, time.monotonic() - started, attrs))
+
+
+def traced(fn):
+    """工具函数的装饰器：客户端请求了追踪时，把工具内部的片段随结果返回
+
+    片段放在结果TextContent的额外字段trace里（mcp 1.8.1的TextContent允许额外字段，
+    也没有结构化结果），文本内容不变，不认识这个字段的客户端不受影响。
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        traceparent = _traceparent()
+        if traceparent is None:
+            return await fn(*args, **kwargs)
+        spans = []
+        token = _spans.set(spans)
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        finally:
+            _spans.reset(token)
+        trace = {
+            "traceparent": traceparent,
+            "duration": round((time.monotonic() - started) * 1000, 2),  # 毫秒
+            "spans": [
+                {"name": name, "offset": round((start - started) * 1000, 2),
+                 "duration": round(duration * 1000, 2), "attrs": attrs}
+                for name, start, duration, attrs in spans
+            ]
+        }
+        return [types.TextContent(type="text", text=str(result), trace=trace)]
+
+    return wrapper
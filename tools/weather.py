@@ -1,94 +1,576 @@
 # MCP\tools\weather.py
 from typing import Any
+import asyncio
+import email.utils
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
 import httpx
 from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp.exceptions import ToolError
+from pydantic import BaseModel
+
+from alert_index import AlertIndex
+import serve
+import spans
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """服务器启动时开始后台轮询全国警报，关闭时停止轮询"""
+    start_alert_poller()
+    try:
+        yield
+    finally:
+        await stop_alert_poller()
 
 # 初始化 FastMCP server
-mcp = FastMCP("weather")
+mcp = FastMCP("weather", lifespan=lifespan)
 
 # Constants
 NWS_API_BASE = "https://api.weather.gov"
 USER_AGENT = "weather-app/1.0"
+GRID_CACHE_PATH = os.getenv(
+    "NWS_GRID_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "nws_grid_cache.sqlite3")
+)
+GRID_CACHE_TTL = 30 * 24 * 3600  # 网格映射几乎不变，30天后再重新确认
+RESPONSE_CACHE_SIZE = 256
+BATCH_CONCURRENCY = 8  # 批量工具同时发往 NWS 的请求数
+BATCH_PERIODS = 3  # 批量预报每个位置显示的 periods 数
+ALERT_POLL_INTERVAL = float(os.getenv("NWS_ALERT_POLL_INTERVAL", "60"))  # 全国警报轮询间隔（秒）
+ALERT_INDEX_MAX_AGE = 3 * ALERT_POLL_INTERVAL  # 超过这个时间未更新则回退到直接请求
+MAX_RESULT_BYTES = int(os.getenv("NWS_MAX_RESULT_BYTES", "6000"))  # 单个工具结果的大小上限（字节），超出时减少条目并给出next_offset
+MAX_PAGE_SIZE = 50
+TEXT_FIELD_CHARS = 800  # 描述、指示等长文本字段保留的字符数
+SEVERITY_ORDER = ["Extreme", "Severe", "Moderate", "Minor", "Unknown"]
 
-async def make_nws_request(url: str) -> dict[str, Any] | None:
-    """向 NWS API 发送请求，并进行适当的错误处理。"""
-    headers = {
+# 整个服务器共享的连接池
+http_client = httpx.AsyncClient(
+    headers={
         "User-Agent": USER_AGENT,
         "Accept": "application/geo+json"
+    },
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
+
+batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+# url -> {"data", "etag", "last_modified", "expires_at"}，用于条件请求
+_response_cache: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _expires_at(response: httpx.Response) -> float:
+    """根据Cache-Control max-age或Expires计算响应的新鲜期"""
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    if match:
+        return time.time() + int(match.group(1))
+    expires = response.headers.get("Expires")
+    if expires:
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return 0.0
+
+
+async def make_nws_request(url: str) -> dict[str, Any] | None:
+    """向 NWS API 发送请求，并进行适当的错误处理。
+
+    新鲜期内直接返回缓存；过期后携带ETag/Last-Modified做条件请求，304时复用缓存内容。
+    """
+    cached = _response_cache.get(url)
+    if cached and cached["expires_at"] > time.time():
+        _response_cache.move_to_end(url)
+        return cached["data"]
+
+    headers = {}
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        with spans.span("nws.request", url=url, conditional=bool(headers)) as attrs:
+            response = await http_client.get(url, headers=headers)
+            attrs["status"] = response.status_code
+        if response.status_code == 304 and cached:
+            cached["expires_at"] = _expires_at(response)
+            _response_cache.move_to_end(url)
+            return cached["data"]
+        response.raise_for_status()
+        data = response.json()
+    except Exception:
+        return None
+
+    if response.headers.get("ETag") or response.headers.get("Last-Modified") or _expires_at(response):
+        _response_cache[url] = {
+            "data": data,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires_at": _expires_at(response)
+        }
+        _response_cache.move_to_end(url)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+    return data
+
+
+class GridPointCache:
+    """经纬度（四舍五入到4位小数）到NWS预报网格信息的持久化缓存"""
+
+    def __init__(self, db_path: str):
+        self._memory: dict[tuple, dict] = {}
+        self._lock = threading.Lock()  # 读写都在线程池中进行
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS grid_points ("
+            "lat REAL, lon REAL, forecast TEXT, forecast_zone TEXT, county TEXT, updated_at REAL, "
+            "PRIMARY KEY (lat, lon))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(latitude: float, longitude: float) -> tuple:
+        return round(latitude, 4), round(longitude, 4)
+
+    def get(self, latitude: float, longitude: float) -> dict | None:
+        key = self.key(latitude, longitude)
+        if key not in self._memory:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT forecast, forecast_zone, county, updated_at FROM grid_points WHERE lat = ? AND lon = ?",
+                    key
+                ).fetchone()
+            if row is None:
+                return None
+            self._memory[key] = {"forecast": row[0], "forecast_zone": row[1], "county": row[2], "updated_at": row[3]}
+        entry = self._memory[key]
+        if entry["updated_at"] + GRID_CACHE_TTL < time.time():
+            return None
+        return entry
+
+    def put(self, latitude: float, longitude: float, entry: dict):
+        key = self.key(latitude, longitude)
+        entry = {**entry, "updated_at": time.time()}
+        self._memory[key] = entry
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO grid_points VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, entry["forecast"], entry["forecast_zone"], entry["county"], entry["updated_at"])
+            )
+            self._conn.commit()
+
+
+grid_cache = GridPointCache(GRID_CACHE_PATH)
+
+
+async def get_grid_point(latitude: float, longitude: float, refresh: bool = False) -> dict | None:
+    """获取位置对应的预报网格信息，优先使用持久化缓存"""
+    if not refresh:
+        entry = await asyncio.to_thread(grid_cache.get, latitude, longitude)
+        if entry:
+            return entry
+
+    lat, lon = GridPointCache.key(latitude, longitude)
+    points_data = await make_nws_request(f"{NWS_API_BASE}/points/{lat},{lon}")
+    if not points_data:
+        return None
+    props = points_data["properties"]
+    entry = {
+        "forecast": props["forecast"],
+        # zone/county URL的最后一段是UGC代码（例如 CAZ006、CAC075）
+        "forecast_zone": (props.get("forecastZone") or "").rsplit("/", 1)[-1],
+        "county": (props.get("county") or "").rsplit("/", 1)[-1]
     }
-    async with httpx.AsyncClient() as client:
+    await asyncio.to_thread(grid_cache.put, latitude, longitude, entry)
+    return entry
+
+alert_index = AlertIndex()
+_alert_poller: asyncio.Task | None = None
+
+async def refresh_alert_index() -> bool:
+    """拉取一次全国活跃警报并重建索引（借助条件请求，未变化时只有一次304）"""
+    data = await make_nws_request(f"{NWS_API_BASE}/alerts/active")
+    if not data or "features" not in data:
+        return False
+    alert_index.rebuild(data["features"])
+    return True
+
+async def poll_alerts():
+    while True:
         try:
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            return response.json()
+            await refresh_alert_index()
         except Exception:
-            return None
+            pass  # 单次轮询失败时保留旧索引，过期后查询会回退到直接请求
+        await asyncio.sleep(ALERT_POLL_INTERVAL)
+
+def start_alert_poller():
+    """启动后台轮询（只启动一次）"""
+    global _alert_poller
+    if _alert_poller is None or _alert_poller.done():
+        _alert_poller = asyncio.create_task(poll_alerts())
+
+async def stop_alert_poller():
+    """取消后台轮询并等待其结束"""
+    global _alert_poller
+    poller, _alert_poller = _alert_poller, None
+    if poller is None:
+        return
+    poller.cancel()
+    try:
+        await poller
+    except asyncio.CancelledError:
+        pass
+
+# 警报可选的输出字段；默认只给摘要字段，模型需要时再请求description/instruction全文
+ALERT_FIELDS = {
+    "event": lambda props: props.get("event"),
+    "severity": lambda props: props.get("severity"),
+    "urgency": lambda props: props.get("urgency"),
+    "certainty": lambda props: props.get("certainty"),
+    "area": lambda props: props.get("areaDesc"),
+    "headline": lambda props: props.get("headline"),
+    "onset": lambda props: props.get("onset"),
+    "expires": lambda props: props.get("expires"),
+    "sender": lambda props: props.get("senderName"),
+    "description": lambda props: props.get("description"),
+    "instruction": lambda props: props.get("instruction")
+}
+DEFAULT_ALERT_FIELDS = ["event", "severity", "area", "expires"]
+BRIEF_ALERT_FIELDS = ["event", "severity", "area"]
+
+# 预报period可选的输出字段
+FORECAST_FIELDS = {
+    "name": lambda period: period.get("name"),
+    "start": lambda period: period.get("startTime"),
+    "temperature": lambda period: f"{period.get('temperature')}°{period.get('temperatureUnit')}",
+    "wind": lambda period: f"{period.get('windSpeed')} {period.get('windDirection')}",
+    "precipitation": lambda period: (period.get("probabilityOfPrecipitation") or {}).get("value"),
+    "short": lambda period: period.get("shortForecast"),
+    "detailed": lambda period: period.get("detailedForecast")
+}
+DEFAULT_FORECAST_FIELDS = ["name", "temperature", "wind", "detailed"]
+BRIEF_FORECAST_FIELDS = ["name", "temperature", "wind", "short"]
+
+
+def dumps(data: Any) -> str:
+    """紧凑的JSON文本（mcp 1.8.1没有structuredContent，结构化结果以JSON文本返回）"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def select_fields(fields: list[str] | None, available: dict, default: list[str]) -> list[str]:
+    if not fields:
+        return default
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValueError(f"未知字段: {', '.join(unknown)}；可选字段: {', '.join(available)}")
+    return list(dict.fromkeys(fields))
+
+
+def pick(source: dict, fields: list[str], available: dict, text_chars: int = TEXT_FIELD_CHARS) -> dict:
+    """按字段列表取值，省略空值，长文本截断"""
+    item = {}
+    for field in fields:
+        value = available[field](source)
+        if value is None or value == "":
+            continue
+        if isinstance(value, str) and len(value) > text_chars:
+            value = value[:text_chars] + "…"
+        item[field] = value
+    return item
+
+
+def fit_items(result: dict, key: str, items: list[dict]) -> int:
+    """把尽量多的items放进result[key]，使整个结果不超过MAX_RESULT_BYTES，返回放进去的条数
+
+    result中的其他字段应已就位（数字字段可先放占位值）；第一条本身就超限时缩短其长文本后仍然返回。
+    """
+    budget = MAX_RESULT_BYTES - len(dumps(result).encode()) - len(key) - 32
+    kept = []
+    for item in items:
+        size = len(dumps(item).encode()) + 1
+        if size > budget:
+            if not kept:
+                kept.append({field: value[:200] + "…" if isinstance(value, str) and len(value) > 200 else value
+                             for field, value in item.items()})
+            break
+        kept.append(item)
+        budget -= size
+    result[key] = kept
+    return len(kept)
+
+
+def severity_rank(severity: str | None) -> int:
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else len(SEVERITY_ORDER) - 1
+
+
+def filter_alerts(features: list[dict], severity: str | None) -> list[dict]:
+    """按最低严重性筛选，并按严重性从高到低排序"""
+    if severity:
+        level = severity.strip().capitalize()
+        if level not in SEVERITY_ORDER:
+            raise ValueError(f"未知的严重性: {severity}；可选: {', '.join(SEVERITY_ORDER)}")
+        features = [f for f in features if severity_rank(f["properties"].get("severity")) <= severity_rank(level)]
+    return sorted(features, key=lambda f: severity_rank(f["properties"].get("severity")))
+
+
+def alert_summary(features: list[dict], matched: list[dict]) -> dict:
+    by_severity = Counter(f["properties"].get("severity") or "Unknown" for f in features)
+    events = Counter(f["properties"].get("event") or "Unknown" for f in matched)
+    return {
+        "total": len(features),
+        "matched": len(matched),
+        "by_severity": {level: by_severity[level] for level in SEVERITY_ORDER if by_severity[level]},
+        "events": dict(events.most_common(10))
+    }
+
+
+def alerts_page(features: list[dict], limit: int, offset: int, severity: str | None,
+                fields: list[str] | None) -> str:
+    """摘要在前的分页警报结果：summary（总数、各严重性数量、主要事件）+ 本页警报 + next_offset"""
+    try:
+        selected = select_fields(fields, ALERT_FIELDS, DEFAULT_ALERT_FIELDS)
+        matched = filter_alerts(features, severity)
+    except ValueError as e:
+        raise ToolError(str(e))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    page = [pick(f["properties"], selected, ALERT_FIELDS) for f in matched[offset:offset + limit]]
+    result = {"summary": alert_summary(features, matched), "offset": offset, "returned": 0, "next_offset": None}
+    result["returned"] = fit_items(result, "alerts", page)
+    if offset + result["returned"] < len(matched):
+        result["next_offset"] = offset + result["returned"]
+    return dumps(result)
+
+
+def forecast_summary(periods: list[dict]) -> dict:
+    temperatures = [p["temperature"] for p in periods if isinstance(p.get("temperature"), (int, float))]
+    summary = {"periods": len(periods)}
+    if periods:
+        summary["now"] = f"{periods[0].get('name')}: {periods[0].get('shortForecast')}"
+    if temperatures:
+        unit = periods[0].get("temperatureUnit", "")
+        summary["range"] = f"{min(temperatures)}~{max(temperatures)}°{unit}"
+    return summary
+
+
+async def fetch_alerts(state: str) -> list[dict] | None:
+    """获取某州当前活跃的警报 features，失败时返回 None。
+
+    全国警报索引足够新时直接在本地回答，否则请求该州的警报。
+    """
+    if alert_index.is_fresh(ALERT_INDEX_MAX_AGE):
+        return alert_index.for_state(state)
+    data = await make_nws_request(f"{NWS_API_BASE}/alerts/active/area/{state}")
+    if not data or "features" not in data:
+        return None
+    return data["features"]
+
+async def fetch_forecast_periods(latitude: float, longitude: float) -> list[dict] | str:
+    """获取某个位置的预报 periods，失败时返回错误说明。"""
+    # 首先获取预报网格 endpoint（缓存命中时无需请求 /points）
+    grid = await get_grid_point(latitude, longitude)
+
+    if not grid:
+        return "无法获取此位置的预报数据。"
+
+    forecast_data = await make_nws_request(grid["forecast"])
+    if not forecast_data:
+        # 网格可能已经调整，重新查询一次 /points
+        grid = await get_grid_point(latitude, longitude, refresh=True)
+        forecast_data = await make_nws_request(grid["forecast"]) if grid else None
+
+    if not forecast_data:
+        return "无法获取详细预报。"
+
+    return forecast_data["properties"]["periods"]
 
-def format_alert(feature: dict) -> str:
-    """将警报 feature 格式化为可读的字符串。"""
-    props = feature["properties"]
-    return f"""
-事件: {props.get('event', 'Unknown')}
-区域: {props.get('areaDesc', 'Unknown')}
-严重性: {props.get('severity', 'Unknown')}
-描述: {props.get('description', 'No description available')}
-指示: {props.get('instruction', 'No specific instructions provided')}
-"""
 @mcp.tool()
-async def get_alerts(state: str) -> str:
-    """获取美国州的天气警报。
+@spans.traced
+async def get_alerts(state: str, limit: int = 10, offset: int = 0, severity: str | None = None,
+                     fields: list[str] | None = None) -> str:
+    """获取美国州的天气警报，返回JSON：summary（总数、各严重性数量、主要事件）在前，
+    警报按严重性从高到低排列，next_offset不为null时可以用它作为offset继续翻页。
 
     Args:
         state: 两个字母的美国州代码（例如 CA、NY）
+        limit: 本页最多返回的警报数（1-50）
+        offset: 跳过前面的警报数，用于翻页
+        severity: 最低严重性（Extreme、Severe、Moderate、Minor），只返回不低于它的警报
+        fields: 每条警报返回的字段，默认 event、severity、area、expires；
+            可选 urgency、certainty、headline、onset、sender、description、instruction
     """
-    url = f"{NWS_API_BASE}/alerts/active/area/{state}"
-    data = await make_nws_request(url)
+    features = await fetch_alerts(state.strip().upper())
 
-    if not data or "features" not in data:
-        return "无法获取警报或未找到警报。"
+    if features is None:
+        raise ToolError("无法获取警报。")
+
+    return alerts_page(features, limit, offset, severity, fields)
+
+@mcp.tool()
+@spans.traced
+async def get_forecast(latitude: float, longitude: float, limit: int = 5, offset: int = 0,
+                       fields: list[str] | None = None) -> str:
+    """获取某个位置的天气预报，返回JSON：summary（时段数、当前天气、温度范围）在前，
+    next_offset不为null时可以用它作为offset查看更往后的时段。
 
-    if not data["features"]:
-        return "该州没有活跃的警报。"
+    Args:
+        latitude: 位置的纬度
+        longitude: 位置的经度
+        limit: 本页最多返回的时段数（1-50）
+        offset: 跳过前面的时段数，用于翻页
+        fields: 每个时段返回的字段，默认 name、temperature、wind、detailed；
+            可选 start、precipitation、short
+    """
+    periods = await fetch_forecast_periods(latitude, longitude)
+    if isinstance(periods, str):
+        raise ToolError(periods)
+    try:
+        selected = select_fields(fields, FORECAST_FIELDS, DEFAULT_FORECAST_FIELDS)
+    except ValueError as e:
+        raise ToolError(str(e))
 
-    alerts = [format_alert(feature) for feature in data["features"]]
-    return "\n---\n".join(alerts)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    page = [pick(period, selected, FORECAST_FIELDS) for period in periods[offset:offset + limit]]
+    result = {"summary": forecast_summary(periods), "offset": offset, "returned": 0, "next_offset": None}
+    result["returned"] = fit_items(result, "periods", page)
+    if offset + result["returned"] < len(periods):
+        result["next_offset"] = offset + result["returned"]
+    return dumps(result)
 
 @mcp.tool()
-async def get_forecast(latitude: float, longitude: float) -> str:
-    """获取某个位置的天气预报。
+@spans.traced
+async def get_alerts_for_point(latitude: float, longitude: float, limit: int = 10, offset: int = 0,
+                               severity: str | None = None, fields: list[str] | None = None) -> str:
+    """获取覆盖某个具体位置的天气警报，返回格式与 get_alerts 相同。
 
     Args:
         latitude: 位置的纬度
         longitude: 位置的经度
+        limit: 本页最多返回的警报数（1-50）
+        offset: 跳过前面的警报数，用于翻页
+        severity: 最低严重性（Extreme、Severe、Moderate、Minor）
+        fields: 每条警报返回的字段，可选值见 get_alerts
     """
-    # 首先获取预报网格 endpoint
-    points_url = f"{NWS_API_BASE}/points/{latitude},{longitude}"
-    points_data = await make_nws_request(points_url)
+    if alert_index.is_fresh(ALERT_INDEX_MAX_AGE):
+        # 没有多边形的警报按预报区/县发布，用网格缓存中的区域代码匹配
+        grid = await get_grid_point(latitude, longitude)
+        zones = (grid["forecast_zone"], grid["county"]) if grid else ()
+        features = alert_index.for_point(latitude, longitude, zones)
+    else:
+        lat, lon = GridPointCache.key(latitude, longitude)
+        data = await make_nws_request(f"{NWS_API_BASE}/alerts/active?point={lat},{lon}")
+        if not data or "features" not in data:
+            raise ToolError("无法获取警报。")
+        features = data["features"]
 
-    if not points_data:
-        return "无法获取此位置的预报数据。"
+    return alerts_page(features, limit, offset, severity, fields)
 
-    # 从 points response 中获取预报 URL
-    forecast_url = points_data["properties"]["forecast"]
-    forecast_data = await make_nws_request(forecast_url)
+class Location(BaseModel):
+    """批量预报中的一个位置。"""
+    latitude: float
+    longitude: float
+    name: str | None = None
 
-    if not forecast_data:
-        return "无法获取详细预报。"
+async def _bounded(coro):
+    async with batch_semaphore:
+        return await coro
+
+@mcp.tool()
+@spans.traced
+async def get_forecasts(locations: list[Location], limit: int = BATCH_PERIODS,
+                        fields: list[str] | None = None) -> str:
+    """一次获取多个位置的天气预报（比多次调用 get_forecast 更快），返回JSON，每个位置一项。
 
-    # 将 periods 格式化为可读的预报
-    periods = forecast_data["properties"]["periods"]
-    forecasts = []
-    for period in periods[:5]:  # 仅显示接下来的 5 个 periods
-        forecast = f"""
-{period['name']}:
-温度: {period['temperature']}°{period['temperatureUnit']}
-风: {period['windSpeed']} {period['windDirection']}
-预报: {period['detailedForecast']}
-"""
-        forecasts.append(forecast)
+    Args:
+        locations: 位置列表，每项包含 latitude、longitude，可选 name（例如城市名）
+        limit: 每个位置返回的时段数（1-50）
+        fields: 每个时段返回的字段，默认 name、temperature、wind、short；可选值见 get_forecast
+    """
+    try:
+        selected = select_fields(fields, FORECAST_FIELDS, BRIEF_FORECAST_FIELDS)
+    except ValueError as e:
+        raise ToolError(str(e))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    results = await asyncio.gather(
+        *(_bounded(fetch_forecast_periods(loc.latitude, loc.longitude)) for loc in locations),
+        return_exceptions=True
+    )
+    entries = []
+    for loc, periods in zip(locations, results):
+        entry = {"name": loc.name or f"{loc.latitude},{loc.longitude}"}
+        if isinstance(periods, (Exception, str)):
+            entry["error"] = str(periods)
+        else:
+            entry["summary"] = forecast_summary(periods)
+            entry["periods"] = [pick(period, selected, FORECAST_FIELDS) for period in periods[:limit]]
+        entries.append(entry)
+    failed = sum(1 for entry in entries if "error" in entry)
+    if entries and failed == len(entries):
+        raise ToolError("无法获取任何位置的预报。")
+    result = {"summary": {"locations": len(entries), "failed": failed}}
+    if failed:
+        result["partial"] = True  # 部分位置失败：客户端不缓存这个结果（见mcp-client/cache.py）
+    returned = fit_items(result, "locations", entries)
+    if returned < len(entries):
+        result["omitted"] = [entry["name"] for entry in entries[returned:]]
+    return dumps(result)
+
+@mcp.tool()
+@spans.traced
+async def get_alerts_multi(states: list[str], limit: int = 5, severity: str | None = None,
+                           fields: list[str] | None = None) -> str:
+    """一次获取多个美国州的天气警报摘要（比多次调用 get_alerts 更快），返回JSON，每个州一项。
+    某个州需要更多警报时再对它调用 get_alerts 翻页。
+
+    Args:
+        states: 两个字母的美国州代码列表（例如 ["CA", "NY"]）
+        limit: 每个州最多返回的警报数（1-50）
+        severity: 最低严重性（Extreme、Severe、Moderate、Minor）
+        fields: 每条警报返回的字段，默认 event、severity、area；可选值见 get_alerts
+    """
+    try:
+        selected = select_fields(fields, ALERT_FIELDS, BRIEF_ALERT_FIELDS)
+        filter_alerts([], severity)
+    except ValueError as e:
+        raise ToolError(str(e))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    states = list(dict.fromkeys(state.strip().upper() for state in states))
+    results = await asyncio.gather(*(_bounded(fetch_alerts(state)) for state in states), return_exceptions=True)
+    entries = []
+    for state, features in zip(states, results):
+        if isinstance(features, Exception) or features is None:
+            entries.append({"state": state, "error": "无法获取警报。"})
+            continue
+        matched = filter_alerts(features, severity)
+        entries.append({
+            "state": state,
+            "summary": alert_summary(features, matched),
+            "alerts": [pick(f["properties"], selected, ALERT_FIELDS) for f in matched[:limit]]
+        })
+    failed = sum(1 for entry in entries if "error" in entry)
+    if entries and failed == len(entries):
+        raise ToolError("无法获取警报。")
+    result = {"summary": {"states": len(entries), "failed": failed,
+                          "total": sum(entry.get("summary", {}).get("total", 0) for entry in entries)}}
+    if failed:
+        result["partial"] = True  # 部分州失败：客户端不缓存这个结果（见mcp-client/cache.py）
+    returned = fit_items(result, "states", entries)
+    if returned < len(entries):
+        result["omitted"] = [entry["state"] for entry in entries[returned:]]
+    return dumps(result)
 
-    return "\n---\n".join(forecasts)
+def http_app():
+    """streamable-HTTP服务的应用工厂（见serve.py）"""
+    return serve.http_app(mcp)
 
 if __name__ == "__main__":
-    # 初始化并运行 server
-    mcp.run(transport='stdio')
+    # 初始化并运行 server（默认stdio；--transport streamable-http --workers N 作为常驻服务）
+    serve.run(mcp, "weather:http_app", default_port=8101)
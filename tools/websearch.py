@@ -1,10 +1,19 @@
 # tools\websearch.py
-from typing import Any
+from typing import Any, Awaitable, Callable
+import asyncio
 import httpx
 import os
 import json
-from mcp.server.fastmcp import FastMCP
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from mcp import types
+from mcp.server.fastmcp import Context, FastMCP
+from mcp.server.fastmcp.exceptions import ToolError
 from dotenv import load_dotenv
+import serve
+import spans
 
 # 加载环境变量
 load_dotenv()
@@ -12,6 +21,8 @@ BAIDU_API_KEY = os.getenv("BAIDU_API_KEY")
 
 # 初始化 FastMCP server
 mcp = FastMCP("websearch")
+# stdio模式下stdout是MCP协议通道，日志只能写到stderr（FastMCP已把logging配置到stderr）
+logger = logging.getLogger("websearch")
 
 # 百度Copilot引擎配置
 COPILOT_API_URL = "https://appbuilder.baidu.com/rpc/2.0/cloud_hub/v1/ai_engine/copilot_engine/service/v1/baidu_search_rag/general"
@@ -21,9 +32,52 @@ HEADERS = {
     # 'Authorization': f'Bearer bce-v3/ALTAK-AhC6fmPq0j9Z4msHfEXPO/eebf22afbd4345d8dca35f04ef13a4e93e40adf9'
 }
 
-async def make_copilot_request(query: str) -> dict[str, Any] | None:
-    """向百度Copilot引擎发送请求"""
-    payload = {
+# 流式模式：上游边生成边返回，部分答案作为progress通知转发给客户端
+COPILOT_STREAM = os.getenv("COPILOT_STREAM", "1") == "1"
+
+# 搜索结果缓存配置
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "256"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+
+# 整个服务器共享的连接池
+http_client = httpx.AsyncClient(
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
+
+# 规范化查询 -> (过期时间, 格式化结果)
+_search_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+# 规范化查询 -> 正在进行的上游请求
+_in_flight: dict[str, "SearchStream"] = {}
+
+
+class SearchStream:
+    """一次进行中的上游搜索：累积已生成的答案，并转发给所有等待同一查询的调用"""
+
+    def __init__(self):
+        self.text = ""
+        self.listeners: list[Callable[[str], Awaitable[None]]] = []
+        self.task: asyncio.Task | None = None
+
+    async def emit(self, delta: str):
+        self.text += delta
+        for listener in list(self.listeners):
+            try:
+                await listener(delta)
+            except Exception:
+                self.listeners.remove(listener)  # 客户端已断开，不影响其他等待者
+
+def normalize_query(query: str) -> str:
+    """规范化查询：全角转半角、忽略大小写、去掉标点符号、合并空白"""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = "".join(
+        " " if unicodedata.category(ch)[0] in "PSZ" else ch
+        for ch in query
+    )
+    return " ".join(query.split())
+
+def copilot_payload(query: str) -> dict[str, Any]:
+    return {
         "model": "ERNIE-4.0-8K",
         "message": [
             {
@@ -39,72 +93,191 @@ async def make_copilot_request(query: str) -> dict[str, Any] | None:
         "enable_instruction_enhance": False,
         "search_rearrange": True
     }
+
+async def make_copilot_request(query: str) -> dict[str, Any] | None:
+    """向百度Copilot引擎发送请求"""
+    payload = copilot_payload(query)
     
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.post(
-                COPILOT_API_URL,
-                json=payload,
-                headers=HEADERS
-            )
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            print(f"API错误: {e.response.status_code} - {e.response.text}")
-            return None
-        except Exception as e:
-            print(f"请求异常: {str(e)}")
-            return None
+    try:
+        response = await http_client.post(
+            COPILOT_API_URL,
+            json=payload,
+            headers=HEADERS
+        )
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        logger.warning("API错误: %s - %s", e.response.status_code, e.response.text)
+        return None
+    except Exception as e:
+        logger.warning("请求异常: %s", e)
+        return None
+
+def extract_content(response: dict) -> str:
+    """从响应（或流式事件）中取出答案文本：answer_message.content 或 result.response[0].content"""
+    content = response.get("answer_message", {}).get("content", "")
+    if not content and "result" in response and "response" in response["result"]:
+        responses = response["result"]["response"]
+        if responses and "content" in responses[0]:
+            content = responses[0]["content"]
+    return content or ""
+
+async def make_copilot_stream_request(query: str, on_delta: Callable[[str], Awaitable[None]]) -> dict[str, Any] | None:
+    """以流式模式请求百度Copilot引擎，每收到一段新答案调用on_delta，返回与非流式相同结构的完整响应"""
+    payload = copilot_payload(query)
+    payload["stream"] = True
+    text = ""
+    try:
+        with spans.span("copilot.request", stream=True) as attrs:
+            async with http_client.stream("POST", COPILOT_API_URL, json=payload, headers=HEADERS) as response:
+                attrs["status"] = response.status_code
+                response.raise_for_status()
+                if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                    # 上游没有按流式返回：当作普通响应处理
+                    return json.loads(await response.aread())
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if not data or data == "[DONE]":
+                        continue
+                    try:
+                        event = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    if "error" in event:
+                        return event
+                    content = extract_content(event)
+                    if not content:
+                        continue
+                    # 兼容两种流式格式：每个事件是新增部分，或是到目前为止的完整答案
+                    delta = content[len(text):] if content.startswith(text) else content
+                    text = text + delta
+                    if delta:
+                        await on_delta(delta)
+        return {"answer_message": {"content": text}}
+    except httpx.HTTPStatusError as e:
+        logger.warning("API错误: %s", e.response.status_code)
+        return None
+    except Exception as e:
+        logger.warning("请求异常: %s", e)
+        return None
 
 def format_copilot_response(response: dict) -> str:
     """优化解析百度Copilot引擎返回结果"""
     try:
-        # 深度检查结果结构
-        answer_message = response.get("answer_message", {})
-        content = answer_message.get("content", "")
+        # 深度检查结果结构，尝试提取主要内容
+        content = extract_content(response)
         
-        # 尝试提取主要内容
+        # 最后尝试直接提取文本
         if not content:
-            # 检查其他可能的内容路径
-            if "result" in response and "response" in response["result"]:
-                responses = response["result"]["response"]
-                if responses and "content" in responses[0]:
-                    content = responses[0]["content"]
-            
-            # 最后尝试直接提取文本
-            if not content:
-                content = response.get("text", "") or json.dumps(response, ensure_ascii=False)
+            content = response.get("text", "") or json.dumps(response, ensure_ascii=False)
         
         # 精简内容 - 删除多余的引用标记和JSON结构
         content = content.replace('[ref_1]', '').replace('[ref_3]', '')
         return content.strip() or "未找到有效内容"
     
     except (KeyError, IndexError, TypeError) as e:
-        return f"解析响应时出错: {str(e)}"
+        raise ValueError(f"解析响应时出错: {str(e)}")
 
-@mcp.tool()
-async def web_search(query: str) -> str:
-    """使用百度Copilot引擎获取网络资料
-    
-    Args:
-        query: 搜索查询内容
-    """
-    # 调用Copilot API
-    response = await make_copilot_request(query)
+async def search(query: str, stream: SearchStream) -> tuple[bool, str]:
+    """调用Copilot API并格式化结果，返回 (是否成功, 结果文本)；流式模式下部分答案经stream转发"""
+    if COPILOT_STREAM:
+        response = await make_copilot_stream_request(query, stream.emit)
+    else:
+        response = await make_copilot_request(query)
     
     if not response:
-        return "无法获取搜索结果，请稍后重试"
+        return False, "无法获取搜索结果，请稍后重试"
     
     # 检查API错误
     if "error" in response:
         error_msg = response.get("error", "未知错误")
-        return f"API错误: {error_msg}"
+        return False, f"API错误: {error_msg}"
     
     # 格式化结果
-    result = format_copilot_response(response)
-    print("搜索结果:", result)  # 添加打印语句以检查结果
+    try:
+        result = format_copilot_response(response)
+    except ValueError as e:
+        return False, str(e)
+    return True, result
+
+async def search_and_cache(key: str, query: str, stream: SearchStream) -> str:
+    """失败时抛出ToolError：FastMCP把它作为isError结果返回，客户端的结果缓存不会保存失败"""
+    ok, result = await search(query, stream)
+    if not ok:
+        raise ToolError(result)
+    _search_cache[key] = (time.time() + SEARCH_CACHE_TTL, result)
+    _search_cache.move_to_end(key)
+    while len(_search_cache) > SEARCH_CACHE_SIZE:
+        _search_cache.popitem(last=False)
     return result
 
+def _search_done(key: str, task: asyncio.Task):
+    _in_flight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # 所有等待者都已离开时，避免“exception was never retrieved”警告
+
+def progress_listener(ctx: Context) -> Callable[[str], Awaitable[None]] | None:
+    """客户端在请求中带了progressToken时，返回把部分答案作为progress通知发回的函数
+
+    通知的message字段携带新增的答案文本，progress为目前累计的字符数。
+    """
+    meta = ctx.request_context.meta
+    token = meta.progressToken if meta else None
+    if token is None:
+        return None
+    sent = 0
+
+    async def listener(delta: str):
+        nonlocal sent
+        sent += len(delta)
+        notification = types.ProgressNotification(
+            method="notifications/progress",
+            params=types.ProgressNotificationParams(progressToken=token, progress=sent, message=delta)
+        )
+        await ctx.request_context.session.send_notification(
+            types.ServerNotification(notification), related_request_id=ctx.request_id)
+
+    return listener
+
+@mcp.tool()
+@spans.traced
+async def web_search(query: str, ctx: Context) -> str:
+    """使用百度Copilot引擎搜索网络资料（新闻、百科等实时信息）
+    
+    Args:
+        query: 搜索查询内容
+    """
+    key = normalize_query(query) or query
+    
+    cached = _search_cache.get(key)
+    if cached and cached[0] > time.time():
+        _search_cache.move_to_end(key)
+        return cached[1]
+    
+    # 相同的查询正在进行时直接等待它的结果，不重复请求上游；后加入的调用先补发已生成的部分
+    listener = progress_listener(ctx)
+    stream = _in_flight.get(key)
+    if stream is None:
+        stream = SearchStream()
+        stream.task = asyncio.create_task(search_and_cache(key, query, stream))
+        _in_flight[key] = stream
+        stream.task.add_done_callback(lambda task: _search_done(key, task))
+    elif listener is not None and stream.text:
+        await listener(stream.text)
+    if listener is not None:
+        stream.listeners.append(listener)
+    try:
+        return await asyncio.shield(stream.task)
+    finally:
+        if listener in stream.listeners:
+            stream.listeners.remove(listener)
+
+def http_app():
+    """streamable-HTTP服务的应用工厂（见serve.py）"""
+    return serve.http_app(mcp)
+
 if __name__ == "__main__":
-    # 初始化并运行 server
-    mcp.run(transport='stdio')
\ No newline at end of file
+    # 初始化并运行 server（默认stdio；--transport streamable-http --workers N 作为常驻服务）
+    serve.run(mcp, "websearch:http_app", default_port=8102)
\ No newline at end of file